@@ -12,9 +12,19 @@ from rasa_sdk.executor import CollectingDispatcher
 from rasa_sdk.forms import REQUESTED_SLOT
 from rasa_sdk.types import DomainDict
 
-from actions.elastic import search_model, search_manufacturer
-from actions.util import create_incident_report, is_valid_os_name, match_os_version, match_app_version, ios, OS_IOS, \
-    find_fuzzy_match, OS_ANDROID, VENDOR_APPLE
+from actions.config import get_settings
+from actions.device_index import DeviceRecord
+from actions.form_plans import get_form_plans
+from actions.fuzzy import fuzzy_index
+from actions.incident_store import join_values, store_incident
+from actions.logs import CATALOGUE, SLOTS
+from actions.lookup_context import LookupContext, search_manufacturer, search_model, turn_lookups
+from actions.metrics import CONFIRMATIONS, instrumented
+from actions.resilience import latency_budget
+from actions.tracing import span
+from actions.tracker_index import confidence_index
+from actions.util import incident_fields, send_incident_async, parse_versions, match_os_version, match_app_version, \
+    ios, OS_IOS, find_fuzzy_match, OS_ANDROID, VENDOR_APPLE
 
 logger = logging.getLogger(__name__)
 
@@ -37,28 +47,7 @@ SLOT_CONFIRM_REQ = "confirm_required"
 
 SLOT_VALUE_WEB = "web"
 
-form_slots_required = [SLOT_PROBLEM_DESCR, SLOT_REPRODUCE, SLOT_MODEL, SLOT_PLATFORM, SLOT_VENDOR, SLOT_OS_NAME,
-                       SLOT_OS_VERSION, SLOT_APP_VERSION]
-form_slots_stream_interruptions = form_slots_required + [SLOT_VIDEO_CONTENT_TYPE, SLOT_VIDEO_CONTENT_ID,
-                                                         SLOT_CONNECTIVITY]
-form_slots_synchronisation = form_slots_required + [SLOT_VIDEO_CONTENT_TYPE, SLOT_VIDEO_CONTENT_ID, SLOT_INTERRUPTIONS,
-                                                    SLOT_CONNECTIVITY]
-form_slots_playback = form_slots_required + [SLOT_VIDEO_CONTENT_TYPE, SLOT_VIDEO_CONTENT_ID, SLOT_INTERRUPTIONS,
-                                             SLOT_CONNECTIVITY, SLOT_ERROR_MSG]
-form_slots_offline = [SLOT_INTERRUPTIONS, SLOT_VIDEO_CONTENT_ID]
-
-
-def filter_slots(issue_type, slots: List[Text]):
-    if issue_type == 'stream_interrupt':
-        slots = form_slots_stream_interruptions
-    if issue_type == 'synchronisation':
-        slots = form_slots_synchronisation
-    if issue_type == 'playback':
-        slots = form_slots_playback
-    if issue_type == 'offline':
-        slots = form_slots_offline
-
-    return slots
+GENERIC_MODEL_NAMES = ["phone", "tablet", "tv"]
 
 
 def unique(values):
@@ -74,12 +63,7 @@ def get_confirm_slot(tracker: Tracker):
 
 
 def get_confidence_for_slot_value(tracker: Tracker, entity_name):
-    for event in reversed(tracker.events):
-        if event["event"] == "user":
-            for entity in event["parse_data"]["entities"]:
-                if entity["entity"] == entity_name:
-                    return entity.get("confidence_entity", 1)
-    return 1
+    return confidence_index(tracker).confidence(entity_name)
 
 
 def list_slot_to_list(slot, should_filter: bool = True):
@@ -93,34 +77,49 @@ def list_slot_to_list(slot, should_filter: bool = True):
         return slot.copy()
 
 
+def prefetch_lookups(lookups: LookupContext, tracker: Tracker):
+    """Starts the catalogue lookups the validators will make for the slots extracted in this turn."""
+    with span("tracker.slots_to_validate", events=len(tracker.events)):
+        slots = tracker.slots_to_validate()
+
+    models = list_slot_to_list(slots.get(SLOT_MODEL))
+    if len(models) == 1 and models[0] and models[0].lower() not in GENERIC_MODEL_NAMES:
+        # Same condition as in validate_model_name, low confidence values are confirmed before they are looked up
+        if tracker.get_slot(REQUESTED_SLOT) == SLOT_MODEL or \
+                get_confidence_for_slot_value(tracker, SLOT_MODEL) >= 0.9:
+            lookups.prefetch_model(models[0])
+
+    vendors = list_slot_to_list(slots.get(SLOT_VENDOR))
+    if len(vendors) == 1 and vendors[0]:
+        lookups.prefetch_manufacturer(vendors[0])
+
+
+@instrumented
 class ValidatePlaybackIssueForm(FormValidationAction):
 
     def name(self) -> Text:
         return "validate_form_issue_playback"
 
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker,
+                  domain: DomainDict) -> List[Dict[Text, Any]]:
+        with latency_budget(get_settings().webhook_latency_budget), turn_lookups() as lookups:
+            prefetch_lookups(lookups, tracker)
+            return await super().run(dispatcher, tracker, domain)
+
     async def required_slots(self, slots_mapped_in_domain: List[Text], dispatcher: CollectingDispatcher,
                              tracker: Tracker, domain: DomainDict) -> List[Text]:
-        logger.info("Checking required slots")
         slots = await super().required_slots(slots_mapped_in_domain, dispatcher, tracker, domain)
-        slots = filter_slots(tracker.get_slot(SLOT_ISSUE_TYPE), slots) + ['email_contact']
-
-        if tracker.get_slot(SLOT_PLATFORM) == SLOT_VALUE_WEB:
-            slots.remove(SLOT_APP_VERSION)
-            slots.remove(SLOT_OS_NAME)
-            slots.remove(SLOT_OS_VERSION)
-            slots.remove(SLOT_VENDOR)
 
-        # If we have multiple matches for a slot that should be single we add a confirm slot to fire a
-        # custom AskForConfirmation Action.
+        # If we have multiple matches for a slot that should be single the plan starts with the confirm slot to fire
+        # a custom AskForConfirmation Action.
         slot_confirm_required = tracker.get_slot(SLOT_CONFIRM_REQ)
         if slot_confirm_required:
-            logger.info("Required Slots: Confirmation required for %s", slot_confirm_required)
-            logger.info("Inserting confirm_slot")
-            slots.insert(0, SLOT_CONFIRM)
+            logger.debug("Confirmation required for %s", slot_confirm_required, extra=SLOTS)
 
-        logger.info(f"Required slots are {slots}")
-
-        return unique(slots)
+        is_web = tracker.get_slot(SLOT_PLATFORM) == SLOT_VALUE_WEB
+        plan = get_form_plans().plan(tracker.get_slot(SLOT_ISSUE_TYPE), is_web, bool(slot_confirm_required), slots)
+        logger.debug("Required slots are %s", plan, extra=SLOTS)
+        return list(plan)
 
     async def extract_confirm_slot(
             self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: DomainDict
@@ -143,7 +142,7 @@ class ValidatePlaybackIssueForm(FormValidationAction):
             return {SLOT_MODEL: slot_value, SLOT_CONFIRM: None, SLOT_CONFIRM_REQ: slot_confirm_required}
 
         slot_value = slot_value[0]
-        if slot_value.lower() in ["phone", "tablet", "tv"]:
+        if slot_value.lower() in GENERIC_MODEL_NAMES:
             dispatcher.utter_message(
                 text=f"{slot_value} ist etwas zu generisch. Ich benötige die genaue Bezeichnung...")
             return {SLOT_MODEL: None}
@@ -154,11 +153,11 @@ class ValidatePlaybackIssueForm(FormValidationAction):
         if tracker.get_slot(REQUESTED_SLOT) != SLOT_MODEL and slot_confidence < 0.9:
             slot_confirm_required = get_confirm_slot(tracker)
             slot_confirm_required.append(SLOT_MODEL)
-            logger.info("Confirmation necessary for app version: %s", slot_confirm_required)
+            logger.debug("Confirmation necessary for model name: %s", slot_confirm_required, extra=SLOTS)
             return {SLOT_MODEL: slot_value, SLOT_CONFIRM: None, SLOT_CONFIRM_REQ: slot_confirm_required}
 
-        elastic_resp = search_model(slot_value)
-        hit = elastic_resp.get("hit", dict())
+        elastic_resp = await search_model(slot_value)
+        hit = elastic_resp.get("hit") or DeviceRecord()
         hit_model = hit.get("Model Name", "").strip()
         sugg = elastic_resp.get("suggestion", None)
 
@@ -173,37 +172,30 @@ class ValidatePlaybackIssueForm(FormValidationAction):
                 platform = SLOT_VALUE_WEB  # There is no desktop application only web
                 slot_value = None  # Ask for the model again (this time browser name), TODO introduce specific slot
 
-            is_android = hit.get("Android SDK Versions", None)
-            if is_android:
+            if hit.is_android:
                 os_name = OS_ANDROID
             manufacturer = hit.get("Manufacturer", manufacturer)
             if manufacturer and manufacturer.lower() == VENDOR_APPLE:
                 os_name = OS_IOS
         else:
-            logger.info("Not prefilling from model name.")
-            logger.info("Hit %s", hit)
-            logger.info("Sugg %s", sugg)
+            logger.debug("Not prefilling from model name %s, hit %s, suggestion %s", slot_value, hit, sugg,
+                         extra=CATALOGUE)
 
             # Quick fix to identify apple devices
-            for token in slot_value.split():
-                if find_fuzzy_match(token, ios):
-                    manufacturer = VENDOR_APPLE
-                    os_name = OS_IOS
+            if fuzzy_index(ios).match_any(slot_value.split()):
+                manufacturer = VENDOR_APPLE
+                os_name = OS_IOS
 
         result = {SLOT_MODEL: slot_value, SLOT_PLATFORM: platform, SLOT_OS_NAME: os_name, SLOT_VENDOR: manufacturer}
-        logger.info("Setting slots: %s", result)
+        logger.debug("Setting slots: %s", result, extra=SLOTS)
         return result
 
     async def validate_os_name(
             self, slot_value: Any, dispatcher: CollectingDispatcher, tracker: Tracker, domain: DomainDict
     ) -> Dict[Text, Any]:
-        values = list_slot_to_list(slot_value)
-        valid_values = []
-
-        for value in values:
-            value = value.lower()  # Rasa matches the string in conditional utterances case sensitive
-            if is_valid_os_name(value):
-                valid_values.append(value)
+        # Rasa matches the string in conditional utterances case sensitive
+        values = [value.lower() for value in list_slot_to_list(slot_value)]
+        valid_values = parse_versions(values).os_names
 
         if len(valid_values) == 0:
             return {SLOT_OS_NAME: None}
@@ -237,9 +229,8 @@ class ValidatePlaybackIssueForm(FormValidationAction):
     async def validate_app_version(
             self, slot_value: Any, dispatcher: CollectingDispatcher, tracker: Tracker, domain: DomainDict
     ) -> Dict[Text, Any]:
-        logger.info("Validating app version... Value %s", slot_value)
         versions = match_app_version(slot_value)
-        logger.info("Candidates are %s", versions)
+        logger.debug("App version candidates of %s are %s", slot_value, versions, extra=SLOTS)
 
         if not versions:
             dispatcher.utter_message(response="utter_validate_app_version")
@@ -248,7 +239,7 @@ class ValidatePlaybackIssueForm(FormValidationAction):
         if len(versions) > 1:
             slot_confirm_required = get_confirm_slot(tracker)
             slot_confirm_required.append(SLOT_APP_VERSION)
-            logger.info("Confirmation necessary for app version: %s", slot_confirm_required)
+            logger.debug("Confirmation necessary for app version: %s", slot_confirm_required, extra=SLOTS)
             return {SLOT_APP_VERSION: versions, SLOT_CONFIRM: None, SLOT_CONFIRM_REQ: slot_confirm_required}
 
         return {SLOT_APP_VERSION: versions}
@@ -262,18 +253,17 @@ class ValidatePlaybackIssueForm(FormValidationAction):
         if len(slot_value) > 1:
             slot_confirm_required = get_confirm_slot(tracker)
             slot_confirm_required.append(SLOT_VENDOR)
-            logger.info("Confirmation necessary for vendor: %s", slot_confirm_required)
+            logger.debug("Confirmation necessary for vendor: %s", slot_confirm_required, extra=SLOTS)
             return {SLOT_VENDOR: slot_value, SLOT_CONFIRM: None, SLOT_CONFIRM_REQ: slot_confirm_required}
 
         manufacturer = next(iter(slot_value), None)
-        elastic_resp = search_manufacturer(manufacturer)
-        hit = elastic_resp.get("hit", dict())
+        elastic_resp = await search_manufacturer(manufacturer)
+        hit = elastic_resp.get("hit") or DeviceRecord()
         hit_manufacturer = hit.get("Manufacturer", "").strip()
 
         # Check if we find the manufacturer in our knowledge base
         if manufacturer and hit_manufacturer.lower() == manufacturer.lower():
-            is_android = hit.get("Android SDK Versions", None)
-            if is_android:
+            if hit.is_android:
                 slots[SLOT_OS_NAME] = OS_ANDROID
             manufacturer = hit.get("Manufacturer", manufacturer)
             if manufacturer and manufacturer.lower() == VENDOR_APPLE:
@@ -288,6 +278,7 @@ class ValidatePlaybackIssueForm(FormValidationAction):
         return slots
 
 
+@instrumented
 class AskForConfirmation(Action):
     def name(self) -> Text:
         return "action_ask_" + SLOT_CONFIRM
@@ -298,6 +289,7 @@ class AskForConfirmation(Action):
         if slot_confirm_required:
             item = list(OrderedDict.fromkeys(slot_confirm_required))[0]
             slot_confirm_required.remove(item)
+            CONFIRMATIONS.inc(slot=item)
 
             # 1. Detected multiple application version - Asking confirmation
             if item == SLOT_APP_VERSION:
@@ -339,6 +331,7 @@ class AskForConfirmation(Action):
         return []
 
 
+@instrumented
 class SubmitIncidentAction(Action):
     affirm_intents = ['confirm', 'thankyou']
     deny_intents = ['deny', 'cancel']
@@ -351,7 +344,7 @@ class SubmitIncidentAction(Action):
 
         last_intent = tracker.latest_message['intent'].get('name')
         if last_intent in self.affirm_intents:
-            response = create_incident_report(
+            slots = dict(
                 problem=tracker.get_slot(SLOT_PROBLEM_DESCR),
                 expected=tracker.get_slot("b_expected_behavior"),
                 steps=tracker.get_slot(SLOT_REPRODUCE),
@@ -368,7 +361,18 @@ class SubmitIncidentAction(Action):
                 error_msg=tracker.get_slot(SLOT_ERROR_MSG),
                 email=tracker.get_slot("email_contact")
             )
+            fields = incident_fields(**slots)
+            # The spool and its Airtable clients are only needed once a report is submitted
+            from actions.dedup import submit_deduplicated
+
+            try:
+                response = await submit_deduplicated(fields)
+            except OSError as err:
+                # Without a writable spool we can still hand the report to Airtable directly
+                logger.error("Could not spool incident, submitting directly: %s", err)
+                response = await send_incident_async(fields)
             if response:
+                await store_incident(incident_fields(**{name: join_values(value) for name, value in slots.items()}))
                 dispatcher.utter_message(response="utter_incident_submit_success")
                 dispatcher.utter_message(response="utter_do_survey")
                 return [AllSlotsReset()]
@@ -382,6 +386,7 @@ class SubmitIncidentAction(Action):
             return [AllSlotsReset()]
 
 
+@instrumented
 class ActionExplainRequestSlot(Action):
 
     def name(self) -> Text:
@@ -403,6 +408,7 @@ class ActionExplainRequestSlot(Action):
             return []
 
 
+@instrumented
 class ActionHelpRequestSlot(Action):
 
     def name(self) -> Text:
@@ -424,6 +430,7 @@ class ActionHelpRequestSlot(Action):
             return []
 
 
+@instrumented
 class ActionSetIncidentTypeSlot(Action):
     def name(self) -> Text:
         return "action_set_incident_type_slot"
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Sends the bodies of several searches in one request and returns one raw response per body, in order
+MultiSearch = Callable[[List[Dict[str, Any]]], Awaitable[List[Dict[str, Any]]]]
+
+
+class SearchFailed(Exception):
+    """A single search of a multi search request failed, the others may still have succeeded."""
+
+    def __init__(self, error: Any):
+        super().__init__(error)
+        self.error = error
+
+
+class SearchBatcher:
+    """Coalesces searches of concurrent webhook calls into multi search requests.
+
+    Searches submitted within `window` seconds of the first one are sent together, at most `max_batch` per request.
+    A search with the same key as one that is waiting or in flight is not sent again but shares its response.
+    """
+
+    def __init__(self, multi_search: MultiSearch, window: float = 0.005, max_batch: int = 50):
+        self.multi_search = multi_search
+        self.window = window
+        self.max_batch = max_batch
+        self.requests = 0
+        self.searches = 0
+        self.coalesced = 0
+        self._pending: List[Tuple[Hashable, Dict[str, Any]]] = []
+        self._futures: Dict[Hashable, "asyncio.Future[Dict[str, Any]]"] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+
+    async def submit(self, key: Hashable, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Returns the raw response of the search `body`, searches with equal `key` must have equal bodies."""
+        future = self._futures.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._futures[key] = future
+            self._pending.append((key, body))
+            if len(self._pending) >= self.max_batch:
+                self.flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self.flush)
+        else:
+            self.coalesced += 1
+        # A caller giving up, e.g. when its latency budget is spent, must not cancel the search for the others
+        return await asyncio.shield(future)
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.get_running_loop().create_task(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: List[Tuple[Hashable, Dict[str, Any]]]):
+        self.requests += 1
+        self.searches += len(batch)
+        try:
+            responses = await self.multi_search([body for _, body in batch])
+        except asyncio.CancelledError:
+            for key, _ in batch:
+                self._futures.pop(key).cancel()
+            raise
+        except Exception as err:
+            for key, _ in batch:
+                self._resolve(key, error=err)
+            return
+
+        if len(responses) != len(batch):
+            logger.error("Multi search returned %s responses for %s searches", len(responses), len(batch))
+        for index, (key, _) in enumerate(batch):
+            response = responses[index] if index < len(responses) else {"error": "missing response"}
+            if "error" in response:
+                self._resolve(key, error=SearchFailed(response["error"]))
+            else:
+                self._resolve(key, response=response)
+
+    def _resolve(self, key: Hashable, response: Optional[Dict[str, Any]] = None, error: Optional[Exception] = None):
+        future = self._futures.pop(key)
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(response)
+
+    async def close(self):
+        """Sends the waiting searches and waits for all requests in flight."""
+        self.flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
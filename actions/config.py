@@ -0,0 +1,131 @@
+import os
+import tempfile
+from typing import Mapping, Optional, Text
+
+from dotenv import load_dotenv
+
+
+_project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Settings:
+    """Configuration of the action server, read from the environment (and a `.env` file) on first use."""
+
+    def __init__(self, environ: Mapping[Text, Text]):
+        self.elastic_host = environ.get('ELASTIC_HOST')
+        self.elastic_admin = environ.get('ELASTIC_ADMIN')
+        self.elastic_pswd = environ.get('ELASTIC_PSWD')
+        # Alias (or index) of the device catalogue, moved to a new index by `python -m actions.ingest`
+        self.elastic_index = environ.get('ELASTIC_INDEX', 'supported_devices_v2')
+        # Snapshot of the device index used when running without a cluster ("local") and as fallback when the
+        # cluster is down
+        self.device_index_path = environ.get('DEVICE_INDEX_PATH')
+        self.elastic_mode = environ.get('ELASTIC_MODE', 'remote' if self.elastic_host else 'local')
+        self.elastic_retries = int(environ.get('ELASTIC_RETRIES', 3))
+        self.elastic_backoff_base = float(environ.get('ELASTIC_BACKOFF_BASE', 0.1))
+        self.elastic_backoff_max = float(environ.get('ELASTIC_BACKOFF_MAX', 2))
+        self.elastic_breaker_threshold = int(environ.get('ELASTIC_BREAKER_THRESHOLD', 5))
+        self.elastic_breaker_reset = float(environ.get('ELASTIC_BREAKER_RESET', 30))
+        # Searches of concurrent webhook calls arriving within this many seconds are sent as one _msearch request
+        # (0 sends every search on its own)
+        self.elastic_batch_window = float(environ.get('ELASTIC_BATCH_WINDOW', 0.005))
+        self.elastic_batch_size = int(environ.get('ELASTIC_BATCH_SIZE', 50))
+        # "tiered" tries an exact and a prefix match of the name before the full text search, which needs the
+        # subfields of the mapping created by `python -m actions.ingest`. "full" always runs the full text search.
+        self.elastic_search_mode = environ.get('ELASTIC_SEARCH_MODE', 'full')
+        self.search_cache_size = int(environ.get('SEARCH_CACHE_SIZE', 512))
+        self.search_cache_ttl = float(environ.get('SEARCH_CACHE_TTL', 3600))
+        # Seconds a validation webhook call may spend waiting for the device catalogue, including retries
+        self.webhook_latency_budget = float(environ.get('WEBHOOK_LATENCY_BUDGET', 3))
+        # Parses the tracker events of a webhook call only when an action reads them, which saves memory but not CPU
+        # (see `actions.webhook`)
+        self.webhook_lazy_events = environ.get('WEBHOOK_LAZY_EVENTS', 'false').lower() in ('1', 'true', 'yes')
+        # Keeps the entity confidence index of a conversation across turns (0 reads the events backwards per call)
+        self.confidence_cache_size = int(environ.get('CONFIDENCE_CACHE_SIZE', 0))
+        self.confidence_cache_ttl = float(environ.get('CONFIDENCE_CACHE_TTL', 3600))
+        # Queries looked up during warm-up so the first conversations after a rollout hit a filled cache
+        self.warm_up_models = _split(environ.get('WARM_UP_MODELS', "iPhone,iPad,Galaxy S8,Fire TV,Apple TV"))
+
+        # Action server processes forked by `actions.server` after preloading the catalogue (0 starts one per core)
+        self.server_workers = int(environ.get('SERVER_WORKERS', 1))
+        # Seconds a worker may take to warm up or go without a heartbeat before it is killed and started again
+        self.worker_timeout = float(environ.get('WORKER_TIMEOUT', 60))
+        # Seconds a stopping worker gets to answer the webhook calls in flight
+        self.worker_stop_timeout = float(environ.get('WORKER_STOP_TIMEOUT', 30))
+
+        self.airtable_base_id = environ.get('AIRTABLE_BASE_ID')
+        self.airtable_api_key = environ.get('AIRTABLE_API_KEY')
+        self.airtable_table_name = environ.get('AIRTABLE_TABLE')
+        self.airtable_api_url = environ.get('AIRTABLE_API_URL', "https://api.airtable.com/v0")
+        # Fields of the incident table holding the cluster of near-duplicate reports and its number of reports,
+        # only written with INCIDENT_DEDUP
+        self.airtable_cluster_field = environ.get('AIRTABLE_CLUSTER_FIELD', "Cluster")
+        self.airtable_occurrences_field = environ.get('AIRTABLE_OCCURRENCES_FIELD', "Occurrences")
+
+        # Required slots of the playback issue form per issue type, next to domain.yml
+        self.form_plans_path = environ.get('FORM_PLANS_PATH', os.path.join(_project_root, "form_plans.yml"))
+
+        self.incident_spool_path = environ.get('INCIDENT_SPOOL_PATH',
+                                               os.path.join(tempfile.gettempdir(), "bugbot_incidents.spool"))
+        # Airtable allows 10 records per request and 5 requests per second and base
+        self.incident_batch_size = int(environ.get('INCIDENT_BATCH_SIZE', 10))
+        self.incident_requests_per_second = float(environ.get('INCIDENT_REQUESTS_PER_SECOND', 4))
+        self.incident_flush_interval = float(environ.get('INCIDENT_FLUSH_INTERVAL', 1))
+        self.airtable_breaker_threshold = int(environ.get('AIRTABLE_BREAKER_THRESHOLD', 5))
+        self.airtable_breaker_reset = float(environ.get('AIRTABLE_BREAKER_RESET', 60))
+        # Local SQLite copy of the submitted incidents for triage queries (empty disables it)
+        self.incident_store_path = environ.get('INCIDENT_STORE_PATH',
+                                               os.path.join(tempfile.gettempdir(), "bugbot_incidents.db"))
+        # Reports similar to a recent report of the same device, OS, app version and content only update its count
+        self.incident_dedup = environ.get('INCIDENT_DEDUP', 'false').lower() in ('1', 'true', 'yes')
+        self.incident_dedup_threshold = float(environ.get('INCIDENT_DEDUP_THRESHOLD', 0.6))
+        self.incident_dedup_window = float(environ.get('INCIDENT_DEDUP_WINDOW', 3600))
+        self.incident_dedup_size = int(environ.get('INCIDENT_DEDUP_SIZE', 50000))
+
+        self.http_pool_size = int(environ.get('HTTP_POOL_SIZE', 100))
+        self.http_pool_per_host = int(environ.get('HTTP_POOL_PER_HOST', 10))
+        self.http_keepalive_timeout = float(environ.get('HTTP_KEEPALIVE_TIMEOUT', 30))
+        self.http_connect_timeout = float(environ.get('HTTP_CONNECT_TIMEOUT', 3))
+        self.http_read_timeout = float(environ.get('HTTP_READ_TIMEOUT', 10))
+
+        # Share of webhook calls traced (0 to 1), calls of the listed sender ids are always traced
+        self.trace_sample_rate = float(environ.get('TRACE_SAMPLE_RATE', 0))
+        self.trace_sender_ids = set(_split(environ.get('TRACE_SENDER_IDS')))
+        self.trace_path = environ.get('TRACE_PATH', os.path.join(tempfile.gettempdir(), "bugbot_traces.jsonl"))
+        self.trace_profile = environ.get('TRACE_PROFILE', 'false').lower() in ('1', 'true', 'yes')
+        self.trace_profile_top = int(environ.get('TRACE_PROFILE_TOP', 30))
+
+        self.log_level = environ.get('LOG_LEVEL', 'INFO').upper()
+        # "text" or "json" (one JSON object per line)
+        self.log_format = environ.get('LOG_FORMAT', 'text')
+        # Share of records below WARNING kept per category, e.g. "slots=0.1,catalogue=0.5" (unlisted ones keep all)
+        self.log_sample_rates = {category: float(rate) for category, rate in
+                                 (item.split("=", 1) for item in _split(environ.get('LOG_SAMPLE_RATES')))}
+        # Records per second and category, further records are dropped and counted (0 disables the limit)
+        self.log_rate_limit = float(environ.get('LOG_RATE_LIMIT', 50))
+        self.log_queue_size = int(environ.get('LOG_QUEUE_SIZE', 10000))
+        # Characters of a logged payload written before it is truncated
+        self.log_payload_max = int(environ.get('LOG_PAYLOAD_MAX', 2000))
+
+
+def _split(value: Optional[Text]):
+    if not value:
+        return []
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+_settings: Optional[Settings] = None
+
+
+def get_settings() -> Settings:
+    global _settings
+    if _settings is None:
+        load_dotenv()
+        _settings = Settings(os.environ)
+    return _settings
+
+
+def reset_settings():
+    """Forgets the loaded settings so the next `get_settings` reads the environment again."""
+    global _settings
+    _settings = None
@@ -0,0 +1,191 @@
+"""Clusters near-duplicate incident reports, e.g. the reports of many users during an outage.
+
+An incident is a duplicate of a recent one if both have the same device model, OS version, app version and content id
+and their problem descriptions and steps are similar. The similarity is the Jaccard similarity of word unigrams and
+bigrams, estimated from MinHash signatures. Signatures are bucketed per band (locality sensitive hashing) under the
+exact keys, so finding the cluster of an incident costs a few dictionary lookups whatever the number of recent
+incidents.
+
+With `INCIDENT_DEDUP` only the first report of a cluster is written as an Airtable record. Further reports update its
+occurrence count (`submit_deduplicated`).
+"""
+import functools
+import hashlib
+import logging
+import re
+import struct
+import uuid
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Callable, Dict, List, Optional, Set, Text, Tuple
+
+from actions.config import get_settings
+from actions.spool import submit_incident, submit_update
+
+logger = logging.getLogger(__name__)
+
+TEXT_FIELDS = ("Problem Statement", "Steps to reproduce")
+KEY_FIELDS = ("Device Model", "OS Version", "App Version", "Content ID")
+
+NUM_PERMUTATIONS = 64
+BANDS = 16
+
+_unpack_hashes = struct.Struct(f"<{NUM_PERMUTATIONS}I").unpack
+
+_word = re.compile(r"\w+")
+
+_index: Optional["IncidentIndex"] = None
+
+Signature = Tuple[int, ...]
+BucketKey = Tuple[Tuple[Text, ...], int, Signature]
+
+
+def shingles(text: Text) -> Set[Text]:
+    words = _word.findall(text.lower())
+    return set(words) | {f"{first} {second}" for first, second in zip(words, words[1:])}
+
+
+@functools.lru_cache(maxsize=65536)
+def _hashes(item: Text) -> Tuple[int, ...]:
+    # One extendable output digest gives the independent 32 bit hashes of all permutations at once
+    return _unpack_hashes(hashlib.shake_128(item.encode("utf-8")).digest(NUM_PERMUTATIONS * 4))
+
+
+def signature(items: Set[Text]) -> Signature:
+    return tuple(map(min, zip(*map(_hashes, items))))
+
+
+def similarity(first: Signature, second: Signature) -> float:
+    """Estimated Jaccard similarity of the shingles behind two signatures."""
+    return sum(1 for a, b in zip(first, second) if a == b) / len(first)
+
+
+def exact_key(fields: Dict[Text, Any]) -> Tuple[Text, ...]:
+    return tuple(str(fields.get(field) or "").strip().lower() for field in KEY_FIELDS)
+
+
+class Cluster:
+    __slots__ = ("key", "signature", "count", "last_seen", "buckets")
+
+    def __init__(self, key: Text, signature: Signature, last_seen: float, buckets: List[BucketKey]):
+        self.key = key
+        self.signature = signature
+        self.count = 1
+        self.last_seen = last_seen
+        self.buckets = buckets
+
+
+class IncidentIndex:
+    """Recent incident clusters, forgotten `window` seconds after their last report or when there are more than
+    `max_clusters`. Not thread safe, used from the event loop."""
+
+    def __init__(self, threshold: float = 0.6, window: float = 3600, max_clusters: int = 50000,
+                 clock: Callable[[], float] = monotonic):
+        self.threshold = threshold
+        self.window = window
+        self.max_clusters = max_clusters
+        self._clock = clock
+        self._rows = NUM_PERMUTATIONS // BANDS
+        # Least recently reported first
+        self._clusters: "OrderedDict[Text, Cluster]" = OrderedDict()
+        self._buckets: Dict[BucketKey, List[Cluster]] = {}
+
+    def __len__(self) -> int:
+        return len(self._clusters)
+
+    def report(self, fields: Dict[Text, Any]) -> Tuple[Optional[Cluster], bool]:
+        """Adds an incident and returns its cluster and whether the cluster is new.
+
+        Incidents without text are not clustered, for them the cluster is None.
+        """
+        now = self._clock()
+        self._expire(now)
+        items = shingles(" ".join(str(fields.get(field) or "") for field in TEXT_FIELDS))
+        if not items:
+            return None, True
+
+        incident = signature(items)
+        buckets = self._bucket_keys(exact_key(fields), incident)
+        cluster = self._find(buckets, incident)
+        if cluster is not None:
+            cluster.count += 1
+            cluster.last_seen = now
+            self._clusters.move_to_end(cluster.key)
+            return cluster, False
+
+        cluster = Cluster(uuid.uuid4().hex, incident, now, buckets)
+        self._clusters[cluster.key] = cluster
+        for bucket in buckets:
+            self._buckets.setdefault(bucket, []).append(cluster)
+        if len(self._clusters) > self.max_clusters:
+            self._remove(next(iter(self._clusters.values())))
+        return cluster, True
+
+    def discard(self, cluster: Cluster):
+        if cluster.key in self._clusters:
+            self._remove(cluster)
+
+    def _bucket_keys(self, key: Tuple[Text, ...], incident: Signature) -> List[BucketKey]:
+        rows = self._rows
+        return [(key, band, incident[band * rows:(band + 1) * rows]) for band in range(BANDS)]
+
+    def _find(self, buckets: List[BucketKey], incident: Signature) -> Optional[Cluster]:
+        best, best_similarity = None, self.threshold
+        seen = set()
+        for bucket in buckets:
+            for cluster in self._buckets.get(bucket, ()):
+                if cluster.key in seen:
+                    continue
+                seen.add(cluster.key)
+                estimate = similarity(cluster.signature, incident)
+                if estimate >= best_similarity:
+                    best, best_similarity = cluster, estimate
+        return best
+
+    def _expire(self, now: float):
+        while self._clusters:
+            oldest = next(iter(self._clusters.values()))
+            if now - oldest.last_seen < self.window:
+                return
+            self._remove(oldest)
+
+    def _remove(self, cluster: Cluster):
+        del self._clusters[cluster.key]
+        for bucket in cluster.buckets:
+            clusters = self._buckets[bucket]
+            clusters.remove(cluster)
+            if not clusters:
+                del self._buckets[bucket]
+
+
+def get_incident_index() -> IncidentIndex:
+    global _index
+    if _index is None:
+        settings = get_settings()
+        _index = IncidentIndex(threshold=settings.incident_dedup_threshold, window=settings.incident_dedup_window,
+                               max_clusters=settings.incident_dedup_size)
+    return _index
+
+
+async def submit_deduplicated(fields: Dict[Text, Any]) -> Text:
+    """Spools a new incident record, or an update of the occurrence count of the record of its cluster.
+
+    Returns the id of the spooled entry. Without `INCIDENT_DEDUP` every incident is a new record.
+    """
+    settings = get_settings()
+    if not settings.incident_dedup:
+        return await submit_incident(fields)
+
+    cluster, is_new = get_incident_index().report(fields)
+    if cluster is None:
+        return await submit_incident(fields)
+    occurrence = {settings.airtable_cluster_field: cluster.key, settings.airtable_occurrences_field: cluster.count}
+    if is_new:
+        try:
+            return await submit_incident(dict(fields, **occurrence))
+        except OSError:
+            # The report is not spooled, later duplicates must not update a record that does not exist
+            get_incident_index().discard(cluster)
+            raise
+    logger.info("Incident is occurrence %s of cluster %s", cluster.count, cluster.key)
+    return await submit_update(occurrence)
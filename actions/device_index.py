@@ -0,0 +1,285 @@
+import bisect
+import json
+import math
+import re
+import sys
+from collections import defaultdict
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Text, Tuple
+
+FIELD_MODEL = "Model Name"
+FIELD_MANUFACTURER = "Manufacturer"
+FIELD_FORM_FACTOR = "Form Factor"
+FIELD_ANDROID_SDK = "Android SDK Versions"
+
+# Same parameters as the default Elasticsearch BM25 similarity
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+NGRAM_SIZE = 3
+SUGGEST_MIN_SIMILARITY = 0.5
+
+token_pattern = re.compile(r"\w+")
+
+# Fields of a catalogue device stored as attributes of `DeviceRecord`
+_ATTRIBUTES = {FIELD_MODEL: "model", FIELD_MANUFACTURER: "manufacturer", FIELD_FORM_FACTOR: "form_factor",
+               FIELD_ANDROID_SDK: "android_sdk"}
+_BITS = {field: 1 << position for position, field in enumerate(_ATTRIBUTES)}
+
+_MISSING = object()
+
+
+def _intern(value: Any) -> Any:
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class DeviceRecord(Mapping):
+    """A catalogue device, read like the `_source` of an Elasticsearch hit (`record["Model Name"]`, `record.get(...)`).
+
+    The fields are attributes instead of dict entries and the few distinct manufacturers, form factors and Android SDK
+    ranges are interned, so a device costs a fraction of a dict. Records are immutable and shared by the local index,
+    the search cache and the validators without copies. Columns of the catalogue other than the four known fields are
+    kept in `extra`.
+    """
+
+    __slots__ = ("model", "manufacturer", "form_factor", "android_sdk", "is_android", "extra", "_present")
+
+    def __init__(self, model: Optional[Text] = None, manufacturer: Optional[Text] = None,
+                 form_factor: Optional[Text] = None, android_sdk: Any = None,
+                 extra: Optional[Dict[Text, Any]] = None, present: Optional[int] = None):
+        self.model = model
+        self.manufacturer = _intern(manufacturer)
+        self.form_factor = _intern(form_factor)
+        self.android_sdk = _intern(android_sdk)
+        # Devices listing Android SDK versions run Android
+        self.is_android = bool(android_sdk)
+        self.extra = {sys.intern(key): value for key, value in extra.items()} if extra else None
+        # Bit mask of the known fields the source had, also those that were null
+        if present is None:
+            present = sum(bit for field, bit in _BITS.items() if getattr(self, _ATTRIBUTES[field]) is not None)
+        self._present = present
+
+    @classmethod
+    def from_source(cls, document: Dict[Text, Any]) -> "DeviceRecord":
+        if isinstance(document, DeviceRecord):
+            return document
+        extra = {key: value for key, value in document.items() if key not in _ATTRIBUTES}
+        return cls(document.get(FIELD_MODEL), document.get(FIELD_MANUFACTURER), document.get(FIELD_FORM_FACTOR),
+                   document.get(FIELD_ANDROID_SDK), extra,
+                   present=sum(bit for field, bit in _BITS.items() if field in document))
+
+    def __getitem__(self, key: Text) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: Text, default: Any = None) -> Any:
+        # Called for every field the validators read, faster than the lookup through __getitem__ of Mapping
+        attribute = _ATTRIBUTES.get(key)
+        if attribute is not None:
+            value = getattr(self, attribute)
+            return value if value is not None or self._present & _BITS[key] else default
+        if self.extra is not None:
+            return self.extra.get(key, default)
+        return default
+
+    def __contains__(self, key: Any) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __iter__(self) -> Iterator[Text]:
+        for field, bit in _BITS.items():
+            if self._present & bit:
+                yield field
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self) -> int:
+        return bin(self._present).count("1") + (len(self.extra) if self.extra is not None else 0)
+
+    def __repr__(self) -> Text:
+        return f"DeviceRecord({self.to_dict()!r})"
+
+    def to_dict(self) -> Dict[Text, Any]:
+        return dict(self.items())
+
+
+def tokenize(text: Any) -> List[Text]:
+    if not text:
+        return []
+    return token_pattern.findall(str(text).lower())
+
+
+def ngrams(token: Text, size: int = NGRAM_SIZE) -> List[Text]:
+    padded = f" {token} "
+    if len(padded) <= size:
+        return [padded]
+    return [padded[i:i + size] for i in range(len(padded) - size + 1)]
+
+
+class FieldIndex:
+    """Inverted index over the word tokens of one document field plus a character n-gram index over its vocabulary."""
+
+    def __init__(self):
+        self.postings: Dict[Text, Dict[int, int]] = defaultdict(dict)
+        self.lengths: Dict[int, int] = {}
+        self.term_counts: Dict[Text, int] = defaultdict(int)
+        self.ngram_terms: Dict[Text, set] = defaultdict(set)
+        self.total_length = 0
+
+    def add(self, doc_id: int, value: Any):
+        tokens = tokenize(value)
+        if not tokens:
+            return
+        self.lengths[doc_id] = len(tokens)
+        self.total_length += len(tokens)
+        for token in tokens:
+            postings = self.postings[token]
+            postings[doc_id] = postings.get(doc_id, 0) + 1
+            self.term_counts[token] += 1
+            for gram in ngrams(token):
+                self.ngram_terms[gram].add(token)
+
+    def score(self, tokens: List[Text], doc_count: int) -> Dict[int, float]:
+        scores: Dict[int, float] = defaultdict(float)
+        if not self.lengths:
+            return scores
+        avg_length = self.total_length / len(self.lengths)
+        for token in tokens:
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[doc_id] / avg_length)
+                scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+    def correct(self, token: Text) -> Optional[Text]:
+        """Returns the most similar vocabulary term for `token` measured by n-gram overlap (Dice coefficient)."""
+        if token in self.postings:
+            return token
+
+        grams = set(ngrams(token))
+        overlap: Dict[Text, int] = defaultdict(int)
+        for gram in grams:
+            for term in self.ngram_terms.get(gram, ()):
+                overlap[term] += 1
+
+        best, best_score = None, 0.0
+        for term, shared in overlap.items():
+            similarity = 2 * shared / (len(grams) + len(set(ngrams(term))))
+            # Prefer frequent terms on ties, like the phrase suggester does
+            if similarity > best_score or (similarity == best_score and best is not None
+                                           and self.term_counts[term] > self.term_counts[best]):
+                best, best_score = term, similarity
+        if best_score < SUGGEST_MIN_SIMILARITY:
+            return None
+        return best
+
+
+class DeviceIndex:
+    """In-memory search engine over a snapshot of the `supported_devices_v2` index.
+
+    Hits are ranked with BM25 over word tokens using `best_fields` semantics (the best boosted field score counts).
+    Suggestions correct each query token to the closest indexed term by character n-gram similarity. Results have the
+    same shape as `actions.elastic.search_model` and `actions.elastic.search_manufacturer`.
+    """
+
+    def __init__(self, documents: Iterable[Dict[Text, Any]]):
+        self.documents: List[DeviceRecord] = []
+        self.fields: Dict[Text, FieldIndex] = {FIELD_MODEL: FieldIndex(), FIELD_MANUFACTURER: FieldIndex()}
+        self._exact: Dict[Text, Dict[Text, int]] = {field: {} for field in self.fields}
+        # Sorted normalized values per field for prefix lookups, built on first use
+        self._sorted: Dict[Text, List[Text]] = {}
+        for document in documents:
+            self.add(document)
+
+    @classmethod
+    def load(cls, path: Text) -> "DeviceIndex":
+        """Loads a snapshot stored as a JSON array or as JSON lines. Elasticsearch hits with a `_source` are unwrapped."""
+        with open(path, encoding="utf-8") as file:
+            content = file.read().strip()
+
+        if content.startswith("["):
+            documents = json.loads(content)
+        else:
+            # Each line is turned into a record before the next one is parsed
+            documents = (json.loads(line) for line in content.splitlines() if line.strip())
+        return cls(document.get("_source", document) for document in documents)
+
+    def add(self, document: Dict[Text, Any]):
+        doc_id = len(self.documents)
+        record = DeviceRecord.from_source(document)
+        self.documents.append(record)
+        for field, index in self.fields.items():
+            value = record.get(field)
+            index.add(doc_id, value)
+            if value:
+                self._exact[field].setdefault(" ".join(tokenize(value)), doc_id)
+        self._sorted.clear()
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def search(self, query: Text, fields: Dict[Text, float]) -> List[Tuple[float, DeviceRecord]]:
+        tokens = tokenize(query)
+        best: Dict[int, float] = {}
+        for field, boost in fields.items():
+            for doc_id, score in self.fields[field].score(tokens, len(self.documents)).items():
+                best[doc_id] = max(best.get(doc_id, 0.0), score * boost)
+
+        # An exact match of the whole field outranks partial matches with the same terms, e.g. "Galaxy S8" vs "S8+"
+        normalized = " ".join(tokens)
+        for field in fields:
+            doc_id = self._exact[field].get(normalized)
+            if doc_id is not None and doc_id in best:
+                best[doc_id] += max(best.values())
+
+        ranked = sorted(best.items(), key=lambda item: (-item[1], item[0]))
+        return [(score, self.documents[doc_id]) for doc_id, score in ranked]
+
+    def suggest(self, query: Text, field: Text) -> Optional[Text]:
+        tokens = tokenize(query)
+        corrected = []
+        for token in tokens:
+            correction = self.fields[field].correct(token)
+            corrected.append(correction or token)
+        if not tokens or corrected == tokens:
+            return None
+        return " ".join(corrected)
+
+    def exact(self, query: Text, field: Text) -> Optional[DeviceRecord]:
+        """The first device whose `field` equals the query, ignoring case and punctuation."""
+        doc_id = self._exact[field].get(" ".join(tokenize(query)))
+        return None if doc_id is None else self.documents[doc_id]
+
+    def prefix(self, query: Text, field: Text) -> Optional[DeviceRecord]:
+        """The device whose `field` is the alphabetically first value starting with the query."""
+        normalized = " ".join(tokenize(query))
+        if not normalized:
+            return None
+        if field not in self._sorted:
+            self._sorted[field] = sorted(self._exact[field])
+        values = self._sorted[field]
+        position = bisect.bisect_left(values, normalized)
+        if position == len(values) or not values[position].startswith(normalized):
+            return None
+        return self.documents[self._exact[field][values[position]]]
+
+    def lookup(self, query: Text, fields: Dict[Text, float], suggest_field: Text) -> Dict[Text, Any]:
+        result = {}
+        hits = self.search(query, fields)
+        if hits:
+            result["hit"] = hits[0][1]
+
+        suggestion = self.suggest(query, suggest_field)
+        if suggestion:
+            result["suggestion"] = suggestion
+        return result
+
+    def search_model(self, model: Text) -> Dict[Text, Any]:
+        return self.lookup(model, {FIELD_MODEL: 2, FIELD_MANUFACTURER: 1}, FIELD_MODEL)
+
+    def search_manufacturer(self, manufacturer: Text) -> Dict[Text, Any]:
+        return self.lookup(manufacturer, {FIELD_MANUFACTURER: 1}, FIELD_MANUFACTURER)
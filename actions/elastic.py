@@ -1,80 +1,376 @@
 import logging
-import os
-from time import sleep
-from typing import Text, Any, Dict
+from typing import Text, Any, Dict, Hashable, List, Optional, Tuple, TYPE_CHECKING
 
-from dotenv import load_dotenv
-from elasticsearch import ConnectionTimeout
-from elasticsearch_dsl import Search, Q
-from elasticsearch_dsl.connections import connections
+from actions.batching import SearchBatcher, SearchFailed
+from actions.cache import TTLCache, normalize_query
+from actions.config import get_settings
+from actions.device_index import FIELD_MANUFACTURER, FIELD_MODEL, DeviceIndex, DeviceRecord
+from actions.logs import CATALOGUE
+from actions.metrics import BACKEND_DURATION, CACHE_REQUESTS, CATALOGUE_LOOKUPS
+from actions.tracing import span
+from actions.resilience import CircuitBreaker, ResilienceError, call_with_retries, call_with_retries_sync
 
-load_dotenv()
+# The elasticsearch packages take a noticeable time to import and are not needed in local mode, so they are only
+# imported on first use
+if TYPE_CHECKING:
+    from elasticsearch import AsyncElasticsearch, Elasticsearch
+    from elasticsearch_dsl import Search
+    from elasticsearch_dsl.response import Response
 
-elastic_host = os.environ.get('ELASTIC_HOST')
-elastic_admin = os.environ.get('ELASTIC_ADMIN')
-elastic_pswd = os.environ.get('ELASTIC_PSWD')
-index_id = "supported_devices_v2"
+logger = logging.getLogger(__name__)
 
+SEARCH_MODE_TIERED = "tiered"
 
-connections.create_connection(hosts=[elastic_host], http_auth=(elastic_admin, elastic_pswd), timeout=20)
+# Field of the catalogue matched by the fast path of the tiered search per kind of lookup
+LOOKUP_FIELDS = {'model': FIELD_MODEL, 'manufacturer': FIELD_MANUFACTURER}
 
-logger = logging.getLogger(__name__)
+PREFIX_SUGGESTION = "prefix"
+
+_async_client: Optional["AsyncElasticsearch"] = None
+
+_batcher: Optional[SearchBatcher] = None
+
+_local_index: Optional[DeviceIndex] = None
+
+_search_cache: Optional[TTLCache] = None
+
+_circuit_breaker: Optional[CircuitBreaker] = None
+
+
+class ClusterUnavailable(Exception):
+    """The cluster answered with 429 (search queue full) or a 5xx status, so the search may succeed when retried."""
+
+
+def is_local_mode() -> bool:
+    return get_settings().elastic_mode == 'local'
+
+
+def get_search_cache() -> TTLCache:
+    global _search_cache
+    if _search_cache is None:
+        settings = get_settings()
+        _search_cache = TTLCache(max_size=settings.search_cache_size, ttl=settings.search_cache_ttl)
+    return _search_cache
+
+
+def get_circuit_breaker() -> CircuitBreaker:
+    global _circuit_breaker
+    if _circuit_breaker is None:
+        settings = get_settings()
+        _circuit_breaker = CircuitBreaker(failure_threshold=settings.elastic_breaker_threshold,
+                                          reset_timeout=settings.elastic_breaker_reset)
+    return _circuit_breaker
+
+
+def get_client() -> "Elasticsearch":
+    from elasticsearch_dsl.connections import connections
+    try:
+        return connections.get_connection()
+    except KeyError:
+        settings = get_settings()
+        return connections.create_connection(hosts=[settings.elastic_host],
+                                             http_auth=(settings.elastic_admin, settings.elastic_pswd),
+                                             timeout=settings.http_read_timeout, maxsize=settings.http_pool_per_host)
+
+
+def get_async_client() -> "AsyncElasticsearch":
+    # The async client binds its connection pool to the running event loop, so it is created on first use
+    global _async_client
+    if _async_client is None:
+        from elasticsearch import AsyncElasticsearch
+        settings = get_settings()
+        _async_client = AsyncElasticsearch(hosts=[settings.elastic_host],
+                                           http_auth=(settings.elastic_admin, settings.elastic_pswd),
+                                           timeout=settings.http_read_timeout, maxsize=settings.http_pool_per_host)
+    return _async_client
+
+
+def get_batcher() -> SearchBatcher:
+    global _batcher
+    if _batcher is None:
+        settings = get_settings()
+        _batcher = SearchBatcher(multi_search, window=settings.elastic_batch_window,
+                                 max_batch=settings.elastic_batch_size)
+    return _batcher
+
+
+async def close_async_client():
+    global _async_client, _batcher
+    if _batcher is not None:
+        await _batcher.close()
+        _batcher = None
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+
+
+def get_local_index() -> Optional[DeviceIndex]:
+    if _local_index is None:
+        return load_local_index()
+    return _local_index
+
+
+def load_local_index() -> Optional[DeviceIndex]:
+    """Reads the snapshot at DEVICE_INDEX_PATH again, e.g. after `python -m actions.ingest --snapshot` replaced it."""
+    global _local_index
+    path = get_settings().device_index_path
+    if path:
+        _local_index = DeviceIndex.load(path)
+        logger.info("Loaded %s devices from %s", len(_local_index), path)
+    return _local_index
+
+
+async def ping() -> bool:
+    """Checks that the cluster answers. Always true in local mode."""
+    if is_local_mode():
+        return True
+    from elasticsearch import ConnectionError as ElasticConnectionError
+    try:
+        return await get_async_client().ping()
+    except ElasticConnectionError as err:
+        logger.warning("Elasticsearch ping failed: %s", err)
+        return False
+
+
+async def warm_up():
+    """Opens the client, loads the local index and fills the search cache with common queries."""
+    settings = get_settings()
+    get_search_cache()
+    get_local_index()
+    if not is_local_mode():
+        get_async_client()
+    for model in settings.warm_up_models:
+        await search_model_async(model)
+
+
+def search_local(kind: str, query: str) -> Dict[Text, Any]:
+    index = get_local_index()
+    if index is None:
+        return {}
+    if kind == 'model':
+        return index.search_model(query)
+    return index.search_manufacturer(query)
+
+
+def model_query(query: str) -> "Search":
+    from elasticsearch_dsl import Search, Q
+    return Search(index=get_settings().elastic_index) \
+        .query(Q("multi_match", query=query, type="best_fields", fields=["Model Name^2", "Manufacturer"])) \
+        .suggest('model', query, phrase={'field': 'Model Name'})
+
+
+def manufacturer_query(query: str) -> "Search":
+    from elasticsearch_dsl import Search, Q
+    return Search(index=get_settings().elastic_index) \
+        .query(Q("multi_match", query=query, type="best_fields", fields=["Manufacturer"])) \
+        .suggest('manufacturer', query, phrase={'field': 'Manufacturer'})
+
+
+def full_query(kind: str, query: str) -> "Search":
+    return model_query(query) if kind == 'model' else manufacturer_query(query)
+
+
+def fast_query(kind: str, query: str) -> "Search":
+    """Exact match of the normalized name and completion of it as prefix in one request, both cheap lookups."""
+    from elasticsearch_dsl import Search, Q
+    field = LOOKUP_FIELDS[kind]
+    return Search(index=get_settings().elastic_index) \
+        .query(Q("match", **{f"{field}.exact": query}))[:1] \
+        .suggest(PREFIX_SUGGESTION, query, completion={'field': f"{field}.completion", 'size': 1})
+
+
+def parse_fast_response(response: "Response") -> Tuple[Optional[Text], Dict[Text, Any]]:
+    """Returns the tier that found a device ("exact" or "prefix", None for no device) and the result."""
+    if response.hits.total.value > 0:
+        return "exact", {"hit": DeviceRecord.from_source(response.hits[0].to_dict())}
+    for item in getattr(response.suggest, PREFIX_SUGGESTION, []):
+        for option in item.options:
+            return "prefix", {"hit": DeviceRecord.from_source(option.to_dict()["_source"])}
+    return None, {}
+
+
+def parse_response(response: "Response", suggest_name: str) -> Dict[Text, Any]:
+    result = {}
+    if response.hits.total.value > 0:
+        result["hit"] = DeviceRecord.from_source(response.hits[0].to_dict())
+
+    for item in getattr(response.suggest, suggest_name, []):
+        best_match = None
+        for option in item.options:
+            if not best_match or option.score > best_match.score:
+                best_match = option
+
+        if best_match:
+            result["suggestion"] = best_match.text
+            break
+    return result
+
+
+def cached(kind: str, query: str, lookup):
+    key = (kind, normalize_query(query))
+    result = get_search_cache().get(key)
+    CACHE_REQUESTS.inc(cache="search", result="miss" if result is None else "hit")
+    if result is not None:
+        return dict(result)
+
+    result = lookup()
+    # Failed lookups are not cached so the next turn retries the cluster
+    if result:
+        get_search_cache().set(key, result)
+    return result
+
+
+async def cached_async(kind: str, query: str, lookup):
+    key = (kind, normalize_query(query))
+    result = get_search_cache().get(key)
+    CACHE_REQUESTS.inc(cache="search", result="miss" if result is None else "hit")
+    if result is not None:
+        return dict(result)
+
+    result = await lookup()
+    if result:
+        get_search_cache().set(key, result)
+    return result
+
+
+def execute(search: "Search") -> "Response":
+    with BACKEND_DURATION.time(backend="elasticsearch", operation="search"), span("elasticsearch.search"):
+        return search.using(get_client()).execute()
+
+
+def lookup(kind: str, query: str) -> Dict[Text, Any]:
+    if get_settings().elastic_search_mode == SEARCH_MODE_TIERED:
+        tier, result = parse_fast_response(retry_on_error(lambda: execute(fast_query(kind, query))))
+        if tier is not None:
+            return count_lookup(kind, tier, result)
+    result = parse_response(retry_on_error(lambda: execute(full_query(kind, query))), kind)
+    return count_lookup(kind, "full", result)
+
+
+def count_lookup(kind: str, tier: Text, result: Dict[Text, Any]) -> Dict[Text, Any]:
+    CATALOGUE_LOOKUPS.inc(kind=kind, tier=tier if "hit" in result else "miss")
+    return result
 
 
 def search_model(model: str) -> Dict[Text, Any]:
-    def do_search(query: str):
-        result = {}
-        search = Search(index=index_id) \
-            .query(Q("multi_match", query=query, type="best_fields", fields=["Model Name^2", "Manufacturer"])) \
-            .suggest('model', query, phrase={'field': 'Model Name'}) \
-            .execute()
-        if search.hits.total.value > 0:
-            result["hit"] = search.hits[0].to_dict()
-
-        for item in search.suggest.model:
-            best_match = None
-            for option in item.options:
-                if not best_match or option.score > best_match.score:
-                    best_match = option
-
-            if best_match:
-                result["suggestion"] = best_match.text
-                break
-        return result
-    return retry_on_error(lambda: do_search(model))
+    return search('model', model, lambda: lookup('model', model))
 
 
 def search_manufacturer(manufacturer: str) -> Dict[Text, Any]:
-    def do_search(query: str):
-        result = {}
-        elastic_resp = Search(index=index_id)\
-            .query(Q("multi_match", query=query, type="best_fields", fields=["Manufacturer"]))\
-            .suggest('manufacturer', query, phrase={'field': 'Manufacturer'})\
-            .execute()
-        if elastic_resp.hits.total.value > 0:
-            result["hit"] = elastic_resp.hits[0].to_dict()
-
-        for item in elastic_resp.suggest.manufacturer:
-            best_match = None
-            for option in item.options:
-                if not best_match or option.score > best_match.score:
-                    best_match = option
-
-            if best_match:
-                result["suggestion"] = best_match.text
-                break
-        return result
-    return retry_on_error(lambda: do_search(manufacturer))
+    return search('manufacturer', manufacturer, lambda: lookup('manufacturer', manufacturer))
+
+
+def search(kind: str, query: str, lookup) -> Dict[Text, Any]:
+    with span("catalogue.search", kind=kind, query=query):
+        return _search(kind, query, lookup)
+
+
+def _search(kind: str, query: str, lookup) -> Dict[Text, Any]:
+    if is_local_mode():
+        return cached(kind, query, lambda: search_local(kind, query))
+    try:
+        return cached(kind, query, lookup)
+    except ResilienceError as err:
+        logger.error("Elasticsearch lookup failed, falling back to local device index: %s", err, extra=CATALOGUE)
+        return search_local(kind, query)
+
+
+async def multi_search(bodies: List[Dict[Text, Any]]) -> List[Dict[Text, Any]]:
+    index = get_settings().elastic_index
+    lines = []
+    for body in bodies:
+        lines.append({"index": index})
+        lines.append(body)
+    with BACKEND_DURATION.time(backend="elasticsearch", operation="msearch"), \
+            span("elasticsearch.msearch", searches=len(bodies)):
+        raw = await get_async_client().msearch(body=lines)
+    return raw["responses"]
+
+
+async def execute_async(search: "Search", key: Optional[Hashable] = None) -> "Response":
+    """Runs `search`, searches with a `key` are coalesced with concurrent searches into one _msearch request."""
+    from elasticsearch_dsl.response import Response
+    if key is not None and get_settings().elastic_batch_window > 0:
+        raw = await get_batcher().submit(key, search.to_dict())
+    else:
+        with BACKEND_DURATION.time(backend="elasticsearch", operation="search"), span("elasticsearch.search"):
+            raw = await get_async_client().search(index=get_settings().elastic_index, body=search.to_dict())
+    return Response(search, raw)
+
+
+async def lookup_async(kind: str, query: str) -> Dict[Text, Any]:
+    key = (kind, normalize_query(query))
+    if get_settings().elastic_search_mode == SEARCH_MODE_TIERED:
+        response = await retry_on_error_async(
+            lambda: execute_async(fast_query(kind, query), key + (SEARCH_MODE_TIERED,)))
+        tier, result = parse_fast_response(response)
+        if tier is not None:
+            return count_lookup(kind, tier, result)
+    response = await retry_on_error_async(lambda: execute_async(full_query(kind, query), key))
+    return count_lookup(kind, "full", parse_response(response, kind))
+
+
+async def search_model_async(model: str) -> Dict[Text, Any]:
+    return await search_async('model', model, lambda: lookup_async('model', model))
+
+
+async def search_manufacturer_async(manufacturer: str) -> Dict[Text, Any]:
+    return await search_async('manufacturer', manufacturer, lambda: lookup_async('manufacturer', manufacturer))
+
+
+async def search_async(kind: str, query: str, lookup) -> Dict[Text, Any]:
+    with span("catalogue.search", kind=kind, query=query):
+        return await _search_async(kind, query, lookup)
+
+
+async def _search_async(kind: str, query: str, lookup) -> Dict[Text, Any]:
+    if is_local_mode():
+        return cached(kind, query, lambda: search_local(kind, query))
+    try:
+        return await cached_async(kind, query, lookup)
+    except ResilienceError as err:
+        logger.error("Elasticsearch lookup failed, falling back to local device index: %s", err, extra=CATALOGUE)
+        return search_local(kind, query)
+
+
+def _is_unavailable(err: Exception) -> bool:
+    # Connection errors are transport errors too, their status code is "N/A"
+    status = getattr(err, "status_code", None)
+    return isinstance(status, int) and (status == 429 or status >= 500)
 
 
 def retry_on_error(action):
-    for retry in range(3):
+    from elasticsearch import ConnectionError as ElasticConnectionError, TransportError
+
+    def attempt():
         try:
             return action()
-        except ConnectionTimeout as cto:
-            interval = retry * 1000
-            logger.error(f"Connection timeout out while fetching search results. Retrying in {interval}", cto)
-            sleep(interval)
-            pass
-        
-    
+        except TransportError as err:
+            if _is_unavailable(err):
+                raise ClusterUnavailable(str(err)) from err
+            raise
+
+    settings = get_settings()
+    return call_with_retries_sync(attempt, retry_on=(ElasticConnectionError, ClusterUnavailable),
+                                  retries=settings.elastic_retries, base_delay=settings.elastic_backoff_base,
+                                  max_delay=settings.elastic_backoff_max,
+                                  breaker=get_circuit_breaker(), name="elasticsearch")
+
+
+async def retry_on_error_async(action):
+    from elasticsearch import ConnectionError as ElasticConnectionError, TransportError
+
+    async def attempt():
+        try:
+            return await action()
+        except TransportError as err:
+            if _is_unavailable(err):
+                raise ClusterUnavailable(str(err)) from err
+            raise
+
+    settings = get_settings()
+    # A search of a batch can fail on its own, e.g. rejected with 429 by a full search queue
+    return await call_with_retries(attempt, retry_on=(ElasticConnectionError, ClusterUnavailable, SearchFailed),
+                                   retries=settings.elastic_retries, base_delay=settings.elastic_backoff_base,
+                                   max_delay=settings.elastic_backoff_max, breaker=get_circuit_breaker(),
+                                   name="elasticsearch")
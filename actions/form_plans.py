@@ -0,0 +1,148 @@
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Text, Tuple
+
+import yaml
+
+from actions.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_VERSIONS = (1,)
+
+PlanKey = Tuple[Optional[Text], bool, bool]
+
+_plans: Optional["FormPlans"] = None
+
+_lock = threading.Lock()
+
+
+class FormPlanError(ValueError):
+    """The form plans file is malformed."""
+
+
+def _unique(values: Iterable[Text]) -> Tuple[Text, ...]:
+    return tuple(dict.fromkeys(values))
+
+
+class FormPlans:
+    """Required slots of the playback issue form per issue type, platform and pending confirmation.
+
+    Every combination is compiled to a tuple up front, so `required_slots` is a dictionary lookup.
+    """
+
+    def __init__(self, issue_types: Dict[Text, Sequence[Text]], always: Sequence[Text] = (),
+                 web_skips: Sequence[Text] = (), confirm_slot: Text = "confirm_slot"):
+        self.issue_types = {name: tuple(slots) for name, slots in issue_types.items()}
+        self.always = tuple(always)
+        self.web_skips = frozenset(web_skips)
+        self.confirm_slot = confirm_slot
+        self._plans: Dict[PlanKey, Tuple[Text, ...]] = {}
+        for issue_type, slots in self.issue_types.items():
+            for is_web in (False, True):
+                for confirm_pending in (False, True):
+                    self._plans[(issue_type, is_web, confirm_pending)] = self.compile(slots, is_web, confirm_pending)
+        # Plans built from the slots of the form in the domain, for issue types without a plan
+        self._domain_plans: Dict[Tuple[Tuple[Text, ...], bool, bool], Tuple[Text, ...]] = {}
+
+    def compile(self, slots: Sequence[Text], is_web: bool, confirm_pending: bool) -> Tuple[Text, ...]:
+        plan = [slot for slot in list(slots) + list(self.always) if not (is_web and slot in self.web_skips)]
+        if confirm_pending:
+            plan.insert(0, self.confirm_slot)
+        return _unique(plan)
+
+    def plan(self, issue_type: Optional[Text], is_web: bool, confirm_pending: bool,
+             domain_slots: Sequence[Text] = ()) -> Tuple[Text, ...]:
+        plan = self._plans.get((issue_type, is_web, confirm_pending))
+        if plan is not None:
+            return plan
+
+        key = (tuple(domain_slots), is_web, confirm_pending)
+        plan = self._domain_plans.get(key)
+        if plan is None:
+            plan = self._domain_plans[key] = self.compile(key[0], is_web, confirm_pending)
+        return plan
+
+    def slots(self, issue_type: Text) -> Tuple[Text, ...]:
+        """The slots of an issue type without the slots asked for every issue type."""
+        return self.issue_types[issue_type]
+
+    def all_slots(self) -> List[Text]:
+        return list(_unique(slot for plan in self._plans.values() for slot in plan))
+
+
+def _string_list(value: Any, name: Text) -> List[Text]:
+    if not isinstance(value, list) or not all(isinstance(item, str) and item for item in value):
+        raise FormPlanError(f"'{name}' must be a list of slot names")
+    return value
+
+
+def parse_form_plans(data: Any) -> FormPlans:
+    """Validates the content of a form plans file and compiles it."""
+    if not isinstance(data, dict):
+        raise FormPlanError("Form plans must be a mapping")
+    unknown = set(data) - {"version", "slot_groups", "issue_types", "always", "web_skips", "confirm_slot"}
+    if unknown:
+        raise FormPlanError(f"Unknown keys in form plans: {', '.join(sorted(unknown))}")
+    if data.get("version") not in SUPPORTED_VERSIONS:
+        raise FormPlanError(f"Unsupported form plans version {data.get('version')!r}")
+
+    groups = data.get("slot_groups") or {}
+    if not isinstance(groups, dict):
+        raise FormPlanError("'slot_groups' must be a mapping of group names to slots")
+    groups = {name: _string_list(slots, f"slot_groups.{name}") for name, slots in groups.items()}
+
+    issue_types = data.get("issue_types")
+    if not isinstance(issue_types, dict) or not issue_types:
+        raise FormPlanError("'issue_types' must map at least one issue type to its slots")
+
+    compiled = {}
+    for issue_type, entries in issue_types.items():
+        slots = []
+        for entry in _string_list(entries, f"issue_types.{issue_type}"):
+            slots.extend(groups.get(entry, [entry]))
+        duplicates = sorted({slot for slot in slots if slots.count(slot) > 1})
+        if duplicates:
+            raise FormPlanError(f"Issue type '{issue_type}' asks more than once for {', '.join(duplicates)}")
+        compiled[issue_type] = slots
+
+    confirm_slot = data.get("confirm_slot", "confirm_slot")
+    if not isinstance(confirm_slot, str) or not confirm_slot:
+        raise FormPlanError("'confirm_slot' must be a slot name")
+
+    return FormPlans(compiled, always=_string_list(data.get("always", []), "always"),
+                     web_skips=_string_list(data.get("web_skips", []), "web_skips"), confirm_slot=confirm_slot)
+
+
+def load_form_plans(path: Text) -> FormPlans:
+    try:
+        with open(path, encoding="utf-8") as file:
+            data = yaml.safe_load(file)
+    except (OSError, yaml.YAMLError) as err:
+        raise FormPlanError(f"Could not read form plans from {path}: {err}") from err
+    try:
+        return parse_form_plans(data)
+    except FormPlanError as err:
+        raise FormPlanError(f"{path}: {err}") from err
+
+
+def get_form_plans() -> FormPlans:
+    global _plans
+    if _plans is None:
+        with _lock:
+            if _plans is None:
+                path = get_settings().form_plans_path
+                _plans = load_form_plans(path)
+                logger.info("Compiled form plans for %s issue types from %s", len(_plans.issue_types), path)
+    return _plans
+
+
+def reload_form_plans() -> FormPlans:
+    """Reads the plans file again. The previous plans stay in use if it is invalid (FormPlanError)."""
+    global _plans
+    path = get_settings().form_plans_path
+    plans = load_form_plans(path)
+    with _lock:
+        _plans = plans
+    logger.info("Compiled form plans for %s issue types from %s", len(plans.issue_types), path)
+    return plans
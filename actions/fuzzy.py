@@ -0,0 +1,161 @@
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Text, Tuple
+
+import yaml
+from thefuzz import fuzz
+
+from actions.tracing import span
+
+DEFAULT_THRESHOLD = 70
+
+
+def _round(value: float) -> int:
+    # Same rounding as thefuzz applies to its ratios
+    return int(round(value))
+
+
+class FuzzyIndex:
+    """Finds the vocabulary entry matching a token with `fuzz.ratio >= threshold`, like scanning the list in order.
+
+    `fuzz.ratio` is `2 * M / T` with `M` matching characters and `T` the summed length of both strings. `M` is at most
+    the shorter length and at most the number of characters both strings share, which rules out almost all entries
+    before the (expensive) ratio is computed. The shared characters are counted for all entries at once:
+
+    (-) per character and occurrence (the second "s" of a token) the entries having it are the bits of an integer
+    (-) adding up these integers for the characters of a token gives the shared characters of every entry, held as
+        bit slices of a counter
+    (-) entries of a length whose count cannot reach the threshold are masked out, the remaining bits are scored in
+        the order of the vocabulary
+
+    So a lookup takes a few operations on integers with one bit per entry instead of a loop over the vocabulary.
+    """
+
+    def __init__(self, vocabulary: Iterable[Text], threshold: int = DEFAULT_THRESHOLD):
+        self.vocabulary: List[Text] = list(vocabulary)
+        self.threshold = threshold
+        self._lowered = [entry.lower() for entry in self.vocabulary]
+        self._all = (1 << len(self._lowered)) - 1
+        postings: Dict[Tuple[Text, int], bytearray] = {}
+        lengths: Dict[int, bytearray] = {}
+        size = (len(self._lowered) + 7) // 8
+        for position, entry in enumerate(self._lowered):
+            byte, bit = position >> 3, 1 << (position & 7)
+            lengths.setdefault(len(entry), bytearray(size))[byte] |= bit
+            for character, count in Counter(entry).items():
+                for occurrence in range(1, count + 1):
+                    postings.setdefault((character, occurrence), bytearray(size))[byte] |= bit
+        # Bit `position` is set for the entries with at least that many occurrences of the character / of that length
+        self._postings = {key: int.from_bytes(bits, "little") for key, bits in postings.items()}
+        self._lengths = {length: int.from_bytes(bits, "little") for length, bits in lengths.items()}
+        self._required: Dict[int, Dict[int, int]] = {}
+        self._matches: Dict[Text, Optional[Text]] = {}
+
+    def __len__(self) -> int:
+        return len(self.vocabulary)
+
+    def _required_shared(self, length: int) -> Dict[int, int]:
+        # Entries (as bits) per number of characters they must share with a token of `length` to reach the threshold
+        required = self._required.get(length)
+        if required is None:
+            required = defaultdict(int)
+            for entry_length, entries in self._lengths.items():
+                total = length + entry_length
+                for shared in range(min(length, entry_length) + 1):
+                    if _round(200 * shared / (total or 1)) >= self.threshold:
+                        required[shared] |= entries
+                        break
+            self._required[length] = required = dict(required)
+        return required
+
+    def _at_least(self, counter: List[int], shared: int) -> int:
+        # Compares the bit-sliced counter with `shared` from the highest bit down, for all entries at once
+        if shared >= 1 << len(counter):
+            return 0
+        greater, equal = 0, self._all
+        for index in reversed(range(len(counter))):
+            if shared >> index & 1:
+                equal &= counter[index]
+            else:
+                greater |= equal & counter[index]
+                equal &= ~counter[index]
+        return greater | equal
+
+    def _candidates(self, lowered: Text) -> Iterator[int]:
+        counter: List[int] = []
+        for character, count in Counter(lowered).items():
+            for occurrence in range(1, count + 1):
+                carry = self._postings.get((character, occurrence), 0)
+                for index, bits in enumerate(counter):
+                    if not carry:
+                        break
+                    counter[index], carry = bits ^ carry, bits & carry
+                if carry:
+                    counter.append(carry)
+
+        selected = 0
+        for shared, entries in self._required_shared(len(lowered)).items():
+            selected |= self._at_least(counter, shared) & entries
+        # Lowest bit first keeps the order of the vocabulary, so the first matching entry wins as in a linear scan
+        while selected:
+            lowest = selected & -selected
+            yield lowest.bit_length() - 1
+            selected ^= lowest
+
+    def match(self, candidate: Optional[Text]) -> Optional[Text]:
+        if not candidate:
+            return None
+        lowered = candidate.lower()
+        if lowered in self._matches:
+            return self._matches[lowered]
+
+        result = None
+        for position in self._candidates(lowered):
+            if fuzz.ratio(lowered, self._lowered[position]) >= self.threshold:
+                result = self.vocabulary[position]
+                break
+
+        if len(self._matches) < 4096:
+            self._matches[lowered] = result
+        return result
+
+    def match_all(self, candidates: Sequence[Text]) -> List[Optional[Text]]:
+        """Scores a batch of tokens, each distinct token is only scored once."""
+        results = {}
+        with span("fuzzy.match_all", candidates=len(candidates)):
+            for candidate in candidates:
+                key = candidate.lower() if candidate else candidate
+                if key not in results:
+                    results[key] = self.match(candidate)
+        return [results[candidate.lower() if candidate else candidate] for candidate in candidates]
+
+    def match_any(self, candidates: Sequence[Text]) -> Optional[Text]:
+        """Returns the match of the first token that has one."""
+        with span("fuzzy.match_any", candidates=len(candidates)):
+            for candidate in candidates:
+                match = self.match(candidate)
+                if match:
+                    return match
+        return None
+
+
+@lru_cache(maxsize=32)
+def _cached_index(vocabulary: Tuple[Text, ...], threshold: int) -> FuzzyIndex:
+    return FuzzyIndex(vocabulary, threshold)
+
+
+def fuzzy_index(vocabulary: Iterable[Text], threshold: int = DEFAULT_THRESHOLD) -> FuzzyIndex:
+    """Returns the index for a vocabulary, it is only built once per vocabulary and threshold."""
+    return _cached_index(tuple(vocabulary), threshold)
+
+
+def load_lookup_table(path: Text, name: Text) -> List[Text]:
+    """Reads the entries of a Rasa NLU lookup table, e.g. `data/nlu/lookups/vendor.yml`."""
+    with open(path, encoding="utf-8") as file:
+        data = yaml.safe_load(file)
+
+    for item in data.get("nlu", []):
+        if item.get("lookup") == name:
+            examples = item.get("examples", "")
+            return [line.strip()[1:].strip() for line in examples.splitlines() if line.strip().startswith("-")]
+    return []
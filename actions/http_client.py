@@ -0,0 +1,79 @@
+import logging
+from functools import lru_cache
+from typing import Optional, Text, TYPE_CHECKING
+
+from actions.config import get_settings
+
+# requests and aiohttp take a noticeable time to import and most webhook calls make no outbound HTTP request, so they
+# are only imported with the first session
+if TYPE_CHECKING:
+    import aiohttp
+    import requests
+
+logger = logging.getLogger(__name__)
+
+_session: Optional["requests.Session"] = None
+_async_session: Optional["aiohttp.ClientSession"] = None
+
+
+@lru_cache(maxsize=None)
+def _timeout_adapter() -> type:
+    from requests.adapters import HTTPAdapter
+
+    class TimeoutAdapter(HTTPAdapter):
+        """Pooled adapter that applies the configured connect and read timeouts unless a call sets its own."""
+
+        def send(self, request, **kwargs):
+            if kwargs.get("timeout") is None:
+                settings = get_settings()
+                kwargs["timeout"] = (settings.http_connect_timeout, settings.http_read_timeout)
+            return super().send(request, **kwargs)
+
+    return TimeoutAdapter
+
+
+def __getattr__(name: Text):
+    # `TimeoutAdapter` subclasses a class of requests and is created on first use
+    if name == "TimeoutAdapter":
+        return _timeout_adapter()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_session() -> "requests.Session":
+    """Returns the shared session, all outbound calls of the action server (Airtable, ...) should use it."""
+    global _session
+    if _session is None:
+        import requests
+
+        settings = get_settings()
+        _session = requests.Session()
+        adapter = _timeout_adapter()(pool_connections=settings.http_pool_size,
+                                     pool_maxsize=settings.http_pool_per_host)
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+    return _session
+
+
+def get_async_session() -> "aiohttp.ClientSession":
+    """Returns the shared aiohttp session. It is bound to the event loop it is first used on."""
+    global _async_session
+    if _async_session is None or _async_session.closed:
+        import aiohttp
+
+        settings = get_settings()
+        connector = aiohttp.TCPConnector(limit=settings.http_pool_size, limit_per_host=settings.http_pool_per_host,
+                                         keepalive_timeout=settings.http_keepalive_timeout, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(sock_connect=settings.http_connect_timeout,
+                                        sock_read=settings.http_read_timeout)
+        _async_session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return _async_session
+
+
+async def close():
+    global _session, _async_session
+    if _async_session is not None:
+        await _async_session.close()
+        _async_session = None
+    if _session is not None:
+        _session.close()
+        _session = None
@@ -0,0 +1,258 @@
+"""Local copy of the submitted incidents in SQLite for triage queries.
+
+Every incident the action server submits is also written to `INCIDENT_STORE_PATH` (WAL mode, so queries do not block
+the writer). The columns used to slice incidents are indexed together with the submission time, so grouped counts over
+a time window read only the matching index range. The contact email is not stored.
+
+    $ python -m actions.incident_store count --group-by os_version,app_version --where platform=android --since 24h
+    $ python -m actions.incident_store count --group-by platform --since 7d --window 1d
+    $ python -m actions.incident_store list --where content_id=tagesschau --since 2021-06-01 --limit 20
+
+Both commands write one JSON object per line.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+from datetime import datetime, timezone
+from time import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Text
+
+from actions.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Columns of the store and the incident fields they are filled from
+COLUMNS = {
+    "platform": "Platform",
+    "os": "OS",
+    "os_version": "OS Version",
+    "app_version": "App Version",
+    "vendor": "Vendor",
+    "model": "Device Model",
+    "content_type": "Content Type",
+    "content_id": "Content ID",
+    "connectivity": "Connectivity",
+    "interruption": "Interruption",
+    "error_msg": "Error Msg",
+    "problem": "Problem Statement",
+    "expected": "Expected Behavior",
+    "steps": "Steps to reproduce",
+}
+
+INDEXED_COLUMNS = ("platform", "os", "os_version", "app_version", "vendor", "content_id")
+
+# Columns incidents can be grouped and filtered by
+DIMENSIONS = ("platform", "os", "os_version", "app_version", "vendor", "model", "content_type", "content_id",
+              "connectivity", "interruption", "error_msg")
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS incidents (id INTEGER PRIMARY KEY, created REAL NOT NULL, "
+    + ", ".join(f"{column} TEXT COLLATE NOCASE" for column in COLUMNS) + ")",
+    "CREATE INDEX IF NOT EXISTS incidents_created ON incidents (created)",
+] + [f"CREATE INDEX IF NOT EXISTS incidents_{column} ON incidents ({column}, created)" for column in INDEXED_COLUMNS]
+
+_DURATION = re.compile(r"^(\d+(?:\.\d+)?)([smhd])$")
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+_store: Optional["IncidentStore"] = None
+
+
+class IncidentStore:
+
+    def __init__(self, path: Text, read_only: bool = False):
+        self.path = path
+        if read_only:
+            self._connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            # Airtable is the system of record, losing the last transactions on a power failure is acceptable
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            with self._connection:
+                for statement in SCHEMA:
+                    self._connection.execute(statement)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+
+    def add(self, fields: Dict[Text, Any], created: Optional[float] = None) -> int:
+        values = [created if created is not None else time()]
+        values.extend(str(join_values(fields.get(field)) or "") for field in COLUMNS.values())
+        placeholders = ", ".join("?" * len(values))
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                f"INSERT INTO incidents (created, {', '.join(COLUMNS)}) VALUES ({placeholders})", values)
+        return cursor.lastrowid
+
+    def aggregate(self, group_by: Sequence[Text] = (), where: Optional[Dict[Text, Text]] = None,
+                  since: Optional[float] = None, until: Optional[float] = None,
+                  window: Optional[float] = None) -> Iterator[Dict[Text, Any]]:
+        """Counts incidents per combination of the `group_by` columns and, with `window`, per time window of that many
+        seconds. Yields the most frequent combinations first (per window)."""
+        _check_dimensions(group_by)
+        selected = list(group_by)
+        parameters: List[Any] = []
+        if window:
+            selected.insert(0, "CAST(created / ? AS INTEGER) * ? AS window_start")
+            parameters.extend([window, window])
+        conditions, condition_parameters = _conditions(where, since, until)
+        parameters.extend(condition_parameters)
+
+        sql = f"SELECT {', '.join(selected + ['COUNT(*) AS count'])} FROM incidents{conditions}"
+        keys = (["window_start"] if window else []) + list(group_by)
+        if keys:
+            sql += f" GROUP BY {', '.join(keys)}"
+        ordering = (["window_start"] if window else []) + ["count DESC"] + list(group_by)
+        sql += f" ORDER BY {', '.join(ordering)}"
+        for row in self._execute(sql, parameters):
+            result = dict(row)
+            if window:
+                result["window"] = _format_time(result.pop("window_start"))
+            yield result
+
+    def incidents(self, where: Optional[Dict[Text, Text]] = None, since: Optional[float] = None,
+                  until: Optional[float] = None, limit: Optional[int] = None) -> Iterator[Dict[Text, Any]]:
+        """Yields the matching incidents, newest first."""
+        conditions, parameters = _conditions(where, since, until)
+        sql = f"SELECT * FROM incidents{conditions} ORDER BY created DESC"
+        if limit:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+        for row in self._execute(sql, parameters):
+            result = dict(row)
+            result["created"] = _format_time(result["created"])
+            yield result
+
+    def _execute(self, sql: Text, parameters: Sequence[Any]) -> Iterator[sqlite3.Row]:
+        # Rows are fetched lazily so large results stream
+        cursor = self._connection.execute(sql, parameters)
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
+
+    def close(self):
+        self._connection.close()
+
+
+def _check_dimensions(columns: Sequence[Text]):
+    unknown = [column for column in columns if column not in DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Unknown incident columns {', '.join(unknown)}, use one of {', '.join(DIMENSIONS)}")
+
+
+def _conditions(where: Optional[Dict[Text, Text]], since: Optional[float], until: Optional[float]):
+    where = where or {}
+    _check_dimensions(list(where))
+    clauses = [f"{column} = ?" for column in where]
+    parameters: List[Any] = list(where.values())
+    if since is not None:
+        clauses.append("created >= ?")
+        parameters.append(since)
+    if until is not None:
+        clauses.append("created < ?")
+        parameters.append(until)
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), parameters
+
+
+def _format_time(timestamp: float) -> Text:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec="seconds")
+
+
+def get_incident_store() -> Optional[IncidentStore]:
+    global _store
+    path = get_settings().incident_store_path
+    if _store is None and path:
+        _store = IncidentStore(path)
+    return _store
+
+
+def join_values(value: Any) -> Any:
+    """The values of a list slot (e.g. the app versions of the validators) as one text, so filters match them."""
+    if isinstance(value, (list, tuple)):
+        return ", ".join(str(item) for item in value)
+    return value
+
+
+def _store_incident(fields: Dict[Text, Any]):
+    try:
+        store = get_incident_store()
+        if store is not None:
+            store.add(fields)
+    except (sqlite3.Error, OSError) as err:
+        logger.error("Could not store incident locally: %s", err)
+
+
+async def store_incident(fields: Dict[Text, Any]):
+    """Adds a submitted incident to the local store. Failures are logged, the submission itself already succeeded.
+
+    The store is shared by the forked workers and may wait for their writes, so it is written on the default executor.
+    """
+    await asyncio.get_event_loop().run_in_executor(None, _store_incident, fields)
+
+
+def parse_time(value: Text, now: Optional[float] = None) -> float:
+    """Parses a duration before now (30m, 24h, 7d) or an ISO date or time (UTC unless it has an offset)."""
+    match = _DURATION.match(value)
+    if match:
+        return (now if now is not None else time()) - float(match.group(1)) * _UNITS[match.group(2)]
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def parse_duration(value: Text) -> float:
+    match = _DURATION.match(value)
+    if not match:
+        raise argparse.ArgumentTypeError(f"Invalid duration {value}, use e.g. 30m, 1h or 1d")
+    return float(match.group(1)) * _UNITS[match.group(2)]
+
+
+def parse_condition(value: Text):
+    column, separator, expected = value.partition("=")
+    if not separator:
+        raise argparse.ArgumentTypeError(f"Invalid condition {value}, use column=value")
+    return column.strip(), expected.strip()
+
+
+def main(arguments: Optional[List[Text]] = None):
+    parser = argparse.ArgumentParser(description="Query the local incident store, results are written as JSON lines.")
+    parser.add_argument("--path", default=get_settings().incident_store_path, help="Path of the store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    count = commands.add_parser("count", help="Count incidents, optionally per group and time window")
+    count.add_argument("--group-by", default="", help=f"Comma separated columns: {', '.join(DIMENSIONS)}")
+    count.add_argument("--window", type=parse_duration, help="Also count per time window, e.g. 1h or 1d")
+    listing = commands.add_parser("list", help="List incidents, newest first")
+    listing.add_argument("--limit", type=int, help="Maximum number of incidents")
+    for command in (count, listing):
+        command.add_argument("--where", type=parse_condition, action="append", default=[],
+                             help="Only incidents with this column value, e.g. os=android (repeatable)")
+        command.add_argument("--since", type=parse_time, help="Start, e.g. 24h (ago) or 2021-06-01")
+        command.add_argument("--until", type=parse_time, help="End (exclusive), same formats as --since")
+    args = parser.parse_args(arguments)
+    if not args.path or not os.path.exists(args.path):
+        parser.error(f"No incident store at {args.path!r}, see INCIDENT_STORE_PATH")
+
+    store = IncidentStore(args.path, read_only=True)
+    try:
+        if args.command == "count":
+            group_by = [column.strip() for column in args.group_by.split(",") if column.strip()]
+            rows = store.aggregate(group_by, dict(args.where), args.since, args.until, args.window)
+        else:
+            rows = store.incidents(dict(args.where), args.since, args.until, args.limit)
+        for row in rows:
+            sys.stdout.write(json.dumps(row, ensure_ascii=False) + "\n")
+    except ValueError as err:
+        parser.error(str(err))
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
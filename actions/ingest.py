@@ -0,0 +1,249 @@
+"""Loads the device catalogue into a new Elasticsearch index and moves the catalogue alias to it.
+
+    $ python -m actions.ingest devices.csv [--alias supported_devices_v2] [--keep 1] [--snapshot devices.jsonl]
+
+Devices are streamed from a CSV file (one column per field), a JSON array or JSON lines into a new index named after
+the alias and the current time, with parallel bulk requests while refreshes and replicas are disabled. Once every
+device is indexed the index is merged, refreshes and replicas are restored and the alias is moved to the new index in
+one atomic request. Lookups of the action server (`ELASTIC_INDEX`) switch from the complete old catalogue to the
+complete new one without downtime. Previous indices are kept for a rollback (`--keep`). An index named like the alias,
+as created before the catalogue was aliased, is replaced in the same request.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+from datetime import datetime
+from time import monotonic
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Text, TextIO, Tuple
+
+from actions.config import get_settings
+from actions.device_index import FIELD_ANDROID_SDK, FIELD_FORM_FACTOR, FIELD_MANUFACTURER, FIELD_MODEL
+
+logger = logging.getLogger(__name__)
+
+# Seconds between progress reports
+PROGRESS_INTERVAL = 5
+
+# The subfields are searched by the fast path of ELASTIC_SEARCH_MODE=tiered, exact matches first, then prefixes
+_normalized_text = {"type": "text", "fields": {
+    "exact": {"type": "keyword", "normalizer": "folded"},
+    "completion": {"type": "completion", "analyzer": "folded_words"},
+}}
+
+INDEX_SETTINGS = {
+    "analysis": {
+        "normalizer": {"folded": {"type": "custom", "filter": ["lowercase", "asciifolding"]}},
+        "analyzer": {"folded_words": {"type": "custom", "tokenizer": "standard",
+                                      "filter": ["lowercase", "asciifolding"]}},
+    },
+}
+
+MAPPING = {
+    # Further columns of the source file are stored but not indexed
+    "dynamic": False,
+    "properties": {
+        FIELD_MODEL: _normalized_text,
+        FIELD_MANUFACTURER: _normalized_text,
+        FIELD_FORM_FACTOR: {"type": "keyword"},
+        FIELD_ANDROID_SDK: {"type": "keyword", "index": False, "doc_values": False},
+    },
+}
+
+
+class IngestError(Exception):
+    """The catalogue was not loaded completely, the alias was not moved."""
+
+
+class IngestReport(NamedTuple):
+    index: Text
+    indexed: int
+    failed: int
+    skipped: int
+    seconds: float
+
+    @property
+    def per_second(self) -> float:
+        return self.indexed / self.seconds if self.seconds else 0.0
+
+
+def clean_document(row: Dict[Text, Any]) -> Optional[Dict[Text, Any]]:
+    """Strips values and turns empty ones into null. Devices without a model name are skipped (None)."""
+    document = row.get("_source", row)
+    cleaned = {}
+    for key, value in document.items():
+        if key is None:
+            continue
+        if isinstance(value, str):
+            value = value.strip() or None
+        cleaned[key.strip()] = value
+    if not cleaned.get(FIELD_MODEL):
+        return None
+    return cleaned
+
+
+def _read_rows(file: TextIO, path: Text) -> Iterator[Dict[Text, Any]]:
+    if path.lower().endswith(".csv"):
+        yield from csv.DictReader(file)
+        return
+
+    first = file.read(1)
+    while first.isspace():
+        first = file.read(1)
+    if first == "[":
+        yield from json.loads(first + file.read())
+        return
+    for number, line in enumerate(file, start=1):
+        line = first + line if number == 1 else line
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_documents(path: Text, skipped: List[int]) -> Iterator[Dict[Text, Any]]:
+    """Streams the cleaned devices of a CSV, JSON array or JSON lines file, counting skipped rows in `skipped[0]`."""
+    with open(path, encoding="utf-8", newline="") as file:
+        for row in _read_rows(file, path):
+            document = clean_document(row)
+            if document is None:
+                skipped[0] += 1
+                continue
+            yield document
+
+
+def index_name(alias: Text, now: Optional[datetime] = None) -> Text:
+    return f"{alias}_{(now or datetime.now()):%Y%m%d%H%M%S}"
+
+
+def create_index(client, name: Text, shards: int = 1):
+    settings = dict(INDEX_SETTINGS, number_of_shards=shards, number_of_replicas=0, refresh_interval="-1")
+    client.indices.create(index=name, body={"settings": settings, "mappings": MAPPING})
+
+
+def bulk_load(client, index: Text, documents: Iterable[Dict[Text, Any]], threads: int = 4,
+              chunk_size: int = 500) -> Tuple[int, int]:
+    """Indexes `documents` with parallel bulk requests, returns the number of indexed and failed documents."""
+    from elasticsearch.helpers import parallel_bulk
+
+    actions = ({"_index": index, "_source": document} for document in documents)
+    indexed = failed = 0
+    started = last_report = monotonic()
+    for ok, item in parallel_bulk(client, actions, thread_count=threads, chunk_size=chunk_size,
+                                  raise_on_error=False, raise_on_exception=False, request_timeout=60):
+        if ok:
+            indexed += 1
+        else:
+            failed += 1
+            if failed <= 10:
+                logger.error("Could not index device: %s", item)
+        now = monotonic()
+        if now - last_report >= PROGRESS_INTERVAL:
+            last_report = now
+            logger.info("Indexed %s devices (%.0f/s)", indexed, indexed / (now - started))
+    return indexed, failed
+
+
+def aliased_indices(client, alias: Text) -> Tuple[List[Text], bool]:
+    """Indices the alias points to and whether a (not aliased) index is named like the alias."""
+    if client.indices.exists_alias(name=alias):
+        return sorted(client.indices.get_alias(name=alias)), False
+    return [], bool(client.indices.exists(index=alias))
+
+
+def swap_alias(client, alias: Text, index: Text):
+    """Points the alias to `index` only, in one atomic request."""
+    previous, concrete = aliased_indices(client, alias)
+    actions: List[Dict[Text, Any]] = [{"remove": {"index": name, "alias": alias}} for name in previous]
+    if concrete:
+        actions.append({"remove_index": {"index": alias}})
+    actions.append({"add": {"index": index, "alias": alias}})
+    client.indices.update_aliases(body={"actions": actions})
+
+
+def prune_indices(client, alias: Text, current: Text, keep: int) -> List[Text]:
+    """Deletes all but the `keep` newest previous versions of the catalogue, returns the deleted indices."""
+    prefix = f"{alias}_"
+    versions = sorted(name for name in client.indices.get(index=prefix + "*")
+                      if name != current and name[len(prefix):].isdigit())
+    deleted = versions[:max(len(versions) - keep, 0)]
+    for name in deleted:
+        client.indices.delete(index=name)
+    return deleted
+
+
+def ingest(client, path: Text, alias: Text, threads: int = 4, chunk_size: int = 500, shards: int = 1,
+           replicas: int = 1, keep: int = 1, max_errors: int = 0, snapshot: Optional[Text] = None) -> IngestReport:
+    index = index_name(alias)
+    skipped = [0]
+    documents = read_documents(path, skipped)
+    if snapshot:
+        documents = _write_snapshot(documents, snapshot + ".tmp")
+
+    started = monotonic()
+    create_index(client, index, shards)
+    try:
+        indexed, failed = bulk_load(client, index, documents, threads, chunk_size)
+        if failed > max_errors:
+            raise IngestError(f"{failed} devices could not be indexed")
+        if not indexed:
+            raise IngestError(f"{path} contains no devices")
+
+        # The catalogue is read only until the next ingestion, one segment per shard makes lookups cheapest
+        client.indices.forcemerge(index=index, max_num_segments=1, request_timeout=300)
+        client.indices.put_settings(index=index, body={"index": {"refresh_interval": "1s",
+                                                                 "number_of_replicas": replicas}})
+        client.indices.refresh(index=index)
+    except BaseException:
+        client.indices.delete(index=index, ignore_unavailable=True)
+        if snapshot and os.path.exists(snapshot + ".tmp"):
+            os.remove(snapshot + ".tmp")
+        raise
+
+    swap_alias(client, alias, index)
+    if snapshot:
+        os.replace(snapshot + ".tmp", snapshot)
+    seconds = monotonic() - started
+    for name in prune_indices(client, alias, index, keep):
+        logger.info("Deleted previous catalogue index %s", name)
+    return IngestReport(index, indexed, failed, skipped[0], seconds)
+
+
+def _write_snapshot(documents: Iterable[Dict[Text, Any]], path: Text) -> Iterator[Dict[Text, Any]]:
+    """Writes the devices as JSON lines for `DEVICE_INDEX_PATH` while they are indexed."""
+    with open(path, "w", encoding="utf-8") as file:
+        for document in documents:
+            file.write(json.dumps(document, ensure_ascii=False) + "\n")
+            yield document
+
+
+def main():
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description="Loads the device catalogue into a new index and moves the alias "
+                                                 "read by the action server to it.")
+    parser.add_argument("path", help="CSV, JSON array or JSON lines file with one device per row")
+    parser.add_argument("--alias", default=settings.elastic_index, help="Alias read by the action server")
+    parser.add_argument("--threads", type=int, default=4, help="Concurrent bulk requests")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Devices per bulk request")
+    parser.add_argument("--shards", type=int, default=1, help="Primary shards of the new index")
+    parser.add_argument("--replicas", type=int, default=1, help="Replicas of the new index once it is loaded")
+    parser.add_argument("--keep", type=int, default=1, help="Previous catalogue indices kept for a rollback")
+    parser.add_argument("--max-errors", type=int, default=0, help="Devices that may fail to index")
+    parser.add_argument("--snapshot", help="Also write the devices to this file, for DEVICE_INDEX_PATH")
+    args = parser.parse_args()
+
+    from actions.elastic import get_client
+    try:
+        report = ingest(get_client(), args.path, args.alias, threads=args.threads, chunk_size=args.chunk_size,
+                        shards=args.shards, replicas=args.replicas, keep=args.keep, max_errors=args.max_errors,
+                        snapshot=args.snapshot)
+    except IngestError as err:
+        logger.error("Ingestion failed, %s still points to the previous catalogue: %s", args.alias, err)
+        raise SystemExit(1)
+    print(f"Indexed {report.indexed} devices into {report.index} in {report.seconds:.1f}s "
+          f"({report.per_second:.0f}/s), {report.failed} failed, {report.skipped} skipped. "
+          f"{args.alias} points to {report.index}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,105 @@
+import gc
+import logging
+from time import monotonic
+from typing import Any, Dict, Text
+
+from actions import elastic, http_client
+from actions.config import get_settings
+from actions.form_plans import FormPlanError, get_form_plans, reload_form_plans
+from actions.fuzzy import fuzzy_index
+from actions.spool import get_worker, worker_spool_path
+from actions.util import android, ios
+
+logger = logging.getLogger(__name__)
+
+STATE_STARTING = "starting"
+STATE_WARMING_UP = "warming_up"
+STATE_READY = "ready"
+STATE_STOPPING = "stopping"
+
+_state = STATE_STARTING
+_checks: Dict[Text, Any] = {}
+
+
+def preload():
+    """Loads what the worker processes of `actions.workers` share before they are forked: the matchers, the form plans
+    and the catalogue snapshot. Runs again for a graceful restart, so changed files are read.
+
+    Must not open connections or start threads, a forked process cannot use them.
+    """
+    fuzzy_index(ios)
+    fuzzy_index(android)
+    reload_form_plans()
+    elastic.load_local_index()
+    # The preloaded objects live as long as the workers. Moving them out of the collected generations keeps garbage
+    # collections in the workers from writing to their pages, which would copy them into every worker.
+    gc.collect()
+    gc.freeze()
+
+
+def start_worker(number: int):
+    """Prepares a forked worker process before it serves, every worker submits the incidents of its own spool."""
+    settings = get_settings()
+    settings.incident_spool_path = worker_spool_path(settings.incident_spool_path, number)
+
+
+async def warm_up():
+    """Prepares the worker before it takes traffic: opens pools, pings the cluster and fills caches.
+
+    Failing steps are logged and reported by `readiness` but do not stop the server, every resource is also created
+    lazily on first use.
+    """
+    global _state
+    _state = STATE_WARMING_UP
+    started = monotonic()
+    get_settings()
+
+    http_client.get_session()
+    http_client.get_async_session()
+    _checks["http_pool"] = True
+
+    fuzzy_index(ios)
+    fuzzy_index(android)
+    _checks["matchers"] = True
+
+    try:
+        get_form_plans()
+        _checks["form_plans"] = True
+    except FormPlanError as err:
+        logger.error("%s", err)
+        _checks["form_plans"] = str(err)
+
+    try:
+        await elastic.warm_up()
+        _checks["catalogue"] = True
+    except Exception as err:
+        logger.exception("Warming up the device catalogue failed")
+        _checks["catalogue"] = str(err)
+    _checks["elasticsearch"] = await elastic.ping()
+
+    try:
+        # Replays incidents left in the spool by the previous process
+        get_worker().start()
+        _checks["incident_spool"] = True
+    except OSError as err:
+        logger.error("Incident spool is not available: %s", err)
+        _checks["incident_spool"] = str(err)
+
+    _state = STATE_READY
+    logger.info("Action server warmed up in %.2fs: %s", monotonic() - started, _checks)
+
+
+async def shut_down():
+    global _state
+    _state = STATE_STOPPING
+    await get_worker().stop()
+    await elastic.close_async_client()
+    await http_client.close()
+
+
+def is_ready() -> bool:
+    return _state == STATE_READY
+
+
+def readiness() -> Dict[Text, Any]:
+    return {"status": _state, "checks": dict(_checks)}
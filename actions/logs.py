@@ -0,0 +1,204 @@
+"""Logging of the action server through a queue.
+
+`configure_logging` routes all records through a bounded queue. On the calling thread a record is only checked
+against the level, the sample rate and the rate limit of its category and enqueued; a background thread formats and
+writes it. Message formatting, payload serialization and stream I/O therefore never run on the event loop. Records that
+are sampled out, exceed the rate limit or find the queue full are dropped and counted in
+`bugbot_log_records_dropped_total`.
+
+The category of a record is its `category` extra (e.g. `logger.debug(..., extra=SLOTS)`) or else its logger name.
+Arguments of a record are formatted on the writer thread and must not be mutated after logging them.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from time import monotonic
+from typing import Any, Callable, Dict, List, Mapping, Optional, Text
+
+from actions.config import Settings, get_settings
+from actions.metrics import LOG_RECORDS_DROPPED
+from actions.tracing import current_trace
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s - %(message)s"
+
+# Categories of the records logged on every turn
+SLOTS = {"category": "slots"}
+CATALOGUE = {"category": "catalogue"}
+INCIDENTS = {"category": "incidents"}
+
+# Attributes every record has, everything else was passed as extra
+_STANDARD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+_listener: Optional[QueueListener] = None
+_handler: Optional["QueueingHandler"] = None
+_stream: Optional[logging.Handler] = None
+
+_atexit_registered = False
+
+
+def category_of(record: logging.LogRecord) -> Text:
+    return getattr(record, "category", record.name)
+
+
+class Payload:
+    """A large value passed as argument of a log record, serialized as JSON only when the record is written."""
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value: Any, limit: Optional[int] = None):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self) -> Text:
+        limit = self.limit if self.limit is not None else get_settings().log_payload_max
+        text = json.dumps(self.value, default=str, ensure_ascii=False)
+        if len(text) > limit:
+            return f"{text[:limit]}... ({len(text) - limit} more characters)"
+        return text
+
+    __repr__ = __str__
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a share of the records below WARNING per category and at most `rate_limit` records per second and
+    category (a token bucket allowing bursts of one second)."""
+
+    def __init__(self, sample_rates: Mapping[Text, float], rate_limit: float,
+                 clock: Callable[[], float] = monotonic):
+        super().__init__()
+        self.sample_rates = dict(sample_rates)
+        self.rate_limit = rate_limit
+        self._clock = clock
+        self._buckets: Dict[Text, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        category = category_of(record)
+        if record.levelno < logging.WARNING:
+            rate = self.sample_rates.get(category)
+            if rate is not None and rate < 1 and random.random() >= rate:
+                LOG_RECORDS_DROPPED.inc(category=category, reason="sampled")
+                return False
+        if self.rate_limit > 0 and not self._take(category):
+            LOG_RECORDS_DROPPED.inc(category=category, reason="rate_limited")
+            return False
+        return True
+
+    def _take(self, category: Text) -> bool:
+        now = self._clock()
+        with self._lock:
+            bucket = self._buckets.get(category)
+            if bucket is None:
+                bucket = self._buckets[category] = [self.rate_limit, now]
+            tokens = min(self.rate_limit, bucket[0] + (now - bucket[1]) * self.rate_limit)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                return False
+            bucket[0] = tokens - 1
+            return True
+
+
+class QueueingHandler(QueueHandler):
+    """Enqueues records unformatted and drops them instead of blocking when the queue is full."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The trace lives in a context variable of the calling thread
+        trace = current_trace()
+        if trace is not None:
+            record.trace_id = trace.trace_id
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc(category=category_of(record), reason="queue_full")
+
+
+class StructuredFormatter(logging.Formatter):
+    """Formats a record as one JSON object, including the extras passed with it."""
+
+    def format(self, record: logging.LogRecord) -> Text:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def create_formatter(log_format: Text) -> logging.Formatter:
+    if log_format == "json":
+        return StructuredFormatter()
+    return logging.Formatter(TEXT_FORMAT)
+
+
+def configure_logging(settings: Optional[Settings] = None, stream: Optional[logging.Handler] = None) -> QueueHandler:
+    """Replaces the handlers of the root logger by a queue written to `stream` (stderr) on a background thread."""
+    global _listener, _handler, _stream, _atexit_registered
+    settings = settings or get_settings()
+    stop_logging()
+
+    _stream = stream or logging.StreamHandler()
+    if _stream.formatter is None:
+        _stream.setFormatter(create_formatter(settings.log_format))
+    _handler = QueueingHandler(queue.Queue(settings.log_queue_size))
+    _handler.addFilter(SamplingFilter(settings.log_sample_rates, settings.log_rate_limit))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_handler)
+    root.setLevel(settings.log_level)
+
+    _listener = QueueListener(_handler.queue, _stream, respect_handler_level=True)
+    _listener.start()
+    if not _atexit_registered:
+        atexit.register(stop_logging)
+        _atexit_registered = True
+    return _handler
+
+
+def stop_logging():
+    """Writes the queued records and lets the root logger write to the stream directly from then on."""
+    global _listener, _handler
+    if _listener is None:
+        return
+    _listener.stop()
+    root = logging.getLogger()
+    root.removeHandler(_handler)
+    root.addHandler(_stream)
+    _listener = None
+    _handler = None
+
+
+def _reset_after_fork():
+    # A forked process has no writer thread and the queue may have been locked by it during the fork. The child writes
+    # to the stream directly until it calls `configure_logging` itself.
+    global _listener, _handler
+    if _listener is None:
+        return
+    root = logging.getLogger()
+    root.removeHandler(_handler)
+    root.addHandler(_stream)
+    _listener = None
+    _handler = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Text, Tuple
+
+from actions import elastic
+from actions.cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+_current: ContextVar[Optional["LookupContext"]] = ContextVar("lookup_context", default=None)
+
+
+class LookupContext:
+    """Catalogue lookups of one webhook call, shared by all validators of that call.
+
+    Lookups for the slots extracted in a turn are started together when the call begins, so the validators await
+    lookups that are already running instead of querying the catalogue one after the other. A manufacturer that the
+    model lookup of the same turn resolves is answered from the model hit. While that model lookup is still running the
+    manufacturer is queried alongside it, the query is cancelled once the model hit answers it.
+    """
+
+    def __init__(self, search_model=None, search_manufacturer=None):
+        self._search_model = search_model or elastic.search_model_async
+        self._search_manufacturer = search_manufacturer or elastic.search_manufacturer_async
+        self._lookups: Dict[Tuple[Text, Text], "asyncio.Task[Dict[Text, Any]]"] = {}
+        self.queries = 0
+        self.reused = 0
+
+    def _start(self, kind: Text, query: Text, lookup) -> "asyncio.Task[Dict[Text, Any]]":
+        key = (kind, normalize_query(query))
+        task = self._lookups.get(key)
+        if task is None:
+            task = asyncio.ensure_future(lookup())
+            self._lookups[key] = task
+        return task
+
+    def prefetch_model(self, model: Text):
+        self._start('model', model, lambda: self._lookup_model(model))
+
+    def prefetch_manufacturer(self, manufacturer: Text):
+        self._start('manufacturer', manufacturer, lambda: self._lookup_manufacturer(manufacturer))
+
+    async def search_model(self, model: Text) -> Dict[Text, Any]:
+        if not model:
+            return await self._search_model(model)
+        return dict(await self._start('model', model, lambda: self._lookup_model(model)))
+
+    async def search_manufacturer(self, manufacturer: Text) -> Dict[Text, Any]:
+        if not manufacturer:
+            return await self._search_manufacturer(manufacturer)
+        return dict(await self._start('manufacturer', manufacturer, lambda: self._lookup_manufacturer(manufacturer)))
+
+    async def _lookup_model(self, model: Text) -> Dict[Text, Any]:
+        self.queries += 1
+        return await self._search_model(model)
+
+    async def _lookup_manufacturer(self, manufacturer: Text) -> Dict[Text, Any]:
+        # Only the model lookups started before this one are considered, the validators never start them later
+        model_lookups = [task for (kind, _), task in self._lookups.items() if kind == 'model']
+        search: Optional["asyncio.Task[Dict[Text, Any]]"] = None
+        try:
+            for task in model_lookups:
+                if search is None and not task.done():
+                    # Queried while the model lookups finish, dropped if one of their hits answers it
+                    self.queries += 1
+                    search = asyncio.ensure_future(self._search_manufacturer(manufacturer))
+                try:
+                    hit = (await task).get("hit", {})
+                except Exception:
+                    continue
+                if hit.get("Manufacturer", "").strip().lower() == manufacturer.strip().lower():
+                    self.reused += 1
+                    return {"hit": hit}
+
+            if search is None:
+                self.queries += 1
+                search = asyncio.ensure_future(self._search_manufacturer(manufacturer))
+            return await search
+        finally:
+            if search is not None and not search.done():
+                search.cancel()
+
+    def close(self):
+        """Cancels lookups no validator asked for."""
+        for task in self._lookups.values():
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled() and task.exception():
+                logger.debug("Prefetched lookup failed: %s", task.exception())
+
+
+@contextmanager
+def turn_lookups(**kwargs):
+    """Makes a new `LookupContext` the current one for the duration of a webhook call."""
+    context = LookupContext(**kwargs)
+    token = _current.set(context)
+    try:
+        yield context
+    finally:
+        _current.reset(token)
+        context.close()
+
+
+def current_lookups() -> Optional[LookupContext]:
+    return _current.get()
+
+
+async def search_model(model: Text) -> Dict[Text, Any]:
+    """Looks up a model through the lookup context of the current call if there is one."""
+    context = current_lookups()
+    if context is None:
+        return await elastic.search_model_async(model)
+    return await context.search_model(model)
+
+
+async def search_manufacturer(manufacturer: Text) -> Dict[Text, Any]:
+    context = current_lookups()
+    if context is None:
+        return await elastic.search_manufacturer_async(manufacturer)
+    return await context.search_manufacturer(manufacturer)
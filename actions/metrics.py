@@ -0,0 +1,209 @@
+"""Process wide latency histograms and counters, rendered in the Prometheus text format on `GET /metrics`."""
+import functools
+import inspect
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Dict, List, Sequence, Text, Tuple
+
+from actions import tracing
+
+# Seconds, from a cached lookup up to a slow Airtable request
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+INFINITY = 'le="+Inf"'
+
+
+def _format_labels(names: Sequence[Text], values: Sequence[Text], extra: Text = "") -> Text:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: Text) -> Text:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> Text:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: Text, documentation: Text, label_names: Sequence[Text] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[Text, Text]) -> Tuple[Text, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> List[Text]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[Text]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: Text, documentation: Text, label_names: Sequence[Text] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[Tuple[Text, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: Text):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Text) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[Text]:
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                for key, value in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: Text, documentation: Text, label_names: Sequence[Text] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: observations per bucket (not cumulative), sum and count
+        self._values: Dict[Tuple[Text, ...], List] = {}
+
+    def observe(self, value: float, **labels: Text):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels: Text):
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - started, **labels)
+
+    def count(self, **labels: Text) -> int:
+        entry = self._values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def _samples(self) -> List[Text]:
+        lines = []
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, INFINITY)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[Text, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> Text:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+ACTION_DURATION: Histogram = REGISTRY.register(Histogram(
+    "bugbot_action_duration_seconds", "Time spent running an action", ["action"]))
+ACTION_ERRORS: Counter = REGISTRY.register(Counter(
+    "bugbot_action_errors_total", "Actions that raised an exception", ["action"]))
+VALIDATOR_DURATION: Histogram = REGISTRY.register(Histogram(
+    "bugbot_validator_duration_seconds", "Time spent validating a slot", ["action", "slot"]))
+BACKEND_DURATION: Histogram = REGISTRY.register(Histogram(
+    "bugbot_backend_request_duration_seconds", "Time spent on requests to a backend, including failed ones",
+    ["backend", "operation"]))
+BACKEND_RETRIES: Counter = REGISTRY.register(Counter(
+    "bugbot_backend_retries_total", "Failed backend calls that were retried", ["backend"]))
+CACHE_REQUESTS: Counter = REGISTRY.register(Counter(
+    "bugbot_cache_requests_total", "Cache lookups by result (hit or miss)", ["cache", "result"]))
+CATALOGUE_LOOKUPS: Counter = REGISTRY.register(Counter(
+    "bugbot_catalogue_lookups_total", "Catalogue searches sent to Elasticsearch by the tier that answered them (exact, "
+    "prefix, full or miss)", ["kind", "tier"]))
+CONFIRMATIONS: Counter = REGISTRY.register(Counter(
+    "bugbot_confirmations_total", "Times the user was asked to confirm a slot value", ["slot"]))
+LOG_RECORDS_DROPPED: Counter = REGISTRY.register(Counter(
+    "bugbot_log_records_dropped_total", "Log records not written, by reason (sampled, rate_limited or queue_full)",
+    ["category", "reason"]))
+
+
+def render() -> Text:
+    return REGISTRY.render()
+
+
+def _instrument(method: Callable, histogram: Histogram, traced: Callable, errors: Counter = None,
+                **labels: Text) -> Callable:
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = perf_counter()
+        try:
+            with traced(*args, **kwargs):
+                return await method(*args, **kwargs)
+        except Exception:
+            if errors is not None:
+                errors.inc(**labels)
+            raise
+        finally:
+            histogram.observe(perf_counter() - started, **labels)
+
+    return wrapper
+
+
+def _traced_run(action: Text):
+    def traced(self, dispatcher, tracker, domain):
+        return tracing.trace_call(action, getattr(tracker, "sender_id", None))
+    return traced
+
+
+def _traced_validator(name: Text):
+    return lambda *args, **kwargs: tracing.span(name)
+
+
+def instrumented(cls):
+    """Class decorator timing (and tracing) `run` and, for form validation actions, every `validate_<slot>` method."""
+    action = cls().name()
+    for attribute, method in list(vars(cls).items()):
+        if not inspect.iscoroutinefunction(method):
+            continue
+        if attribute == "run":
+            setattr(cls, attribute, _instrument(method, ACTION_DURATION, _traced_run(action), ACTION_ERRORS,
+                                                action=action))
+        elif attribute.startswith("validate_"):
+            setattr(cls, attribute, _instrument(method, VALIDATOR_DURATION, _traced_validator(attribute),
+                                                action=action, slot=attribute[len("validate_"):]))
+    return cls
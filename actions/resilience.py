@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import monotonic, sleep
+from typing import Awaitable, Callable, Optional, Text, Tuple, Type, TypeVar
+
+from actions.metrics import BACKEND_RETRIES
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+# Absolute (monotonic) point in time until which the current webhook call has to be answered
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+class ResilienceError(Exception):
+    pass
+
+
+class CircuitOpenError(ResilienceError):
+    pass
+
+
+class DeadlineExceeded(ResilienceError):
+    pass
+
+
+class RetriesExhausted(ResilienceError):
+    pass
+
+
+class CircuitBreaker:
+    """Stops calling a backend after `failure_threshold` consecutive failures.
+
+    While open all calls are rejected. After `reset_timeout` seconds a single trial call is let through (half open),
+    its outcome either closes the circuit again or keeps it open for another `reset_timeout`.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30, clock: Callable[[], float] = monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_started_at = 0.0
+
+    def allow_request(self) -> bool:
+        if self.state == STATE_CLOSED:
+            return True
+
+        now = self.clock()
+        if self.state == STATE_OPEN and now - self._opened_at >= self.reset_timeout:
+            self.state = STATE_HALF_OPEN
+            self._trial_started_at = now
+            return True
+        # A trial that never reported back (e.g. it was cancelled) must not keep the circuit half open forever
+        if self.state == STATE_HALF_OPEN and now - self._trial_started_at >= self.reset_timeout:
+            self._trial_started_at = now
+            return True
+        return False
+
+    @property
+    def is_open(self) -> bool:
+        """Whether a call would be rejected now. Unlike `allow_request` this does not let a trial call through."""
+        now = self.clock()
+        if self.state == STATE_OPEN:
+            return now - self._opened_at < self.reset_timeout
+        if self.state == STATE_HALF_OPEN:
+            return now - self._trial_started_at < self.reset_timeout
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.state = STATE_CLOSED
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == STATE_HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != STATE_OPEN:
+                logger.warning("Circuit opened after %s consecutive failures", self.failures)
+            self.state = STATE_OPEN
+            self._opened_at = self.clock()
+
+
+@contextmanager
+def latency_budget(seconds: Optional[float]):
+    """Limits the time all calls made within the block may spend waiting for backends, including retries."""
+    if seconds is None:
+        yield
+        return
+
+    deadline = monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def clear_latency_budget():
+    _deadline.set(None)
+
+
+def remaining_budget() -> Optional[float]:
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - monotonic()
+
+
+def backoff_delay(attempt: int, base: float, cap: float, rng: Callable[[], float] = random.random) -> float:
+    """Exponential backoff with full jitter: a random delay between 0 and `base * 2^attempt`, at most `cap`."""
+    return rng() * min(cap, base * (2 ** attempt))
+
+
+async def call_with_retries(action: Callable[[], Awaitable[T]], retry_on: Tuple[Type[BaseException], ...],
+                            retries: int = 3, base_delay: float = 0.1, max_delay: float = 2.0,
+                            breaker: Optional[CircuitBreaker] = None, name: Text = "backend") -> T:
+    last_error = None
+    for attempt in range(retries):
+        if breaker and not breaker.allow_request():
+            raise CircuitOpenError(f"Circuit for {name} is open")
+
+        remaining = remaining_budget()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(f"Latency budget exhausted before calling {name}") from last_error
+
+        try:
+            result = await asyncio.wait_for(action(), timeout=remaining)
+        except (asyncio.TimeoutError,) + retry_on as err:
+            last_error = err
+            if breaker:
+                breaker.record_failure()
+        else:
+            if breaker:
+                breaker.record_success()
+            return result
+
+        if attempt + 1 < retries:
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            remaining = remaining_budget()
+            if remaining is not None and delay >= remaining:
+                raise DeadlineExceeded(f"Latency budget exhausted while retrying {name}") from last_error
+            logger.error("Call to %s failed (attempt %s/%s), retrying in %.2fs: %s",
+                         name, attempt + 1, retries, delay, last_error)
+            BACKEND_RETRIES.inc(backend=name)
+            await asyncio.sleep(delay)
+
+    raise RetriesExhausted(f"Call to {name} failed {retries} times") from last_error
+
+
+def call_with_retries_sync(action: Callable[[], T], retry_on: Tuple[Type[BaseException], ...], retries: int = 3,
+                           base_delay: float = 0.1, max_delay: float = 2.0, breaker: Optional[CircuitBreaker] = None,
+                           name: Text = "backend") -> T:
+    last_error = None
+    for attempt in range(retries):
+        if breaker and not breaker.allow_request():
+            raise CircuitOpenError(f"Circuit for {name} is open")
+
+        remaining = remaining_budget()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(f"Latency budget exhausted before calling {name}") from last_error
+
+        try:
+            result = action()
+        except retry_on as err:
+            last_error = err
+            if breaker:
+                breaker.record_failure()
+        else:
+            if breaker:
+                breaker.record_success()
+            return result
+
+        if attempt + 1 < retries:
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            remaining = remaining_budget()
+            if remaining is not None and delay >= remaining:
+                raise DeadlineExceeded(f"Latency budget exhausted while retrying {name}") from last_error
+            logger.error("Call to %s failed (attempt %s/%s), retrying in %.2fs: %s",
+                         name, attempt + 1, retries, delay, last_error)
+            BACKEND_RETRIES.inc(backend=name)
+            sleep(delay)
+
+    raise RetriesExhausted(f"Call to {name} failed {retries} times") from last_error
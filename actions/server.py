@@ -0,0 +1,126 @@
+"""Starts the action server with a warm-up phase and a readiness endpoint.
+
+Runs the same webhook as `rasa run actions`, with bodies decoded by orjson (see `actions.webhook`), plus:
+
+(-) `GET /ready` answers 503 until the warm-up (connection pools, cluster ping, caches) finished and 200 afterwards
+(-) `GET /metrics` exposes latency histograms and counters of actions and backends in the Prometheus text format
+(-) pools and background workers are closed when the server stops
+(-) log records are written by a background thread, sampled and rate limited per category (see `actions.logs`)
+(-) with `--workers` several processes serve the webhook, forked after preloading the catalogue (see `actions.workers`)
+
+    $ python -m actions.server --actions actions.actions --port 5055 [--workers 4]
+"""
+import argparse
+import logging
+import os
+from typing import Text
+
+from rasa_sdk.constants import DEFAULT_SERVER_PORT
+from sanic import Sanic, response
+
+from actions import lifecycle, metrics, webhook
+from actions.config import get_settings
+from actions.form_plans import FormPlanError, get_form_plans
+from actions.logs import configure_logging, stop_logging
+from actions.workers import Supervisor, available_cores, bind_socket, send_heartbeats
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ACTIONS = "actions.actions"
+
+
+def create_app(action_package_name: Text = DEFAULT_ACTIONS, cors_origins: Text = "*") -> Sanic:
+    app = webhook.create_app(action_package_name, cors_origins=cors_origins)
+
+    @app.get("/ready")
+    async def ready(_):
+        return response.json(lifecycle.readiness(), status=200 if lifecycle.is_ready() else 503)
+
+    @app.get("/metrics")
+    async def metrics_endpoint(_):
+        return response.text(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+    @app.listener("after_server_start")
+    async def start_warm_up(app, loop):
+        # Runs in the background so /health and /ready answer while warming up
+        app.add_task(lifecycle.warm_up())
+
+    @app.listener("before_server_stop")
+    async def shut_down(app, loop):
+        await lifecycle.shut_down()
+
+    return app
+
+
+def create_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Starts the action server.")
+    parser.add_argument("--actions", default=DEFAULT_ACTIONS, help="Name of the action package to load")
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_SERVER_PORT, help="Port to run the server at")
+    parser.add_argument("--cors", default="*", help="Enable CORS for the passed origin")
+    parser.add_argument("--workers", type=int, default=get_settings().server_workers,
+                        help="Worker processes, 0 starts one per CPU core")
+    return parser
+
+
+def serve_app(app: Sanic, **options):
+    """Runs the app in this process until it is stopped.
+
+    Sanic 22 and later start a separate server process in `app.run`, which looks the app up by name and does not know
+    apps created after the import of `__main__`. The server forks its workers itself (`actions.workers`), so the app is
+    served in the calling process with every version.
+    """
+    if not hasattr(Sanic, "serve_single"):
+        # Sanic 21 serves in the calling process
+        app.run(workers=1, access_log=False, **options)
+        return
+    app.prepare(single_process=True, access_log=False, **options)
+    Sanic.serve_single(app)
+
+
+def run_workers(app: Sanic, host: Text, port: int, workers: int):
+    """Serves the app from `workers` forked processes sharing the listening socket and the preloaded catalogue."""
+    settings = get_settings()
+    sock = bind_socket(host, port)
+
+    def serve(number: int, heartbeat: int):
+        configure_logging()
+        lifecycle.start_worker(number)
+
+        @app.listener("after_server_start")
+        async def start_heartbeats(app, loop):
+            # Heartbeats start once the worker is warmed up, the supervisor waits for them in a graceful restart
+            app.add_task(send_heartbeats(heartbeat, is_healthy=lifecycle.is_ready))
+
+        try:
+            serve_app(app, sock=sock)
+        finally:
+            stop_logging()
+
+    Supervisor(serve, workers, preload=lifecycle.preload, timeout=settings.worker_timeout,
+               stop_timeout=settings.worker_stop_timeout).run()
+
+
+def main():
+    args = create_argument_parser().parse_args()
+    configure_logging()
+
+    try:
+        # A broken plans file would fail every form turn, refuse to start instead
+        get_form_plans()
+    except FormPlanError as err:
+        logger.error("%s", err)
+        raise SystemExit(1)
+
+    app = create_app(args.actions, cors_origins=args.cors)
+    host = os.environ.get("SANIC_HOST", "0.0.0.0")
+    workers = args.workers or available_cores()
+    if workers > 1:
+        logger.info("Starting %s action server workers on %s:%s", workers, host, args.port)
+        run_workers(app, host, args.port, workers)
+        return
+    logger.info("Starting action server on %s:%s", host, args.port)
+    serve_app(app, host=host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
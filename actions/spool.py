@@ -0,0 +1,339 @@
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import threading
+import uuid
+from time import monotonic
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Text, Tuple, TypeVar
+
+from aiohttp import ClientError, ClientResponseError
+from requests import HTTPError, RequestException
+
+from actions import http_client
+from actions.config import get_settings
+from actions.resilience import CircuitBreaker, ResilienceError, call_with_retries, clear_latency_budget
+from actions.tracing import detach
+from actions.util import post_incident_records_async, update_incident_records_async
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Records rejected with these statuses will never succeed and are moved to the dead letter log
+STATUS_UNPROCESSABLE = (400, 404, 413, 422)
+
+
+class RejectedBatch(Exception):
+    pass
+
+
+class IncidentSpool:
+    """Durable append-only log of incident records waiting for submission.
+
+    Records are appended to `path`, ids of submitted records to `path.ack`. Both files are only ever appended to, so
+    a crash can at worst lose the acknowledgement of a batch that was just submitted. Everything in the log that is
+    not acknowledged is pending and replayed after a restart.
+
+    Entries appended with `update=True` change the fields of a record created before instead of creating one.
+    """
+
+    def __init__(self, path: Text):
+        self.path = path
+        self.ack_path = path + ".ack"
+        self.dead_letter_path = path + ".failed"
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, fields: Dict[Text, Any], update: bool = False) -> Text:
+        record_id = uuid.uuid4().hex
+        entry = {"id": record_id, "fields": fields}
+        if update:
+            entry["update"] = True
+        self._write(self.path, [json.dumps(entry)])
+        return record_id
+
+    def pending(self) -> List[Dict[Text, Any]]:
+        with self._lock:
+            return self._pending()
+
+    def ack(self, record_ids: List[Text]):
+        self._write(self.ack_path, record_ids)
+
+    def dead_letter(self, records: List[Dict[Text, Any]]):
+        self._write(self.dead_letter_path, [json.dumps(record) for record in records])
+        self.ack(covered_ids(records))
+
+    def compact(self):
+        """Truncates the log once everything in it has been acknowledged."""
+        with self._lock:
+            if self._pending():
+                return
+            for path in (self.path, self.ack_path):
+                if os.path.exists(path):
+                    os.truncate(path, 0)
+
+    def _pending(self) -> List[Dict[Text, Any]]:
+        acknowledged = set(_read_lines(self.ack_path))
+        records = []
+        for line in _read_lines(self.path):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A torn write from a crash while appending
+                logger.warning("Skipping corrupt spool entry %s", line[:100])
+                continue
+            if record["id"] not in acknowledged:
+                records.append(record)
+        return records
+
+    def _write(self, path: Text, lines: List[Text]):
+        if not lines:
+            return
+        with self._lock:
+            with open(path, "a", encoding="utf-8") as file:
+                file.write("".join(line + "\n" for line in lines))
+                file.flush()
+                os.fsync(file.fileno())
+
+
+def _read_lines(path: Text) -> List[Text]:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def covered_ids(records: List[Dict[Text, Any]]) -> List[Text]:
+    """Ids of the spool entries submitted with `records`, including the updates folded into them."""
+    return [record_id for record in records for record_id in record.get("covers", [record["id"]])]
+
+
+Record = Dict[Text, Any]
+
+
+def fold_updates(records: List[Record], merge_field: Text) -> Tuple[List[Record], List[Record]]:
+    """Splits pending entries into records to create and records to update.
+
+    Updates of a record that is still pending are folded into it and consecutive updates of the same record are
+    merged, so each record is sent once. The ids of the merged entries are listed in "covers".
+    """
+    creates: List[Record] = []
+    updates: Dict[Text, Record] = {}
+    pending: Dict[Text, Record] = {}
+    for record in records:
+        key = record["fields"].get(merge_field)
+        if not record.get("update"):
+            entry = dict(record, fields=dict(record["fields"]), covers=[record["id"]])
+            creates.append(entry)
+            if key:
+                pending[key] = entry
+            continue
+        entry = pending.get(key) or updates.get(key)
+        if entry is None:
+            updates[key] = dict(record, fields=dict(record["fields"]), covers=[record["id"]])
+        else:
+            entry["fields"].update(record["fields"])
+            entry["covers"].append(record["id"])
+    return creates, list(updates.values())
+
+
+class SubmissionWorker:
+    """Drains an `IncidentSpool` in the background, posting batches of records to Airtable.
+
+    Updates are sent with `post_updates`, which updates the records with the same `merge_field` value. While the
+    circuit `breaker` is open after repeated failures the spool is left alone until its reset timeout passed.
+    """
+
+    def __init__(self, spool: IncidentSpool,
+                 post_batch: Callable[[List[Dict[Text, Any]]], Any] = post_incident_records_async,
+                 batch_size: int = 10, requests_per_second: float = 4, flush_interval: float = 1,
+                 post_updates: Callable[[List[Dict[Text, Any]]], Any] = update_incident_records_async,
+                 merge_field: Text = "Cluster", breaker: Optional[CircuitBreaker] = None):
+        self.spool = spool
+        self.post_batch = post_batch
+        self.post_updates = post_updates
+        self.merge_field = merge_field
+        self.batch_size = batch_size
+        self.min_interval = 1 / requests_per_second if requests_per_second > 0 else 0
+        self.flush_interval = flush_interval
+        self.breaker = breaker or CircuitBreaker()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_request = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    def notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        # The task inherits the context of the webhook call that started it, but not its latency budget or trace
+        clear_latency_budget()
+        detach()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self.breaker.is_open:
+                continue
+            try:
+                await self.drain()
+            except ResilienceError as err:
+                logger.error("Submitting incidents failed, keeping them spooled: %s", err)
+            except Exception:
+                logger.exception("Unexpected error while submitting incidents")
+
+    async def drain(self) -> int:
+        """Submits all pending records and returns the number of spool entries acknowledged."""
+        pending = await _blocking(self.spool.pending)
+        creates, updates = fold_updates(pending, self.merge_field)
+        submitted = 0
+        # Updates go last, the records they update may be created by this drain
+        for records, post in ((creates, self.post_batch), (updates, self.post_updates)):
+            for start in range(0, len(records), self.batch_size):
+                batch = records[start:start + self.batch_size]
+                await self._throttle()
+                try:
+                    await call_with_retries(lambda: self._post(batch, post), retry_on=(RequestException, ClientError),
+                                            breaker=self.breaker, name="airtable", base_delay=1, max_delay=30)
+                except RejectedBatch as err:
+                    logger.error("Airtable rejected %s incidents, moving them to %s: %s",
+                                 len(batch), self.spool.dead_letter_path, err)
+                    await _blocking(self.spool.dead_letter, batch)
+                    continue
+                acknowledged = covered_ids(batch)
+                await _blocking(self.spool.ack, acknowledged)
+                submitted += len(acknowledged)
+
+        if pending:
+            await _blocking(self.spool.compact)
+        return submitted
+
+    async def _post(self, batch: List[Dict[Text, Any]], post: Callable[[List[Dict[Text, Any]]], Any]):
+        records = [record["fields"] for record in batch]
+        try:
+            if asyncio.iscoroutinefunction(post):
+                return await post(records)
+            # Blocking posters run on the default executor so they do not stall the event loop
+            return await _blocking(post, records)
+        except (HTTPError, ClientResponseError) as err:
+            if _status_code(err) in STATUS_UNPROCESSABLE:
+                raise RejectedBatch(str(err)) from err
+            raise
+
+    async def _throttle(self):
+        wait = self._last_request + self.min_interval - monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self._last_request = monotonic()
+
+
+def _blocking(function: Callable[..., T], *args) -> Awaitable[T]:
+    # Spool files are fsynced, which must not stall the event loop
+    return asyncio.get_event_loop().run_in_executor(None, functools.partial(function, *args))
+
+
+def _status_code(err: Exception) -> Optional[int]:
+    if isinstance(err, ClientResponseError):
+        return err.status
+    if isinstance(err, HTTPError) and err.response is not None:
+        return err.response.status_code
+    return None
+
+
+_worker: Optional[SubmissionWorker] = None
+
+
+def get_worker() -> SubmissionWorker:
+    global _worker
+    if _worker is None:
+        settings = get_settings()
+        _worker = SubmissionWorker(IncidentSpool(settings.incident_spool_path),
+                                   batch_size=settings.incident_batch_size,
+                                   requests_per_second=settings.incident_requests_per_second,
+                                   flush_interval=settings.incident_flush_interval,
+                                   merge_field=settings.airtable_cluster_field,
+                                   breaker=CircuitBreaker(failure_threshold=settings.airtable_breaker_threshold,
+                                                          reset_timeout=settings.airtable_breaker_reset))
+    return _worker
+
+
+def worker_spool_path(path: Text, worker: int) -> Text:
+    """Spool of a worker process of `actions.workers`, no two processes may drain the same spool. Worker 0 keeps the
+    spool of a single process server."""
+    return path if worker == 0 else f"{path}.{worker}"
+
+
+async def submit_incident(fields: Dict[Text, Any]) -> Text:
+    """Spools an incident for submission and returns its id without waiting for Airtable.
+
+    Must be called from within the running event loop, which also hosts the submission worker.
+    """
+    return await _spool(fields, update=False)
+
+
+async def submit_update(fields: Dict[Text, Any]) -> Text:
+    """Spools new values of fields of an incident submitted before, identified by its `AIRTABLE_CLUSTER_FIELD`."""
+    return await _spool(fields, update=True)
+
+
+async def _spool(fields: Dict[Text, Any], update: bool) -> Text:
+    worker = get_worker()
+    record_id = await _blocking(functools.partial(worker.spool.append, fields, update=update))
+    worker.start()
+    worker.notify()
+    return record_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Submit incidents left in the spool, e.g. after an outage.")
+    parser.add_argument("--path", default=get_settings().incident_spool_path, help="Path of the spool file")
+    parser.add_argument("--list", action="store_true", help="Only print the pending records")
+    args = parser.parse_args()
+
+    spool = IncidentSpool(args.path)
+    if args.list:
+        for record in spool.pending():
+            print(json.dumps(record, ensure_ascii=False))
+        return
+
+    async def drain():
+        try:
+            settings = get_settings()
+            worker = SubmissionWorker(spool, batch_size=settings.incident_batch_size,
+                                      requests_per_second=settings.incident_requests_per_second)
+            return await worker.drain()
+        finally:
+            await http_client.close()
+
+    submitted = asyncio.run(drain())
+    print(f"Submitted {submitted} incidents")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,181 @@
+"""Opt-in traces of single webhook calls.
+
+A sampled call (`TRACE_SAMPLE_RATE`, or always for the sender ids in `TRACE_SENDER_IDS`) records nested spans for
+decoding the request, the action, its validators, catalogue lookups, fuzzy matching and outbound requests, and is
+written as one JSON line to `TRACE_PATH`. With `TRACE_PROFILE` a cProfile summary of the call is attached to the trace.
+
+Outside of a sampled call `span` only costs a context variable lookup.
+"""
+import cProfile
+import io
+import itertools
+import json
+import logging
+import pstats
+import random
+import threading
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter, time
+from typing import Any, Dict, List, Optional, Text
+
+from actions.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+_trace: ContextVar[Optional["Trace"]] = ContextVar("trace", default=None)
+_parent: ContextVar[Optional[int]] = ContextVar("trace_parent", default=None)
+
+_write_lock = threading.Lock()
+
+# cProfile can only profile one call per thread at a time, overlapping sampled calls are traced without profile
+_profiling = False
+
+
+class Trace:
+    def __init__(self, action: Text, sender_id: Text, origin: Optional[float] = None):
+        # `origin` is the perf_counter() value the call started at, if that was before the trace was created
+        self._origin = perf_counter() if origin is None else origin
+        self.trace_id = uuid.uuid4().hex
+        self.action = action
+        self.sender_id = sender_id
+        self.started = time() - self.offset()
+        self.spans: List[Dict[Text, Any]] = []
+        self.profile: Optional[List[Dict[Text, Any]]] = None
+        self._ids = itertools.count(1)
+
+    def offset(self, now: Optional[float] = None) -> float:
+        return (perf_counter() if now is None else now) - self._origin
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    def to_dict(self) -> Dict[Text, Any]:
+        record = {"trace_id": self.trace_id, "action": self.action, "sender_id": self.sender_id,
+                  "started": self.started, "duration": self.offset(),
+                  "spans": sorted(self.spans, key=lambda span: span["start"])}
+        if self.profile is not None:
+            record["profile"] = self.profile
+        return record
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+
+def is_sampled(sender_id: Optional[Text]) -> bool:
+    settings = get_settings()
+    if sender_id and sender_id in settings.trace_sender_ids:
+        return True
+    return settings.trace_sample_rate > 0 and random.random() < settings.trace_sample_rate
+
+
+@contextmanager
+def span(name: Text, **attributes: Any):
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+
+    span_id = trace.next_id()
+    parent = _parent.get()
+    token = _parent.set(span_id)
+    start = trace.offset()
+    error = None
+    try:
+        yield
+    except BaseException as err:
+        error = type(err).__name__
+        raise
+    finally:
+        _parent.reset(token)
+        record = {"id": span_id, "parent": parent, "name": name, "start": start, "duration": trace.offset() - start}
+        if attributes:
+            record["attributes"] = attributes
+        if error:
+            record["error"] = error
+        trace.spans.append(record)
+
+
+def record_span(name: Text, start: float, end: float, **attributes: Any):
+    """Adds a span for work between the perf_counter() values `start` and `end`, e.g. done before the trace began."""
+    trace = _trace.get()
+    if trace is None:
+        return
+    record = {"id": trace.next_id(), "parent": _parent.get(), "name": name, "start": trace.offset(start),
+              "duration": end - start}
+    if attributes:
+        record["attributes"] = attributes
+    trace.spans.append(record)
+
+
+@contextmanager
+def trace_call(action: Text, sender_id: Optional[Text], started: Optional[float] = None):
+    """Traces the webhook call running `action` if it is sampled, nested calls are part of the outer trace.
+
+    `started` is the perf_counter() value at which the call was received, if that was before this block.
+    """
+    if _trace.get() is not None or not is_sampled(sender_id):
+        yield None
+        return
+
+    trace = Trace(action, sender_id, origin=started)
+    trace_token = _trace.set(trace)
+    parent_token = _parent.set(None)
+    profiler = _start_profiler()
+    try:
+        with span(action, sender_id=sender_id):
+            yield trace
+    finally:
+        if profiler is not None:
+            trace.profile = _stop_profiler(profiler)
+        _parent.reset(parent_token)
+        _trace.reset(trace_token)
+        write(trace)
+
+
+def detach():
+    """Stops recording into the trace of the current context, for background tasks started within a traced call."""
+    _trace.set(None)
+    _parent.set(None)
+
+
+def _start_profiler() -> Optional[cProfile.Profile]:
+    global _profiling
+    if not get_settings().trace_profile or _profiling:
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is active, e.g. when running under a debugger or profiling tool
+        return None
+    _profiling = True
+    return profiler
+
+
+def _stop_profiler(profiler: cProfile.Profile) -> List[Dict[Text, Any]]:
+    global _profiling
+    profiler.disable()
+    _profiling = False
+    # Other coroutines running while the call awaited are part of the profile as well
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    stats.sort_stats("cumulative")
+    summary = []
+    for function in stats.fcn_list[:get_settings().trace_profile_top]:
+        primitive_calls, calls, total, cumulative, _ = stats.stats[function]
+        filename, line, name = function
+        summary.append({"function": f"{filename}:{line}({name})", "calls": calls, "total": total,
+                        "cumulative": cumulative})
+    return summary
+
+
+def write(trace: Trace):
+    path = get_settings().trace_path
+    line = json.dumps(trace.to_dict(), default=str)
+    try:
+        with _write_lock, open(path, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+    except OSError as err:
+        logger.error("Could not write trace %s to %s: %s", trace.trace_id, path, err)
@@ -0,0 +1,136 @@
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Sequence, Text, Tuple, Union
+
+from rasa_sdk import Tracker
+
+from actions.cache import TTLCache
+from actions.config import get_settings
+from actions.tracing import span
+
+EventType = Dict[Text, Any]
+
+# Index of the tracker handled by the current webhook call, shared by all validators of that call
+_current: ContextVar[Optional[Tuple[Tracker, "ConfidenceIndex"]]] = ContextVar("confidence_index", default=None)
+
+_cache: Optional[TTLCache] = None
+
+
+def _fingerprint(event: EventType) -> Tuple:
+    return event.get("event"), event.get("timestamp")
+
+
+class EntityConfidenceIndex:
+    """Latest confidence per entity name over the user events of a conversation.
+
+    Built in a single forward pass and extended incrementally with events appended later, so asking for a confidence
+    does not walk the conversation history again.
+    """
+
+    def __init__(self):
+        self.confidences: Dict[Text, float] = {}
+        self.event_count = 0
+        self._first: Optional[Tuple] = None
+        self._last: Optional[Tuple] = None
+
+    def is_prefix_of(self, events: Sequence[EventType]) -> bool:
+        if self.event_count == 0:
+            return True
+        if len(events) < self.event_count:
+            return False
+        return _fingerprint(events[0]) == self._first and _fingerprint(events[self.event_count - 1]) == self._last
+
+    def update(self, events: Sequence[EventType]) -> "EntityConfidenceIndex":
+        if not self.is_prefix_of(events):
+            # The history was cut, e.g. by a restart, start over
+            self.confidences = {}
+            self.event_count = 0
+
+        for index in range(self.event_count, len(events)):
+            event = events[index]
+            if event.get("event") != "user":
+                continue
+            seen = set()
+            for entity in (event.get("parse_data") or {}).get("entities", []):
+                name = entity["entity"]
+                # Within one message the first entity of a name counts
+                if name not in seen:
+                    seen.add(name)
+                    self.confidences[name] = entity.get("confidence_entity", 1)
+
+        if events:
+            self._first = _fingerprint(events[0])
+            self._last = _fingerprint(events[-1])
+        self.event_count = len(events)
+        return self
+
+    def confidence(self, entity_name: Text, default: float = 1) -> float:
+        return self.confidences.get(entity_name, default)
+
+
+class LatestEntityConfidences:
+    """Latest confidence per entity name, found by walking the user events of a conversation backwards.
+
+    The walk stops at the latest message with the entity asked for, so of lazily parsed events (see `actions.webhook`)
+    only those of the recent turns are parsed.
+    """
+
+    def __init__(self, events: Sequence[EventType]):
+        self._reset(events)
+
+    def _reset(self, events: Sequence[EventType]):
+        self.confidences: Dict[Text, float] = {}
+        self._events = events
+        self._event_count = len(events)
+        # Next event to read, going backwards
+        self._position = self._event_count - 1
+
+    def update(self, events: Sequence[EventType]) -> "LatestEntityConfidences":
+        if events is not self._events or len(events) != self._event_count:
+            self._reset(events)
+        return self
+
+    def confidence(self, entity_name: Text, default: float = 1) -> float:
+        while entity_name not in self.confidences and self._position >= 0:
+            event = self._events[self._position]
+            self._position -= 1
+            if event.get("event") != "user":
+                continue
+            for entity in (event.get("parse_data") or {}).get("entities", []):
+                # Later messages and, within one message, the first entity of a name win
+                self.confidences.setdefault(entity["entity"], entity.get("confidence_entity", 1))
+        return self.confidences.get(entity_name, default)
+
+
+ConfidenceIndex = Union[EntityConfidenceIndex, LatestEntityConfidences]
+
+
+def _get_cache() -> Optional[TTLCache]:
+    global _cache
+    settings = get_settings()
+    if _cache is None and settings.confidence_cache_size > 0:
+        _cache = TTLCache(max_size=settings.confidence_cache_size, ttl=settings.confidence_cache_ttl)
+    return _cache
+
+
+def confidence_index(tracker: Tracker) -> ConfidenceIndex:
+    """Returns the up to date index for `tracker`.
+
+    The index is built once per webhook call and reads the events backwards on demand. With `CONFIDENCE_CACHE_SIZE`
+    set it is instead kept per `sender_id` across turns and only extended with the events of the new turn.
+    """
+    current = _current.get()
+    if current is not None and current[0] is tracker:
+        return current[1].update(tracker.events)
+
+    with span("tracker.confidence_index", events=len(tracker.events)):
+        cache = _get_cache()
+        if cache is None:
+            index = LatestEntityConfidences(tracker.events)
+        else:
+            index = cache.get(tracker.sender_id)
+            if index is None:
+                index = EntityConfidenceIndex()
+                cache.set(tracker.sender_id, index)
+            index.update(tracker.events)
+    _current.set((tracker, index))
+    return index
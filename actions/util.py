@@ -1,11 +1,14 @@
 import json
 import logging
-import os
 import re
-from typing import Any, List, Text
+from typing import Any, Dict, List, NamedTuple, Optional, Pattern, Text, Tuple, Union
 
-import requests
-from thefuzz import fuzz
+from actions.config import get_settings
+from actions.fuzzy import fuzzy_index
+from actions.http_client import get_async_session, get_session
+from actions.logs import INCIDENTS, Payload
+from actions.metrics import BACKEND_DURATION
+from actions.tracing import span
 
 DEVICE_TV = "tv"
 DEVICE_HANDHELD = "handheld"
@@ -22,49 +25,30 @@ ios = ["ipad", "iphone", "apple"]
 
 logger = logging.getLogger(__name__)
 
-airtable_base_id = os.environ.get('AIRTABLE_BASE_ID')
-airtable_api_key = os.environ.get('AIRTABLE_API_KEY')
-airtable_table_name = os.environ.get('AIRTABLE_TABLE')
-
 
 def create_incident_report(problem: Any, expected: Any, steps: Any, platform: Any, model: Any, vendor: Any,
                            os: Any, os_version: Any, content_type: Any, content_id: Any, video_interrupt: Any,
                            app_version: Any, connectivity: Any, error_msg: Any, email: Any):
-    request = f"https://api.airtable.com/v0/" + airtable_base_id + "/" + airtable_table_name
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "Authorization": f"Bearer " + airtable_api_key,
-    }
-    data = {
-        "records": [
-            {
-                "fields": {
-                    "Problem Statement": sanitize(problem),
-                    "Expected Behavior": sanitize(expected),
-                    "Steps to reproduce": sanitize(steps),
-                    "Platform": sanitize(platform),
-                    "Device Model": sanitize(model),
-                    "Vendor": sanitize(vendor),
-                    "OS": sanitize(os),
-                    "OS Version": sanitize(os_version),
-                    "Content Type": sanitize(content_type),
-                    "Content ID": sanitize(content_id),
-                    "Interruption": sanitize(video_interrupt),
-                    "App Version": sanitize(app_version),
-                    "Connectivity": sanitize(connectivity),
-                    "Error Msg": sanitize(error_msg),
-                    "Email": sanitize(email)
-                },
-            }
-        ]
-    }
+    fields = incident_fields(problem=problem, expected=expected, steps=steps, platform=platform, model=model,
+                             vendor=vendor, os=os, os_version=os_version, content_type=content_type,
+                             content_id=content_id, video_interrupt=video_interrupt, app_version=app_version,
+                             connectivity=connectivity, error_msg=error_msg, email=email)
+    return send_incident(fields)
+
+
+def send_incident(fields: Dict[Text, Text]):
+    try:
+        response = post_incident_records([fields])
+    except Exception as err:
+        logger.error(err)
+        return None
+
+    return response
 
-    logger.info("Sending incident report with data %s", data)
 
+async def send_incident_async(fields: Dict[Text, Text]):
     try:
-        response = requests.post(request, headers=headers, data=json.dumps(data))
-        response.raise_for_status()
+        response = await post_incident_records_async([fields])
     except Exception as err:
         logger.error(err)
         return None
@@ -72,6 +56,75 @@ def create_incident_report(problem: Any, expected: Any, steps: Any, platform: An
     return response
 
 
+def incident_fields(problem: Any, expected: Any, steps: Any, platform: Any, model: Any, vendor: Any, os: Any,
+                    os_version: Any, content_type: Any, content_id: Any, video_interrupt: Any, app_version: Any,
+                    connectivity: Any, error_msg: Any, email: Any) -> Dict[Text, Text]:
+    return {
+        "Problem Statement": sanitize(problem),
+        "Expected Behavior": sanitize(expected),
+        "Steps to reproduce": sanitize(steps),
+        "Platform": sanitize(platform),
+        "Device Model": sanitize(model),
+        "Vendor": sanitize(vendor),
+        "OS": sanitize(os),
+        "OS Version": sanitize(os_version),
+        "Content Type": sanitize(content_type),
+        "Content ID": sanitize(content_id),
+        "Interruption": sanitize(video_interrupt),
+        "App Version": sanitize(app_version),
+        "Connectivity": sanitize(connectivity),
+        "Error Msg": sanitize(error_msg),
+        "Email": sanitize(email)
+    }
+
+
+def airtable_request(records: List[Dict[Text, Text]],
+                     merge_on: Optional[Text] = None) -> Tuple[Text, Dict[Text, Text], Text]:
+    settings = get_settings()
+    request = settings.airtable_api_url + "/" + settings.airtable_base_id + "/" + settings.airtable_table_name
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": "application/json",
+        "Authorization": f"Bearer " + settings.airtable_api_key,
+    }
+    data = {"records": [{"fields": fields} for fields in records]}
+    if merge_on:
+        # Updates the record with the same value of `merge_on`, or creates one
+        data["performUpsert"] = {"fieldsToMergeOn": [merge_on]}
+
+    logger.info("Sending %s incident records", len(records), extra=INCIDENTS)
+    logger.debug("Incident records: %s", Payload(data), extra=INCIDENTS)
+    return request, headers, json.dumps(data)
+
+
+def post_incident_records(records: List[Dict[Text, Text]]):
+    """Creates one Airtable record per entry of `records` (at most 10 per call) and raises on HTTP errors."""
+    request, headers, data = airtable_request(records)
+    with BACKEND_DURATION.time(backend="airtable", operation="create_records"), \
+            span("airtable.create_records", records=len(records)):
+        response = get_session().post(request, headers=headers, data=data)
+    response.raise_for_status()
+    return response
+
+
+async def post_incident_records_async(records: List[Dict[Text, Text]]) -> Dict[Text, Any]:
+    """Async variant of `post_incident_records`, returns the decoded Airtable response."""
+    request, headers, data = airtable_request(records)
+    with BACKEND_DURATION.time(backend="airtable", operation="create_records"), \
+            span("airtable.create_records", records=len(records)):
+        async with get_async_session().post(request, headers=headers, data=data, raise_for_status=True) as response:
+            return await response.json()
+
+
+async def update_incident_records_async(records: List[Dict[Text, Text]]) -> Dict[Text, Any]:
+    """Updates the fields of the records with the same `AIRTABLE_CLUSTER_FIELD` value (at most 10 per call)."""
+    request, headers, data = airtable_request(records, merge_on=get_settings().airtable_cluster_field)
+    with BACKEND_DURATION.time(backend="airtable", operation="update_records"), \
+            span("airtable.update_records", records=len(records)):
+        async with get_async_session().patch(request, headers=headers, data=data, raise_for_status=True) as response:
+            return await response.json()
+
+
 def sanitize(value: Any, default=""):
     if value:
         return str(value)
@@ -79,41 +132,71 @@ def sanitize(value: Any, default=""):
         return default
 
 
+os_name_pattern = re.compile(r"((android)|(ios)|(tvos))((?:\s*)?(\d+\.)?(\d+\.)?(\d+))?")
+os_version_pattern = re.compile(r"(\d+\.)?(\d+\.)?(\d+)")
+app_version_pattern = re.compile(r"((?<!\.)(5\.)(\d+\.)?(\d+))")
+
+
+class VersionInfo(NamedTuple):
+    app_versions: List[Text]
+    # None if the input contains an app version, as an app version is not a valid os version
+    os_versions: Optional[List[Text]]
+    os_names: List[Text]
+
+
+def parse_versions(slot_value: Any) -> VersionInfo:
+    """Extracts app versions, os versions and valid os names from a string or a list of strings in one pass.
+
+    Equivalent to calling `match_app_version`, `match_os_version` and `is_valid_os_name` (per item) on the same input.
+    """
+    items = slot_value if type(slot_value) is list else [slot_value]
+    app_versions = []
+    os_versions = []
+    os_names = []
+    for item in items:
+        if not isinstance(item, str):
+            continue
+        match = app_version_pattern.search(item)
+        if match and match[0]:
+            app_versions.append(match[0])
+        elif not app_versions:
+            # Once there is an app version the os version candidates are discarded anyway
+            match = os_version_pattern.search(item)
+            if match and match[0]:
+                os_versions.append(match[0])
+
+        lowered = item.lower()
+        if os_name_pattern.match(lowered) or lowered == "unkown":
+            os_names.append(item)
+
+    return VersionInfo(app_versions, None if app_versions else os_versions, os_names)
+
+
 def is_valid_os_name(name: str):
-    pattern = re.compile(r"((android)|(ios)|(tvos))((?:\s*)?(\d+\.)?(\d+\.)?(\d+))?")
-    return bool(pattern.match(name.lower())) or name.lower() == "unkown"
+    lowered = name.lower()
+    return bool(os_name_pattern.match(lowered)) or lowered == "unkown"
 
 
 def match_os_version(slot_value: Any):
-    # An app version is not a valid os version
-    is_app_version = match_app_version(slot_value)
-    if is_app_version:
-        return None
-    return match_version(slot_value, r"(\d+\.)?(\d+\.)?(\d+)")
+    return parse_versions(slot_value).os_versions
 
 
 def match_app_version(slot_value: Any):
-    return match_version(slot_value, r"((?<!\.)(5\.)(\d+\.)?(\d+))")
+    return match_version(slot_value, app_version_pattern)
 
 
-def match_version(slot_value: Any, pattern: str):
-    def search_match(candidate):
-        match = re.search(pattern, candidate)
-        if match and match[0]:
-            matches.append(match[0])
+def match_version(slot_value: Any, pattern: Union[str, Pattern]):
+    if isinstance(pattern, str):
+        pattern = re.compile(pattern)
 
     matches = []
-    if type(slot_value) is list:
-        for item in slot_value:
-            search_match(item)
-    else:
-        search_match(slot_value)
+    for item in slot_value if type(slot_value) is list else [slot_value]:
+        match = pattern.search(item)
+        if match and match[0]:
+            matches.append(match[0])
     return matches
 
 
 def find_fuzzy_match(candidate: str, items: List[Text]):
-    for token in items:
-        ratio = fuzz.ratio(candidate.lower(), token.lower())
-        if ratio >= 70:
-            return token
-    return None
+    with span("fuzzy.match", candidate=candidate):
+        return fuzzy_index(items).match(candidate)
@@ -0,0 +1,235 @@
+"""Webhook of the action server with a fast request path for long conversations.
+
+Answers like the webhook of `rasa_sdk.endpoint`, but request and response bodies are encoded with orjson. With
+`WEBHOOK_LAZY_EVENTS` the events of the tracker are also parsed only when an action reads them. Every call carries all
+events of the conversation (with the `parse_data` of every message), while the actions read the latest user messages
+and the slots of the turn, so this keeps much less memory per call.
+
+With lazy events `decode_action_call` parses the body with the events array left out. The tracker gets a `LazyEvents`
+sequence over the text of the array, which knows where each event starts and parses an event the first time it is read.
+Reading from the end (`reversed(tracker.events)`, `tracker.events[-1]`) therefore parses only the recent events, the
+text of the others is kept as it is. An event starts where an object whose first key is "event" is an element of the
+array, which is how Rasa writes events. Decoding checks that the text of each event parses on its own and ends where the
+next event starts, which costs somewhat more CPU than parsing the body completely but keeps only the events that are
+read. A tracker that does not match this is parsed completely.
+"""
+import json
+import logging
+import re
+from collections.abc import MutableSequence
+from time import perf_counter
+from typing import Any, Dict, List, Optional, Text
+
+import orjson
+from rasa_sdk import utils
+from rasa_sdk.endpoint import configure_cors
+from rasa_sdk.executor import ActionExecutor
+from rasa_sdk.interfaces import ActionExecutionRejection, ActionNotFoundException
+from sanic import Sanic, response
+from sanic.response import HTTPResponse
+
+from actions.config import get_settings
+from actions.tracing import record_span, span, trace_call
+
+logger = logging.getLogger(__name__)
+
+_events_array = re.compile(r'"events"\s*:\s*\[')
+# Objects starting with the key "event" and how Rasa (json.dumps) or compact encoders separate them in an array. An
+# unescaped quote ends a JSON string, so these do not occur inside one
+_event_start = re.compile(r'\{"event"')
+_first_event = re.compile(r'\s*\{"event"')
+_separator = re.compile(r",\s*")
+_array_end = re.compile(r"\s*\]")
+
+# Stands for the events array while the rest of the body is parsed
+_PLACEHOLDER = "__lazy_events__"
+
+_decoder = json.JSONDecoder()
+
+
+class LazyEvents(MutableSequence):
+    """Events of a tracker, each parsed from the JSON text of the events array when it is read first.
+
+    Appending does not parse anything, other changes parse all events first.
+    """
+
+    def __init__(self, text: Text, start: int, end: int, starts: List[int], last: Dict[Text, Any]):
+        # The array is text[start:end], its events start at `starts`, the last one is already parsed
+        self._text: Optional[Text] = text
+        self._start = start
+        self._end = end
+        self._starts = starts
+        self._events: List[Optional[Dict[Text, Any]]] = [None] * (len(starts) - 1) + [last]
+
+    @property
+    def parsed(self) -> int:
+        """Number of events parsed so far."""
+        return sum(1 for event in self._events if event is not None)
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(len(self._events)))]
+        event = self._events[index]
+        if event is None:
+            event = self._parse(index % len(self._events))
+        return event
+
+    def __setitem__(self, index, value):
+        self._parse_all()
+        self._events[index] = value
+
+    def __delitem__(self, index):
+        self._parse_all()
+        del self._events[index]
+
+    def insert(self, index: int, value: Dict[Text, Any]):
+        self._parse_all()
+        self._events.insert(index, value)
+
+    def append(self, value: Dict[Text, Any]):
+        self._events.append(value)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (list, LazyEvents)):
+            return len(self) == len(other) and list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> Text:
+        return f"LazyEvents({len(self)} events, {self.parsed} parsed)"
+
+    def _parse(self, position: int) -> Dict[Text, Any]:
+        # The last event is parsed up front, so the next event starts after every event still to parse
+        start, next_start = self._starts[position], self._starts[position + 1]
+        event = orjson.loads(self._text[start:self._text.rfind(",", start, next_start)])
+        self._events[position] = event
+        return event
+
+    def _parse_all(self):
+        if self._text is None:
+            return
+        events = orjson.loads(self._text[self._start:self._end])
+        self._events = events + self._events[len(self._starts):]
+        self._text = None
+        self._starts = []
+
+
+def _is_object(text: Text) -> bool:
+    try:
+        return isinstance(orjson.loads(text), dict)
+    except orjson.JSONDecodeError:
+        return False
+
+
+def _lazy_events(text: Text, start: int) -> Optional[LazyEvents]:
+    """Events of the array starting at `start`, None if they are not written the way Rasa writes them."""
+    if _first_event.match(text, start + 1) is None:
+        return None
+    starts = [match.start() for match in _event_start.finditer(text, start)]
+    # Each event must end where the separator before the next object starting with the key "event" starts. Otherwise
+    # the event contains such an object, e.g. in its metadata, or it is the last event and the object follows the array
+    for index, (position, next_start) in enumerate(zip(starts, starts[1:])):
+        separator = text.rfind(",", position, next_start)
+        chained = separator >= 0 and _separator.match(text, separator).end() == next_start
+        if not chained or not _is_object(text[position:separator]):
+            del starts[index + 1:]
+            break
+    try:
+        last, last_end = _decoder.raw_decode(text, starts[-1])
+    except ValueError:
+        return None
+    # The event where the chain ends must end the array
+    end = _array_end.match(text, last_end)
+    if end is None:
+        return None
+    return LazyEvents(text, start, end.end(), starts, last)
+
+
+def decode_action_call(body: bytes, lazy_events: bool = False) -> Any:
+    """Decodes a webhook request body. With `lazy_events` the tracker events are a `LazyEvents` sequence."""
+    if not lazy_events:
+        return orjson.loads(body)
+    text = body.decode("utf-8")
+    for match in _events_array.finditer(text):
+        start = match.end() - 1
+        events = _lazy_events(text, start)
+        if events is None:
+            continue
+        try:
+            action_call = orjson.loads(f'{text[:start]}"{_PLACEHOLDER}"{text[events._end:]}')
+        except orjson.JSONDecodeError:
+            break
+        tracker = action_call.get("tracker") if isinstance(action_call, dict) else None
+        if isinstance(tracker, dict) and tracker.get("events") == _PLACEHOLDER:
+            tracker["events"] = events
+            return action_call
+        # The array belongs to something else than the tracker, e.g. a slot called "events"
+    return orjson.loads(text)
+
+
+def _serialize(value: Any) -> Any:
+    # The run results of newer rasa_sdk versions are pydantic models
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _json(body: Any, status: int = 200) -> HTTPResponse:
+    return response.raw(orjson.dumps(body, default=_serialize), status=status, content_type="application/json")
+
+
+def _event_count(action_call: Dict[Text, Any]) -> Optional[int]:
+    tracker = action_call.get("tracker")
+    events = tracker.get("events") if isinstance(tracker, dict) else None
+    return len(events) if isinstance(events, (list, LazyEvents)) else None
+
+
+async def handle_webhook(executor: ActionExecutor, body: bytes) -> HTTPResponse:
+    received = perf_counter()
+    try:
+        action_call = decode_action_call(body, get_settings().webhook_lazy_events)
+    except (orjson.JSONDecodeError, UnicodeDecodeError):
+        action_call = None
+    if not isinstance(action_call, dict):
+        return _json({"error": "Invalid body request"}, status=400)
+    decoded = perf_counter()
+
+    # Whether the call is sampled depends on its sender, so the decoding is added to the trace afterwards
+    with trace_call(action_call.get("next_action"), action_call.get("sender_id"), started=received):
+        record_span("webhook.decode", received, decoded, bytes=len(body), events=_event_count(action_call))
+        utils.check_version_compatibility(action_call.get("version"))
+        try:
+            result = await executor.run(action_call)
+        except ActionExecutionRejection as e:
+            logger.debug(e)
+            return _json({"error": e.message, "action_name": e.action_name}, status=400)
+        except ActionNotFoundException as e:
+            logger.error(e)
+            return _json({"error": e.message, "action_name": e.action_name}, status=404)
+        with span("webhook.encode"):
+            return _json(result)
+
+
+def create_app(action_package_name: Text, cors_origins: Text = "*") -> Sanic:
+    """The app of `rasa_sdk.endpoint.create_app` (/health, /webhook, /actions) with the fast webhook."""
+    app = Sanic("action_server", configure_logging=False)
+    configure_cors(app, cors_origins)
+
+    executor = ActionExecutor()
+    executor.register_package(action_package_name)
+
+    @app.get("/health")
+    async def health(_):
+        return _json({"status": "ok"})
+
+    @app.post("/webhook")
+    async def webhook(request):
+        return await handle_webhook(executor, request.body)
+
+    @app.get("/actions")
+    async def actions(_):
+        return _json([{"name": name} for name in executor.actions.keys()])
+
+    return app
@@ -0,0 +1,334 @@
+"""Runs several action server processes behind one listening socket.
+
+The parent process loads what every worker only reads (the action package, the device catalogue snapshot, the fuzzy
+matchers and the form plans) and then forks the workers, which share these objects copy-on-write instead of each
+building its own copy. The kernel hands new connections to whichever worker accepts first. The parent only supervises:
+
+(-) workers that exit are started again, after a growing delay while they keep failing before they are ready
+(-) workers that send no heartbeat for `WORKER_TIMEOUT` seconds, e.g. because their event loop is blocked, are killed
+    and started again
+(-) `SIGHUP` runs the preload again (e.g. for a new catalogue snapshot) and replaces the workers one after the other,
+    each once the previous replacement is ready
+(-) `SIGTERM` and `SIGINT` stop the workers gracefully, webhook calls in flight are answered
+
+    $ python -m actions.server --workers 4
+"""
+import asyncio
+import logging
+import os
+import select
+import signal
+import socket
+from time import monotonic, sleep
+from typing import Callable, Dict, List, Optional, Text, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds between heartbeats of a worker
+HEARTBEAT_INTERVAL = 1
+
+# SIGCHLD only wakes the supervisor up, so exited workers are started again right away
+HANDLED_SIGNALS = (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD)
+
+
+def available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def bind_socket(host: Text, port: int, backlog: int = 100) -> socket.socket:
+    """Listening socket shared by the workers. It stays open while workers restart, so connections wait in the
+    backlog instead of being refused."""
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+async def send_heartbeats(heartbeat: int, interval: float = HEARTBEAT_INTERVAL,
+                          is_healthy: Callable[[], bool] = lambda: True):
+    """Tells the supervisor that the event loop of this worker is responsive, while `is_healthy`.
+
+    Stops the worker when the supervisor is gone.
+    """
+    while True:
+        if is_healthy():
+            try:
+                os.write(heartbeat, b".")
+            except BlockingIOError:
+                # The supervisor did not read the previous heartbeats yet
+                pass
+            except BrokenPipeError:
+                logger.error("Supervisor process is gone, stopping worker")
+                os.kill(os.getpid(), signal.SIGTERM)
+                return
+        await asyncio.sleep(interval)
+
+
+class Worker:
+    __slots__ = ("number", "pid", "heartbeat", "started", "last_seen", "ready")
+
+    def __init__(self, number: int, pid: int, heartbeat: int, started: float):
+        self.number = number
+        self.pid = pid
+        self.heartbeat = heartbeat
+        self.started = started
+        self.last_seen = started
+        self.ready = False
+
+
+class Supervisor:
+    """Forks `workers` processes running `serve(number, heartbeat)` and keeps them running.
+
+    `serve` gets the number of the worker (0 to workers - 1, a restarted worker keeps the number of the one it replaces)
+    and the file descriptor for `send_heartbeats`. A worker is ready with its first heartbeat. `preload` runs in the
+    parent before the first fork and before every graceful restart.
+    """
+
+    def __init__(self, serve: Callable[[int, int], None], workers: int, preload: Optional[Callable[[], None]] = None,
+                 timeout: float = 60, stop_timeout: float = 30, restart_delay: float = 1,
+                 max_restart_delay: float = 30, clock: Callable[[], float] = monotonic):
+        self.serve = serve
+        self.workers = workers
+        self.preload = preload or (lambda: None)
+        self.timeout = timeout
+        self.stop_timeout = stop_timeout
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self._clock = clock
+        self._running: Dict[int, Worker] = {}
+        # Workers asked to stop for a graceful restart and when they are killed instead
+        self._retiring: Dict[int, float] = {}
+        # Workers still to replace in a graceful restart
+        self._outdated: List[int] = []
+        # Consecutive failures before being ready and the time a worker is started again, per worker number
+        self._failures: Dict[int, int] = {}
+        self._restart_at: Dict[int, float] = {}
+        self._stopping = False
+        self._stop_requested = False
+        self._reload_requested = False
+        self._wakeup: Optional[Tuple[int, int]] = None
+        self._previous_handlers: Dict[int, object] = {}
+
+    @property
+    def pids(self) -> List[int]:
+        return sorted(self._running)
+
+    def ready(self) -> bool:
+        return len(self._running) == self.workers and all(worker.ready for worker in self._running.values())
+
+    def run(self):
+        """Starts the workers and supervises them until SIGTERM or SIGINT. SIGHUP restarts them gracefully."""
+        self._wakeup = os.pipe()
+        for fd in self._wakeup:
+            os.set_blocking(fd, False)
+        self._previous_handlers = {signum: signal.signal(signum, self._on_signal) for signum in HANDLED_SIGNALS}
+        previous_wakeup = signal.set_wakeup_fd(self._wakeup[1], warn_on_full_buffer=False)
+        try:
+            self.start()
+            while not self._stop_requested:
+                self.poll()
+        finally:
+            self.stop()
+            signal.set_wakeup_fd(previous_wakeup)
+            for signum, handler in self._previous_handlers.items():
+                signal.signal(signum, handler)
+            for fd in self._wakeup:
+                os.close(fd)
+            self._wakeup = None
+
+    def start(self):
+        self.preload()
+        for number in range(self.workers):
+            self._spawn(number)
+
+    def reload(self):
+        """Runs the preload again and replaces the running workers one after the other."""
+        try:
+            self.preload()
+        except Exception:
+            logger.exception("Preloading failed, keeping the running workers")
+            return
+        logger.info("Restarting %s workers", len(self._running))
+        self._outdated = sorted(self._running, key=lambda pid: self._running[pid].number)
+
+    def poll(self, timeout: float = 1):
+        """Waits up to `timeout` seconds for heartbeats and signals, then reaps, kills and starts workers."""
+        now = self._clock()
+        wait = min([timeout] + [max(at - now, 0) for at in self._restart_at.values()])
+        descriptors = [worker.heartbeat for worker in self._running.values() if worker.heartbeat >= 0]
+        if self._wakeup is not None:
+            descriptors.append(self._wakeup[0])
+        try:
+            readable, _, _ = select.select(descriptors, [], [], wait)
+        except InterruptedError:
+            readable = []
+
+        now = self._clock()
+        if self._wakeup is not None and self._wakeup[0] in readable:
+            _read_all(self._wakeup[0])
+        for worker in list(self._running.values()):
+            if worker.heartbeat in readable:
+                self._receive_heartbeat(worker, now)
+        self._reap(now)
+        if self._stop_requested:
+            return
+        if self._reload_requested:
+            self._reload_requested = False
+            self.reload()
+        self._check(now)
+        for number, at in list(self._restart_at.items()):
+            if at <= now:
+                self._spawn(number)
+        self._replace_next()
+
+    def stop(self):
+        """Stops the workers gracefully, kills those still running after `stop_timeout` seconds."""
+        self._stopping = True
+        for worker in self._running.values():
+            _signal(worker.pid, signal.SIGTERM)
+        deadline = self._clock() + self.stop_timeout
+        while self._running and self._clock() < deadline:
+            self._reap(self._clock())
+            if self._running:
+                sleep(0.05)
+        for pid in list(self._running):
+            logger.error("Worker %s (pid %s) did not stop in time, killing it", self._running[pid].number, pid)
+            _signal(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self._close(self._running.pop(pid))
+
+    def _on_signal(self, signum, frame):
+        if signum == signal.SIGHUP:
+            self._reload_requested = True
+        elif signum != signal.SIGCHLD:
+            self._stop_requested = True
+
+    def _spawn(self, number: int):
+        self._restart_at.pop(number, None)
+        read, write = os.pipe()
+        os.set_blocking(read, False)
+        os.set_blocking(write, False)
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            self._run_worker(number, write)
+        os.close(write)
+        self._running[pid] = Worker(number, pid, read, self._clock())
+        logger.info("Started worker %s (pid %s)", number, pid)
+
+    def _run_worker(self, number: int, heartbeat: int):
+        code = 1
+        try:
+            if self._wakeup is not None:
+                signal.set_wakeup_fd(-1)
+                for fd in self._wakeup:
+                    os.close(fd)
+            for signum, handler in self._previous_handlers.items():
+                signal.signal(signum, handler)
+            for worker in self._running.values():
+                self._close(worker)
+            self.serve(number, heartbeat)
+            code = 0
+        except Exception:
+            logger.exception("Worker %s failed", number)
+        finally:
+            # Skips the exit handlers of the parent, e.g. stopping its logging thread
+            os._exit(code)
+
+    def _receive_heartbeat(self, worker: Worker, now: float):
+        if not _read_all(worker.heartbeat):
+            # The worker closed its end, it is exiting
+            self._close(worker)
+            return
+        worker.last_seen = now
+        if not worker.ready:
+            worker.ready = True
+            self._failures.pop(worker.number, None)
+            logger.info("Worker %s (pid %s) is ready after %.1fs", worker.number, worker.pid, now - worker.started)
+
+    def _reap(self, now: float):
+        for pid in list(self._running):
+            try:
+                reaped, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                reaped, status = pid, 0
+            if not reaped:
+                continue
+            worker = self._running.pop(pid)
+            self._close(worker)
+            if self._retiring.pop(pid, None) is not None:
+                if not self._stopping:
+                    self._spawn(worker.number)
+                continue
+            if self._stopping:
+                continue
+
+            failures = 0 if worker.ready else self._failures.get(worker.number, 0) + 1
+            self._failures[worker.number] = failures
+            delay = min(self.restart_delay * 2 ** (failures - 1), self.max_restart_delay) if failures else 0
+            logger.error("Worker %s (pid %s) exited with %s, starting it again in %.0fs",
+                         worker.number, pid, _describe(status), delay)
+            self._restart_at[worker.number] = now + delay
+
+    def _check(self, now: float):
+        for worker in self._running.values():
+            deadline = self._retiring.get(worker.pid)
+            if deadline is not None:
+                if now >= deadline:
+                    logger.error("Worker %s (pid %s) did not stop in time, killing it", worker.number, worker.pid)
+                    _signal(worker.pid, signal.SIGKILL)
+                continue
+            if now - worker.last_seen > self.timeout:
+                state = "sent no heartbeat" if worker.ready else "was not ready"
+                logger.error("Worker %s (pid %s) %s for %.0fs, killing it", worker.number, worker.pid, state,
+                             now - worker.last_seen)
+                _signal(worker.pid, signal.SIGKILL)
+                # Killed once, it is started again when it was reaped
+                worker.last_seen = float("inf")
+
+    def _replace_next(self):
+        # One worker at a time, the others keep serving
+        if self._retiring or self._restart_at or not self.ready():
+            return
+        while self._outdated:
+            worker = self._running.get(self._outdated.pop(0))
+            if worker is not None:
+                self._retiring[worker.pid] = self._clock() + self.stop_timeout
+                _signal(worker.pid, signal.SIGTERM)
+                return
+
+    @staticmethod
+    def _close(worker: Worker):
+        if worker.heartbeat >= 0:
+            os.close(worker.heartbeat)
+            worker.heartbeat = -1
+
+
+def _read_all(fd: int) -> bool:
+    """Empties a non-blocking pipe, false at its end."""
+    received = False
+    while True:
+        try:
+            data = os.read(fd, 4096)
+        except BlockingIOError:
+            return True
+        if not data:
+            return received
+        received = True
+
+
+def _describe(status: int) -> Text:
+    if os.WIFSIGNALED(status):
+        return f"signal {os.WTERMSIG(status)}"
+    return f"status {os.WEXITSTATUS(status)}"
+
+
+def _signal(pid: int, signum: int):
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        pass
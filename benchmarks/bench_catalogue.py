@@ -0,0 +1,61 @@
+"""Memory of a catalogue held as `DeviceRecord`s compared with the dicts parsed from JSON lines.
+
+Generates a catalogue of the size of `supported_devices_v2` with the manufacturers, form factors and Android SDK
+ranges of the test snapshot, and measures the allocations of keeping it with tracemalloc.
+
+    $ python -m benchmarks.bench_catalogue [--devices 50000]
+"""
+import argparse
+import json
+import random
+import timeit
+import tracemalloc
+from pathlib import Path
+
+from actions.device_index import DeviceRecord
+
+SNAPSHOT = Path(__file__).parent.parent / "tests" / "data" / "supported_devices.json"
+
+
+def catalogue_lines(devices: int):
+    with open(SNAPSHOT, encoding="utf-8") as file:
+        samples = json.load(file)
+    rng = random.Random(7)
+    for number in range(devices):
+        device = dict(rng.choice(samples))
+        device["Model Name"] = f"{device['Model Name']} {number}"
+        yield json.dumps(device)
+
+
+def allocated(load) -> int:
+    tracemalloc.start()
+    try:
+        kept = load()
+        size = tracemalloc.get_traced_memory()[0]
+        del kept
+        return size
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=50000, help="Devices in the generated catalogue")
+    args = parser.parse_args()
+    lines = list(catalogue_lines(args.devices))
+
+    dicts = allocated(lambda: [json.loads(line) for line in lines])
+    records = allocated(lambda: [DeviceRecord.from_source(json.loads(line)) for line in lines])
+    print(f"{'representation':<16}{'MiB':>8}{'bytes/device':>14}")
+    print(f"{'dict':<16}{dicts / 2 ** 20:>8.1f}{dicts / args.devices:>14.0f}")
+    print(f"{'DeviceRecord':<16}{records / 2 ** 20:>8.1f}{records / args.devices:>14.0f}")
+
+    source = json.loads(lines[0])
+    record = DeviceRecord.from_source(source)
+    for name, value in (("dict", source), ("DeviceRecord", record)):
+        seconds = min(timeit.repeat(lambda: value.get("Manufacturer"), number=200000, repeat=3)) / 200000
+        print(f"{name:<16} get {seconds * 1e9:.0f}ns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""Latency benchmark of the form validation hot path.
+
+Drives `ValidatePlaybackIssueForm` (`required_slots`, every `validate_*` method and all validators of a turn sharing a
+lookup context, as `run` does), `AskForConfirmation.run` and `SubmitIncidentAction.run` with synthetic trackers of
+growing event histories and different slot mixes, and reports p50/p95/p99 per action and history length.
+
+Elasticsearch and Airtable are replaced by in-process stand-ins with configurable latency. The catalogue stand-in
+answers from the device snapshot in `tests/data` and bypasses the search cache, so every lookup pays the latency.
+
+    $ python -m benchmarks.bench_form
+    $ python -m benchmarks.bench_form --save benchmarks/baselines/form.json
+    $ python -m benchmarks.bench_form --compare benchmarks/baselines/form.json
+
+With `--compare` the exit code is 1 if the p95 of an action exceeds its baseline by more than the tolerance (and by
+more than `--min-delta` ms, to ignore noise on sub-millisecond actions).
+"""
+import argparse
+import asyncio
+import copy
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Text
+from unittest import mock
+
+from rasa_sdk import Tracker
+from rasa_sdk.executor import CollectingDispatcher
+
+from actions import actions, elastic, spool
+from actions.device_index import DeviceIndex
+from actions.form_plans import get_form_plans
+from actions.lookup_context import turn_lookups
+
+DATA = Path(__file__).resolve().parent.parent / "tests" / "data"
+
+TEMPLATE = json.loads((DATA / "empty_tracker.json").read_text())
+
+DOMAIN: Dict[Text, Any] = {"responses": {}}
+
+# Slots of form_issue_playback in domain.yml
+DOMAIN_SLOTS = ["a_detailed_problem", "b_expected_behavior", "c_steps_to_reproduce", "video_content_type",
+                "video_content_id", "video_interruptions", "platform", "model_name", "vendor", "os_name", "os_version",
+                "app_version", "connectivity", "error_message", "email_contact"]
+
+ENTITY_NAMES = [actions.SLOT_MODEL, actions.SLOT_VENDOR, actions.SLOT_OS_NAME, actions.SLOT_APP_VERSION, "email"]
+
+# Slots extracted in the benchmarked turn, with the confidence of their entities
+SCENARIOS: Dict[Text, Dict[Text, Any]] = {
+    "model": {"slots": {actions.SLOT_MODEL: "Galaxy S8"}, "confidence": 0.95},
+    "model+vendor": {"slots": {actions.SLOT_MODEL: "Galaxy S8", actions.SLOT_VENDOR: "Samsung"}, "confidence": 0.95},
+    "apple": {"slots": {actions.SLOT_MODEL: "iPhone XR", actions.SLOT_VENDOR: "Apple",
+                        actions.SLOT_OS_NAME: "iOS 14.2"}, "confidence": 0.95},
+    "low_confidence": {"slots": {actions.SLOT_MODEL: "Pixle 4"}, "confidence": 0.4},
+    "versions": {"slots": {actions.SLOT_APP_VERSION: "5.3.1", actions.SLOT_OS_VERSION: "Android 11"},
+                 "confidence": 0.95},
+    "confirm": {"slots": {actions.SLOT_APP_VERSION: ["5.3.1", "5.4"], actions.SLOT_OS_NAME: ["android", "ios"],
+                          actions.SLOT_CONFIRM_REQ: [actions.SLOT_APP_VERSION, actions.SLOT_OS_NAME]},
+                "confidence": 0.95},
+    "web": {"slots": {actions.SLOT_PLATFORM: actions.SLOT_VALUE_WEB, actions.SLOT_ISSUE_TYPE: "playback",
+                      actions.SLOT_MODEL: "Firefox"}, "confidence": 0.95},
+}
+
+
+class Catalogue:
+    """Stand-in for the Elasticsearch device catalogue."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.index = DeviceIndex.load(str(DATA / "supported_devices.json"))
+
+    async def search_model(self, model: Text) -> Dict[Text, Any]:
+        await asyncio.sleep(self.latency)
+        return self.index.search_model(model or "")
+
+    async def search_manufacturer(self, manufacturer: Text) -> Dict[Text, Any]:
+        await asyncio.sleep(self.latency)
+        return self.index.search_manufacturer(manufacturer or "")
+
+
+class Airtable:
+    """Stand-in for the Airtable API, used by the incident submission worker."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.records = 0
+
+    async def post(self, records: List[Dict[Text, Any]]) -> Dict[Text, Any]:
+        await asyncio.sleep(self.latency)
+        self.records += len(records)
+        return {"records": [{"id": f"rec{self.records + i}", "fields": fields} for i, fields in enumerate(records)]}
+
+
+def user_event(timestamp: float, text: Text, intent: Text, entities: List[Dict[Text, Any]]) -> Dict[Text, Any]:
+    return {"event": "user", "timestamp": timestamp, "text": text,
+            "parse_data": {"intent": {"name": intent, "confidence": 0.9}, "entities": entities, "text": text}}
+
+
+def tracker_state(history: int, scenario: Dict[Text, Any], rng: random.Random) -> Dict[Text, Any]:
+    """A tracker with about `history` earlier events followed by a turn extracting the slots of `scenario`."""
+    state = copy.deepcopy(TEMPLATE)
+    events = state["events"]
+    timestamp = state["latest_event_time"]
+    while len(events) < history:
+        timestamp += 1
+        entities = [{"entity": name, "value": "x", "confidence_entity": round(rng.random(), 2)}
+                    for name in rng.sample(ENTITY_NAMES, rng.randint(0, 2))]
+        events.append(user_event(timestamp, "...", "inform", entities))
+        events.append({"event": "action", "timestamp": timestamp, "name": "action_listen"})
+
+    slots = scenario["slots"]
+    timestamp += 1
+    entities = [{"entity": name, "value": value, "confidence_entity": scenario["confidence"]}
+                for name, value in slots.items() if name in ENTITY_NAMES]
+    events.append(user_event(timestamp, "...", "confirm", entities))
+    events.extend({"event": "slot", "timestamp": timestamp, "name": name, "value": value}
+                  for name, value in slots.items())
+    state["slots"].update(slots)
+    state["slots"][actions.SLOT_ISSUE_TYPE] = slots.get(actions.SLOT_ISSUE_TYPE, "playback")
+    state["slots"]["requested_slot"] = actions.SLOT_PROBLEM_DESCR
+    state["latest_message"] = events[-1 - len(slots)]["parse_data"]
+    return state
+
+
+def fresh_tracker(state: Dict[Text, Any]) -> Tracker:
+    # Actions may change slot values in place, the event history is shared
+    return Tracker.from_dict(dict(state, slots=copy.deepcopy(state["slots"])))
+
+
+async def validate_turn(form: actions.ValidatePlaybackIssueForm, tracker: Tracker):
+    """All validators of one turn, sharing a lookup context like `ValidatePlaybackIssueForm.run`."""
+    dispatcher = CollectingDispatcher()
+    with turn_lookups() as lookups:
+        actions.prefetch_lookups(lookups, tracker)
+        for name, value in tracker.slots_to_validate().items():
+            validate = getattr(form, f"validate_{name}", None)
+            if validate is not None:
+                await validate(value, dispatcher, tracker, DOMAIN)
+
+
+def benchmarked_actions() -> Dict[Text, Callable[[Tracker], Any]]:
+    form = actions.ValidatePlaybackIssueForm()
+    ask = actions.AskForConfirmation()
+    submit = actions.SubmitIncidentAction()
+
+    def validator(slot: Text):
+        return lambda tracker: getattr(form, f"validate_{slot}")(tracker.get_slot(slot), CollectingDispatcher(),
+                                                                 tracker, DOMAIN)
+
+    calls = {
+        "required_slots": lambda tracker: form.required_slots(list(DOMAIN_SLOTS), CollectingDispatcher(), tracker,
+                                                              DOMAIN),
+        "validate_turn": lambda tracker: validate_turn(form, tracker),
+        "AskForConfirmation.run": lambda tracker: ask.run(CollectingDispatcher(), tracker, DOMAIN),
+        "SubmitIncidentAction.run": lambda tracker: submit.run(CollectingDispatcher(), tracker, DOMAIN),
+    }
+    for slot in (actions.SLOT_MODEL, actions.SLOT_VENDOR, actions.SLOT_OS_NAME, actions.SLOT_OS_VERSION,
+                 actions.SLOT_APP_VERSION):
+        calls[f"validate_{slot}"] = validator(slot)
+    return calls
+
+
+def applies(action: Text, scenario: Dict[Text, Any]) -> bool:
+    # Validators only run for slots extracted in the turn
+    if action.startswith("validate_") and action != "validate_turn":
+        return action[len("validate_"):] in scenario["slots"]
+    if action == "AskForConfirmation.run":
+        return actions.SLOT_CONFIRM_REQ in scenario["slots"]
+    return True
+
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+async def measure(histories: List[int], iterations: int, catalogue: Catalogue,
+                  airtable: Airtable) -> Dict[Text, Dict[Text, float]]:
+    spool_dir = tempfile.mkdtemp(prefix="bench_form")
+    worker = spool.SubmissionWorker(spool.IncidentSpool(os.path.join(spool_dir, "incidents.spool")),
+                                    post_batch=airtable.post, requests_per_second=0, flush_interval=0.05)
+    rng = random.Random(42)
+    # Compiled at startup by the action server
+    get_form_plans()
+    results = {}
+    with mock.patch.object(elastic, "search_model_async", catalogue.search_model), \
+            mock.patch.object(elastic, "search_manufacturer_async", catalogue.search_manufacturer), \
+            mock.patch.object(spool, "_worker", worker):
+        calls = benchmarked_actions()
+        for history in histories:
+            states = {name: tracker_state(history, scenario, rng) for name, scenario in SCENARIOS.items()}
+            for action, call in calls.items():
+                samples = []
+                for name, scenario in SCENARIOS.items():
+                    if not applies(action, scenario):
+                        continue
+                    for _ in range(iterations):
+                        tracker = fresh_tracker(states[name])
+                        started = perf_counter()
+                        await call(tracker)
+                        samples.append(perf_counter() - started)
+                results[f"{action}@{history}"] = {
+                    "n": len(samples),
+                    "p50": percentile(samples, 50) * 1e3,
+                    "p95": percentile(samples, 95) * 1e3,
+                    "p99": percentile(samples, 99) * 1e3,
+                }
+        await worker.drain()
+        await worker.stop()
+    return results
+
+
+def compare(results: Dict[Text, Dict[Text, float]], baseline: Dict[Text, Dict[Text, float]],
+            tolerance: float, min_delta: float) -> List[Text]:
+    regressions = []
+    for key, result in results.items():
+        before = baseline.get(key)
+        # Sub-millisecond actions vary by more than the tolerance from run to run
+        if before and result["p95"] > before["p95"] * (1 + tolerance) and \
+                result["p95"] - before["p95"] > min_delta:
+            regressions.append(f"{key}: p95 {before['p95']:.3f} ms -> {result['p95']:.3f} ms")
+    return regressions
+
+
+def main(argv: Optional[List[Text]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--iterations", type=int, default=50, help="Calls per action, scenario and history")
+    parser.add_argument("--history", type=int, nargs="+", default=[10, 100, 1000], help="Events before the turn")
+    parser.add_argument("--search-latency", type=float, default=2, help="Catalogue latency in ms")
+    parser.add_argument("--airtable-latency", type=float, default=50, help="Airtable latency in ms")
+    parser.add_argument("--save", help="Write the results as baseline to this file")
+    parser.add_argument("--compare", help="Compare the results with the baseline in this file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p95 increase over the baseline")
+    parser.add_argument("--min-delta", type=float, default=0.5, help="p95 increase in ms always allowed")
+    args = parser.parse_args(argv)
+
+    catalogue = Catalogue(args.search_latency / 1e3)
+    airtable = Airtable(args.airtable_latency / 1e3)
+    results = asyncio.run(measure(args.history, args.iterations, catalogue, airtable))
+
+    print(f"{'action':<28}{'events':>8}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for key, result in results.items():
+        action, history = key.rsplit("@", 1)
+        print(f"{action:<28}{history:>8}{result['n']:>6}{result['p50']:>10.3f}{result['p95']:>10.3f}"
+              f"{result['p99']:>10.3f}")
+
+    settings = {"iterations": args.iterations, "search_latency": args.search_latency,
+                "airtable_latency": args.airtable_latency}
+    if args.save:
+        Path(args.save).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.save).write_text(json.dumps({"settings": settings, "results": results}, indent=2))
+        print(f"Saved baseline to {args.save}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        if baseline.get("settings") != settings:
+            print(f"Baseline was measured with {baseline.get('settings')}, results may not be comparable")
+        regressions = compare(results, baseline["results"], args.tolerance, args.min_delta)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print("No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
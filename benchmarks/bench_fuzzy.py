@@ -0,0 +1,57 @@
+"""Micro-benchmark of fuzzy matching against growing vocabularies.
+
+Compares a linear `fuzz.ratio` scan (the previous `find_fuzzy_match`) with `FuzzyIndex` for the tokens of a typical
+model name.
+
+    $ python -m benchmarks.bench_fuzzy
+"""
+import argparse
+import random
+import string
+import timeit
+
+from thefuzz import fuzz
+
+from actions.fuzzy import FuzzyIndex, load_lookup_table
+
+
+def linear_scan(candidate, items):
+    for token in items:
+        if fuzz.ratio(candidate.lower(), token.lower()) >= 70:
+            return token
+    return None
+
+
+def vocabulary(size: int, rng: random.Random):
+    vendors = load_lookup_table("data/nlu/lookups/vendor.yml", "vendor")
+    words = list(vendors)
+    while len(words) < size:
+        words.append("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 12))))
+    return words
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--number", type=int, default=20, help="Lookups per measurement")
+    args = parser.parse_args()
+
+    tokens = ["Galaxy", "S8", "Samsnug"]
+    print(f"{'entries':>8}{'linear ms':>12}{'index ms':>12}{'speedup':>10}")
+    for size in (20, 200, 2000, 10000):
+        words = vocabulary(size, random.Random(size))
+        index = FuzzyIndex(words)
+        assert [index.match(token) for token in tokens] == [linear_scan(token, words) for token in tokens]
+
+        def indexed():
+            # A fresh memo so every lookup is scored
+            index._matches.clear()
+            return index.match_all(tokens)
+
+        before = min(timeit.repeat(lambda: [linear_scan(token, words) for token in tokens],
+                                   number=args.number, repeat=3)) / args.number
+        after = min(timeit.repeat(indexed, number=args.number, repeat=3)) / args.number
+        print(f"{size:>8}{before * 1e3:>12.3f}{after * 1e3:>12.3f}{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
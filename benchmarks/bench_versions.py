@@ -0,0 +1,70 @@
+"""Micro-benchmark of the version parsing used by the form validators.
+
+Compares the precompiled single-pass `parse_versions` with the previous implementation, which compiled the os name
+pattern on every call and ran the app version search twice for every os version lookup.
+
+    $ python -m benchmarks.bench_versions
+"""
+import argparse
+import re
+import timeit
+
+from actions.util import parse_versions
+
+MESSAGES = {
+    "slot": "5.3.1",
+    "sentence": "Ich habe ein Pixel 4 mit Android 12 und die App Version 5.3.1",
+    "paragraph": "Seit dem letzten Update bricht der Stream bei jeder Sendung nach ein paar Minuten ab. "
+                 "Ich nutze ein Galaxy S8 mit Android 9.0 und habe die App in Version 5.12.2 installiert. "
+                 "Neu installieren und den Cache leeren hat nichts geholfen, im Browser funktioniert alles. "
+                 "Das WLAN hat 100 Mbit und andere Apps laufen ohne Probleme. " * 3,
+    "list": ["iOS 14.2", "iPhone 12", "5.3"],
+}
+
+
+def legacy_is_valid_os_name(name: str):
+    pattern = re.compile(r"((android)|(ios)|(tvos))((?:\s*)?(\d+\.)?(\d+\.)?(\d+))?")
+    return bool(pattern.match(name.lower())) or name.lower() == "unkown"
+
+
+def legacy_match_version(slot_value, pattern: str):
+    matches = []
+    for item in slot_value if type(slot_value) is list else [slot_value]:
+        match = re.search(pattern, item)
+        if match and match[0]:
+            matches.append(match[0])
+    return matches
+
+
+def legacy_match_app_version(slot_value):
+    return legacy_match_version(slot_value, r"((?<!\.)(5\.)(\d+\.)?(\d+))")
+
+
+def legacy_match_os_version(slot_value):
+    if legacy_match_app_version(slot_value):
+        return None
+    return legacy_match_version(slot_value, r"(\d+\.)?(\d+\.)?(\d+)")
+
+
+def legacy(value):
+    items = value if type(value) is list else [value]
+    return (legacy_match_app_version(value), legacy_match_os_version(value),
+            [item for item in items if legacy_is_valid_os_name(item)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--number", type=int, default=20000, help="Calls per measurement")
+    args = parser.parse_args()
+
+    print(f"{'message':<12}{'chars':>8}{'legacy µs':>12}{'engine µs':>12}{'speedup':>10}")
+    for name, message in MESSAGES.items():
+        assert list(parse_versions(message)) == list(legacy(message))
+        chars = sum(map(len, message)) if type(message) is list else len(message)
+        before = min(timeit.repeat(lambda: legacy(message), number=args.number, repeat=3)) / args.number
+        after = min(timeit.repeat(lambda: parse_versions(message), number=args.number, repeat=3)) / args.number
+        print(f"{name:<12}{chars:>8}{before * 1e6:>12.2f}{after * 1e6:>12.2f}{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Decoding a webhook call of a long conversation, completely with json and orjson and with lazily parsed events.
+
+The conversation has the events Rasa 2.8 sends per turn: the user message with its complete `parse_data`, the
+featurization marker, the slot set from the entity, the actions with their policy and the bot utterance. Each decoded
+call is used like a form validation uses it: the confidence of the latest model name entity is looked up
+and the slots set in the turn are collected. Time and allocations include that work.
+
+    $ python -m benchmarks.bench_webhook [--turns 500]
+"""
+import argparse
+import json
+import timeit
+import tracemalloc
+
+import orjson
+from rasa_sdk import Tracker
+
+from actions.tracker_index import LatestEntityConfidences
+from actions.webhook import decode_action_call
+from tests.test_webhook import action_call
+
+INTENTS = ["inform", "affirm", "deny", "greet", "goodbye", "bot_challenge", "report_playback_issue", "help",
+           "explain", "out_of_scope"]
+
+
+def turn_events(turn: int):
+    timestamp = 1622547000 + turn * 10
+    text = f"Ich habe ein iPhone {turn % 13} und das Video bleibt hängen"
+    ranking = [{"id": hash(intent) % 10 ** 18, "name": intent, "confidence": round(1 / (rank + 2), 6)}
+               for rank, intent in enumerate(INTENTS)]
+    entity = {"entity": "model_name", "start": 13, "end": 21, "confidence_entity": 0.9 - turn % 5 / 10,
+              "value": f"iPhone {turn % 13}", "extractor": "DIETClassifier", "processors": ["EntitySynonymMapper"]}
+    return [
+        {"event": "user", "timestamp": timestamp, "metadata": {}, "text": text,
+         "parse_data": {"intent": ranking[0], "entities": [entity], "text": text, "message_id": f"{turn:032x}",
+                        "metadata": {}, "intent_ranking": ranking,
+                        "response_selector": {"all_retrieval_intents": [], "default": {
+                            "response": {"id": None, "responses": None, "response_templates": None,
+                                         "confidence": 0.0, "intent_response_key": None, "utter_action": "utter_None",
+                                         "template_name": "utter_None"},
+                            "ranking": []}}},
+         "input_channel": "rest", "message_id": f"{turn:032x}"},
+        {"event": "user_featurization", "timestamp": timestamp + 0.01, "use_text_for_featurization": False},
+        {"event": "slot", "timestamp": timestamp + 0.01, "name": "model_name", "value": [entity["value"]]},
+        {"event": "action", "timestamp": timestamp + 0.02, "name": "utter_ask_app_version",
+         "policy": "policy_2_TEDPolicy", "confidence": 0.97, "action_text": None, "hide_rule_turn": False},
+        {"event": "bot", "timestamp": timestamp + 0.03, "text": "Welche Version der App nutzt du?",
+         "data": {"elements": None, "quick_replies": None, "buttons": None, "attachment": None, "image": None,
+                  "custom": None}, "metadata": {"utter_action": "utter_ask_app_version"}},
+        {"event": "action", "timestamp": timestamp + 0.04, "name": "action_listen",
+         "policy": "policy_2_TEDPolicy", "confidence": 0.99, "action_text": None, "hide_rule_turn": False},
+    ]
+
+
+def conversation(turns: int):
+    return [event for turn in range(turns) for event in turn_events(turn)]
+
+
+def use(action_call_state):
+    tracker = Tracker.from_dict(action_call_state["tracker"])
+    LatestEntityConfidences(tracker.events).confidence("model_name")
+    return tracker.slots_to_validate()
+
+
+def allocated(run) -> int:
+    tracemalloc.start()
+    try:
+        kept = run()
+        size = tracemalloc.get_traced_memory()[0]
+        del kept
+        return size
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=500, help="User messages in the conversation")
+    args = parser.parse_args()
+    body = json.dumps(action_call(conversation(args.turns))).encode("utf-8")
+    print(f"{len(body) / 2 ** 20:.1f} MiB body, {args.turns * 6} events")
+
+    decoders = (("json", lambda: json.loads(body)), ("orjson", lambda: orjson.loads(body)),
+                ("orjson lazy", lambda: decode_action_call(body, lazy_events=True)))
+    print(f"{'decoder':<14}{'ms':>8}{'KiB kept':>10}")
+    for name, decode in decoders:
+        seconds = min(timeit.repeat(lambda: use(decode()), number=20, repeat=3)) / 20
+        size = allocated(lambda: (lambda state: (state, use(state)))(decode()))
+        print(f"{name:<14}{seconds * 1e3:>8.2f}{size / 2 ** 10:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,469 @@
+"""Load generator for the action server webhook.
+
+Plays scripted form conversations (the slot sequences of the playback and stream interruption plans in
+`form_plans.yml`) as webhook POSTs, like Rasa does, and reports throughput, latency percentiles per action and error
+rates.
+
+Load is either closed (`--concurrency` conversations running back to back) or open (`--rate` webhook calls per
+second, conversations are started to keep up the rate whatever the server latency).
+
+The action server should run against the stubs of this module instead of the real backends:
+
+(-) a stub Elasticsearch answering `_search`/`_msearch` from the device snapshot in `tests/data`, including the
+    exact and prefix lookups of `ELASTIC_SEARCH_MODE=tiered`
+(-) a stub Airtable accepting incident records and updates
+
+    $ python -m benchmarks.loadgen stubs                 # stubs only, start the action server yourself
+    $ python -m benchmarks.loadgen run --spawn -c 50     # stubs and an action server subprocess
+    $ python -m benchmarks.loadgen run --url http://localhost:5055/webhook --rate 200 --duration 60
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import uuid
+from collections import Counter, defaultdict
+from pathlib import Path
+from time import monotonic, perf_counter
+from typing import Any, Dict, List, Optional, Text
+
+import aiohttp
+import yaml
+from aiohttp import web
+
+from actions import actions
+from actions.device_index import DeviceIndex
+from actions.form_plans import get_form_plans
+from benchmarks.bench_form import percentile
+
+ROOT = Path(__file__).resolve().parent.parent
+
+DEVICES = ROOT / "tests" / "data" / "supported_devices.json"
+
+FORM = "form_issue_playback"
+
+# Issue type intent of each conversation, named by its form plan
+CONVERSATIONS = {
+    "playback": "issue_playback",
+    "stream_interrupt": "issue_stream_interruptions",
+}
+
+SLOT_VALUES: Dict[Text, List[Any]] = {
+    actions.SLOT_PROBLEM_DESCR: ["Das Video bleibt nach ein paar Minuten stehen", "Der Ton ist nicht synchron"],
+    actions.SLOT_REPRODUCE: ["App öffnen und eine Sendung starten", "Livestream im WLAN ansehen"],
+    actions.SLOT_MODEL: ["Galaxy S8", "iPhone", "iPad", "Fire TV", "Pixel 4", "Apple TV 4k"],
+    actions.SLOT_PLATFORM: ["Phone", "Tablet", "TV"],
+    actions.SLOT_VENDOR: ["Samsung", "Apple", "Google", "Amazon"],
+    actions.SLOT_OS_NAME: ["android", "ios", "Android 11"],
+    actions.SLOT_OS_VERSION: ["11", "14.2", "9.0"],
+    actions.SLOT_APP_VERSION: ["5.3.1", "5.12", "version 5.4.2"],
+    actions.SLOT_VIDEO_CONTENT_TYPE: ["live", "vod"],
+    actions.SLOT_VIDEO_CONTENT_ID: ["tagesschau", "sportschau"],
+    actions.SLOT_INTERRUPTIONS: [True, False],
+    actions.SLOT_CONNECTIVITY: ["wifi", "lte"],
+    actions.SLOT_ERROR_MSG: ["Fehler 1003", "no_error_msg"],
+    "email_contact": ["tester@example.org", "none"],
+}
+
+
+# -- Stubs -------------------------------------------------------------------------------------------------------------
+
+
+def hits_response(hits: List[Dict[Text, Any]], suggest: Dict[Text, Any]) -> Dict[Text, Any]:
+    hits = [{"_index": "supported_devices_v2", "_id": str(i), "_score": 1.0, "_source": dict(hit)}
+            for i, hit in enumerate(hits)]
+    return {"took": 1, "timed_out": False,
+            "hits": {"total": {"value": len(hits), "relation": "eq"}, "max_score": 1.0 if hits else None,
+                     "hits": hits},
+            "suggest": suggest}
+
+
+def fast_search_response(index: DeviceIndex, body: Dict[Text, Any]) -> Dict[Text, Any]:
+    """Answers a search built by `actions.elastic.fast_query` (exact match and completion) from the device snapshot."""
+    subfield, query = next(iter(body["query"]["match"].items()))
+    field = subfield.rsplit(".", 1)[0]
+    hit = index.exact(query, field)
+    prefix = index.prefix(query, field)
+    options = [{"text": prefix[field], "_index": "supported_devices_v2", "_id": "0", "_score": 1.0,
+                "_source": dict(prefix)}] if prefix else []
+    return hits_response([hit] if hit else [], {
+        "prefix": [{"text": query, "offset": 0, "length": len(query), "options": options}]})
+
+
+def search_response(index: DeviceIndex, body: Dict[Text, Any]) -> Dict[Text, Any]:
+    """Answers a search built by `actions.elastic.model_query` or `manufacturer_query` from the device snapshot."""
+    if "match" in body.get("query", {}):
+        return fast_search_response(index, body)
+    query = body.get("query", {}).get("multi_match", {}).get("query", "")
+    suggest_name = next(iter(body.get("suggest", {})), "model")
+    result = index.search_model(query) if suggest_name == "model" else index.search_manufacturer(query)
+
+    options = [{"text": result["suggestion"], "score": 0.5}] if "suggestion" in result else []
+    return hits_response([result["hit"]] if "hit" in result else [], {
+        suggest_name: [{"text": query, "offset": 0, "length": len(query), "options": options}]})
+
+
+def create_elastic_stub(index: DeviceIndex, latency: float) -> web.Application:
+    app = web.Application()
+    # Clients of 7.14+ refuse to talk to a server that does not identify as Elasticsearch
+    headers = {"X-Elastic-Product": "Elasticsearch"}
+
+    async def info(_):
+        return web.json_response({"version": {"number": "7.17.0", "build_flavor": "default"},
+                                  "tagline": "You Know, for Search"}, headers=headers)
+
+    async def search(request):
+        await asyncio.sleep(latency)
+        return web.json_response(search_response(index, await request.json()), headers=headers)
+
+    async def msearch(request):
+        await asyncio.sleep(latency)
+        lines = [json.loads(line) for line in (await request.text()).splitlines() if line.strip()]
+        responses = [dict(search_response(index, body), status=200) for body in lines[1::2]]
+        return web.json_response({"took": 1, "responses": responses}, headers=headers)
+
+    app.router.add_get("/", info)
+    app.router.add_post("/_search", search)
+    app.router.add_post("/{index}/_search", search)
+    app.router.add_post("/_msearch", msearch)
+    app.router.add_post("/{index}/_msearch", msearch)
+    return app
+
+
+def create_airtable_stub(latency: float) -> web.Application:
+    app = web.Application()
+    app["records"] = 0
+
+    async def create_records(request):
+        await asyncio.sleep(latency)
+        records = (await request.json()).get("records", [])
+        app["records"] += len(records)
+        return web.json_response({"records": [dict(record, id=f"rec{uuid.uuid4().hex[:14]}") for record in records]})
+
+    app.router.add_post("/{base}/{table}", create_records)
+    # Upserts of the occurrence counts of deduplicated incidents (INCIDENT_DEDUP)
+    app.router.add_patch("/{base}/{table}", create_records)
+    return app
+
+
+async def start_stubs(elastic_port: int, airtable_port: int, elastic_latency: float,
+                      airtable_latency: float) -> List[web.AppRunner]:
+    runners = []
+    for app, port in ((create_elastic_stub(DeviceIndex.load(str(DEVICES)), elastic_latency), elastic_port),
+                      (create_airtable_stub(airtable_latency), airtable_port)):
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        runners.append(runner)
+    return runners
+
+
+def stub_environment(elastic_port: int, airtable_port: int) -> Dict[Text, Text]:
+    """Environment pointing the action server at the stubs."""
+    return {
+        "ELASTIC_HOST": f"http://127.0.0.1:{elastic_port}",
+        "ELASTIC_MODE": "remote",
+        "ELASTIC_ADMIN": "loadgen",
+        "ELASTIC_PSWD": "loadgen",
+        "AIRTABLE_API_URL": f"http://127.0.0.1:{airtable_port}",
+        "AIRTABLE_BASE_ID": "base",
+        "AIRTABLE_API_KEY": "key",
+        "AIRTABLE_TABLE": "incidents",
+        "INCIDENT_SPOOL_PATH": os.path.join(tempfile.mkdtemp(prefix="loadgen"), "incidents.spool"),
+    }
+
+
+# -- Conversations -----------------------------------------------------------------------------------------------------
+
+
+class Conversation:
+    """Client side tracker of one scripted conversation, updated with the events returned by the server."""
+
+    def __init__(self, domain: Dict[Text, Any], rng: random.Random):
+        self.domain = domain
+        self.rng = rng
+        self.sender_id = uuid.uuid4().hex
+        self.slots: Dict[Text, Any] = {}
+        self.events: List[Dict[Text, Any]] = [{"event": "action", "timestamp": self.now(), "name": "action_listen"}]
+        self.latest_message: Dict[Text, Any] = {}
+        self.active_loop: Dict[Text, Any] = {}
+
+    @staticmethod
+    def now() -> float:
+        return monotonic()
+
+    def user_says(self, intent: Text, entities: List[Dict[Text, Any]] = (), text: Text = "..."):
+        self.latest_message = {"intent": {"name": intent, "confidence": 0.95}, "entities": list(entities),
+                               "text": text}
+        self.events.append({"event": "user", "timestamp": self.now(), "text": text,
+                            "parse_data": self.latest_message})
+
+    def set_slot(self, name: Text, value: Any):
+        self.slots[name] = value
+        self.events.append({"event": "slot", "timestamp": self.now(), "name": name, "value": value})
+
+    def apply(self, events: List[Dict[Text, Any]]):
+        for event in events:
+            if event.get("event") == "slot":
+                self.slots[event["name"]] = event["value"]
+            elif event.get("event") == "reset_slots":
+                self.slots = {}
+            self.events.append(event)
+
+    def webhook_payload(self, action: Text) -> Dict[Text, Any]:
+        tracker = {"sender_id": self.sender_id, "slots": dict(self.slots), "latest_message": self.latest_message,
+                   "events": self.events, "paused": False, "followup_action": None,
+                   "active_loop": self.active_loop, "latest_action_name": self.events[-1].get("name")}
+        return {"next_action": action, "sender_id": self.sender_id, "tracker": tracker, "domain": self.domain,
+                "version": "2.8.0"}
+
+    def turns(self, kind: Text):
+        """Yields the actions to call for a conversation of `kind`, the tracker is prepared for each call."""
+        self.user_says(CONVERSATIONS[kind])
+        yield "action_set_incident_type_slot"
+
+        self.active_loop = {"name": FORM}
+        for slot in get_form_plans().plan(kind, is_web=False, confirm_pending=False):
+            self.set_slot("requested_slot", slot)
+            value = self.rng.choice(SLOT_VALUES[slot])
+            self.user_says("inform", [{"entity": slot, "value": value, "confidence_entity": 0.95}], str(value))
+            self.set_slot(slot, value)
+            yield f"validate_{FORM}"
+            if self.slots.get(actions.SLOT_CONFIRM_REQ):
+                yield f"action_ask_{actions.SLOT_CONFIRM}"
+        self.active_loop = {}
+
+        self.user_says("confirm")
+        yield "submit_incident"
+
+
+class Results:
+    def __init__(self):
+        self.latencies: Dict[Text, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.requests = 0
+        self.conversations = 0
+
+    def report(self, elapsed: float) -> Dict[Text, Any]:
+        failed = sum(self.errors.values())
+        report = {"elapsed": elapsed, "requests": self.requests, "conversations": self.conversations,
+                  "throughput": self.requests / elapsed if elapsed else 0,
+                  "conversations_per_second": self.conversations / elapsed if elapsed else 0,
+                  "error_rate": failed / self.requests if self.requests else 0,
+                  "errors": dict(self.errors), "actions": {}}
+        everything = [latency for latencies in self.latencies.values() for latency in latencies]
+        for action, latencies in sorted(self.latencies.items()) + [("all", everything)]:
+            if latencies:
+                report["actions"][action] = {"n": len(latencies),
+                                             **{f"p{q}": percentile(latencies, q) * 1e3 for q in (50, 95, 99)}}
+        return report
+
+
+async def call_action(session: aiohttp.ClientSession, url: Text, conversation: Conversation, action: Text,
+                      results: Results) -> bool:
+    payload = conversation.webhook_payload(action)
+    started = perf_counter()
+    results.requests += 1
+    try:
+        async with session.post(url, json=payload) as response:
+            if response.status != 200:
+                results.errors[f"{action}: HTTP {response.status}"] += 1
+                return False
+            body = await response.json(content_type=None)
+            results.latencies[action].append(perf_counter() - started)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+        results.errors[f"{action}: {type(err).__name__}"] += 1
+        return False
+    conversation.apply(body.get("events", []))
+    return True
+
+
+async def converse(session: aiohttp.ClientSession, url: Text, domain: Dict[Text, Any], rng: random.Random,
+                   results: Results, think_time: float, pacer: Optional["Pacer"] = None):
+    conversation = Conversation(domain, rng)
+    for action in conversation.turns(rng.choice(list(CONVERSATIONS))):
+        if pacer is not None:
+            await pacer.get()
+        if not await call_action(session, url, conversation, action, results):
+            return
+        if think_time:
+            await asyncio.sleep(rng.uniform(0, 2 * think_time))
+    results.conversations += 1
+
+
+async def closed_load(url: Text, domain: Dict[Text, Any], concurrency: int, duration: float, think_time: float,
+                      results: Results):
+    deadline = monotonic() + duration
+
+    async def user(seed: int):
+        rng = random.Random(seed)
+        while monotonic() < deadline:
+            await converse(session, url, domain, rng, results, think_time)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30)) as session:
+        await asyncio.gather(*(user(seed) for seed in range(concurrency)))
+
+
+class Pacer:
+    """Hands out webhook calls at a fixed rate to the conversations waiting for one."""
+
+    def __init__(self):
+        self._tokens = asyncio.Semaphore(0)
+        self.available = 0
+        self.waiting = 0
+
+    def release(self, count: int):
+        for _ in range(count):
+            self.available += 1
+            self._tokens.release()
+
+    @property
+    def unclaimed(self) -> int:
+        return self.available - self.waiting
+
+    async def get(self):
+        self.waiting += 1
+        try:
+            await self._tokens.acquire()
+        finally:
+            self.waiting -= 1
+        self.available -= 1
+
+
+async def open_load(url: Text, domain: Dict[Text, Any], rate: float, duration: float, think_time: float,
+                    results: Results):
+    """Releases `rate` webhook calls per second, starting conversations whenever no started one can take a call."""
+    pacer = Pacer()
+    deadline = monotonic() + duration
+    rng = random.Random(0)
+    conversations = set()
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0),
+                                     timeout=aiohttp.ClientTimeout(total=30)) as session:
+        started = monotonic()
+        released = 0
+        while monotonic() < deadline:
+            due = int((monotonic() - started) * rate)
+            pacer.release(due - released)
+            released = due
+            # New conversations claim their first call before the next iteration
+            for _ in range(pacer.unclaimed):
+                task = asyncio.ensure_future(converse(session, url, domain, random.Random(rng.random()), results,
+                                                      think_time, pacer))
+                conversations.add(task)
+                task.add_done_callback(conversations.discard)
+            await asyncio.sleep(0.001)
+        for task in list(conversations):
+            task.cancel()
+        await asyncio.gather(*conversations, return_exceptions=True)
+
+
+async def wait_until_ready(base_url: Text, timeout: float = 60):
+    deadline = monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while monotonic() < deadline:
+            try:
+                async with session.get(base_url + "/ready") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+    raise TimeoutError(f"Action server at {base_url} did not get ready within {timeout}s")
+
+
+async def run(args) -> Dict[Text, Any]:
+    domain = yaml.safe_load((ROOT / "domain.yml").read_text(encoding="utf-8"))
+    runners = []
+    server = None
+    url = args.url
+    if args.spawn:
+        runners = await start_stubs(args.elastic_port, args.airtable_port, args.elastic_latency / 1e3,
+                                    args.airtable_latency / 1e3)
+        env = dict(os.environ, **stub_environment(args.elastic_port, args.airtable_port))
+        server = subprocess.Popen([sys.executable, "-m", "actions.server", "--port", str(args.port)], cwd=ROOT,
+                                  env=env)
+        url = f"http://127.0.0.1:{args.port}/webhook"
+    try:
+        if args.spawn:
+            await wait_until_ready(url.rsplit("/", 1)[0])
+        results = Results()
+        started = monotonic()
+        if args.rate:
+            await open_load(url, domain, args.rate, args.duration, args.think_time / 1e3, results)
+        else:
+            await closed_load(url, domain, args.concurrency, args.duration, args.think_time / 1e3, results)
+        return results.report(monotonic() - started)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        for runner in runners:
+            await runner.cleanup()
+
+
+async def serve_stubs(args):
+    await start_stubs(args.elastic_port, args.airtable_port, args.elastic_latency / 1e3, args.airtable_latency / 1e3)
+    print("Start the action server with:")
+    for name, value in stub_environment(args.elastic_port, args.airtable_port).items():
+        print(f"  {name}={value}")
+    await asyncio.Event().wait()
+
+
+def print_report(report: Dict[Text, Any]):
+    print(f"{report['requests']} requests, {report['conversations']} conversations in {report['elapsed']:.1f}s")
+    print(f"throughput {report['throughput']:.1f} req/s, {report['conversations_per_second']:.2f} conversations/s, "
+          f"error rate {report['error_rate']:.2%}")
+    print(f"{'action':<34}{'n':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for action, stats in report["actions"].items():
+        print(f"{action:<34}{stats['n']:>8}{stats['p50']:>10.2f}{stats['p95']:>10.2f}{stats['p99']:>10.2f}")
+    for error, count in report["errors"].items():
+        print(f"ERROR {error}: {count}")
+
+
+def create_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--elastic-port", type=int, default=9201, help="Port of the Elasticsearch stub")
+    parser.add_argument("--airtable-port", type=int, default=9202, help="Port of the Airtable stub")
+    parser.add_argument("--elastic-latency", type=float, default=5, help="Latency of the Elasticsearch stub in ms")
+    parser.add_argument("--airtable-latency", type=float, default=100, help="Latency of the Airtable stub in ms")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("stubs", help="Only run the backend stubs")
+
+    load = commands.add_parser("run", help="Generate load")
+    target = load.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="Webhook URL of a running action server")
+    target.add_argument("--spawn", action="store_true", help="Start the stubs and an action server")
+    load.add_argument("--port", type=int, default=5056, help="Port of the spawned action server")
+    load.add_argument("-c", "--concurrency", type=int, default=10, help="Concurrent conversations (closed load)")
+    load.add_argument("-r", "--rate", type=float, help="Webhook calls per second (open load)")
+    load.add_argument("-d", "--duration", type=float, default=30, help="Seconds to generate load for")
+    load.add_argument("--think-time", type=float, default=0, help="Mean pause between turns in ms")
+    load.add_argument("--json", help="Also write the report to this file")
+    return parser
+
+
+def main(argv: Optional[List[Text]] = None) -> int:
+    args = create_argument_parser().parse_args(argv)
+    if args.command == "stubs":
+        try:
+            asyncio.run(serve_stubs(args))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+    return 0 if report["error_rate"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
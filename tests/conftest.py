@@ -1,4 +1,5 @@
 import json
+import os
 from pathlib import Path
 
 import pytest
@@ -7,6 +8,9 @@ from rasa_sdk.executor import CollectingDispatcher
 
 here = Path(__file__).parent.resolve()
 
+# Without an Elasticsearch cluster configured the device lookups are served from this snapshot
+os.environ.setdefault("DEVICE_INDEX_PATH", str(here / "data/supported_devices.json"))
+
 EMPTY_TRACKER = Tracker.from_dict(json.load(open(here / "./data/empty_tracker.json")))
 
 
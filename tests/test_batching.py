@@ -0,0 +1,91 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from actions.batching import SearchBatcher, SearchFailed
+
+
+class FakeCluster:
+    def __init__(self, delay: float = 0, error: Exception = None):
+        self.delay = delay
+        self.error = error
+        self.requests = []
+
+    async def __call__(self, bodies):
+        self.requests.append(bodies)
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return [{"error": {"type": "parse_exception"}} if body.get("bad") else {"hits": {"query": body["q"]}}
+                for body in bodies]
+
+
+class TestBatching(IsolatedAsyncioTestCase):
+
+    async def test_concurrent_searches_share_one_request(self):
+        cluster = FakeCluster()
+        batcher = SearchBatcher(cluster, window=0.01)
+
+        results = await asyncio.gather(*(batcher.submit(q, {"q": q}) for q in ["ipad", "iphone", "ipad", "pixel"]))
+
+        assert [result["hits"]["query"] for result in results] == ["ipad", "iphone", "ipad", "pixel"]
+        assert len(cluster.requests) == 1
+        assert [body["q"] for body in cluster.requests[0]] == ["ipad", "iphone", "pixel"]
+        assert batcher.coalesced == 1
+
+    async def test_in_flight_search_is_not_sent_again(self):
+        cluster = FakeCluster(delay=0.05)
+        batcher = SearchBatcher(cluster, window=0.001)
+
+        first = asyncio.ensure_future(batcher.submit("ipad", {"q": "ipad"}))
+        await asyncio.sleep(0.01)
+        second = await batcher.submit("ipad", {"q": "ipad"})
+
+        assert second == await first
+        assert len(cluster.requests) == 1
+
+    async def test_max_batch_sends_immediately(self):
+        cluster = FakeCluster()
+        batcher = SearchBatcher(cluster, window=60, max_batch=2)
+
+        await asyncio.wait_for(asyncio.gather(batcher.submit("a", {"q": "a"}), batcher.submit("b", {"q": "b"})), 1)
+
+        assert len(cluster.requests) == 1
+
+    async def test_errors_reach_every_caller(self):
+        batcher = SearchBatcher(FakeCluster(error=ConnectionError("unreachable")), window=0.001)
+
+        results = await asyncio.gather(batcher.submit("a", {"q": "a"}), batcher.submit("b", {"q": "b"}),
+                                       return_exceptions=True)
+
+        assert all(isinstance(result, ConnectionError) for result in results)
+
+    async def test_failed_search_does_not_fail_the_batch(self):
+        batcher = SearchBatcher(FakeCluster(), window=0.001)
+
+        good, bad = await asyncio.gather(batcher.submit("a", {"q": "a"}), batcher.submit("b", {"bad": True}),
+                                         return_exceptions=True)
+
+        assert good == {"hits": {"query": "a"}}
+        assert isinstance(bad, SearchFailed)
+
+    async def test_cancelled_caller_does_not_cancel_others(self):
+        cluster = FakeCluster(delay=0.05)
+        batcher = SearchBatcher(cluster, window=0.001)
+
+        impatient = asyncio.ensure_future(batcher.submit("ipad", {"q": "ipad"}))
+        patient = asyncio.ensure_future(batcher.submit("ipad", {"q": "ipad"}))
+        await asyncio.sleep(0.01)
+        impatient.cancel()
+
+        assert (await patient)["hits"]["query"] == "ipad"
+
+    async def test_close_sends_waiting_searches(self):
+        cluster = FakeCluster()
+        batcher = SearchBatcher(cluster, window=60)
+
+        search = asyncio.ensure_future(batcher.submit("a", {"q": "a"}))
+        await asyncio.sleep(0)
+        await batcher.close()
+
+        assert search.done()
+        assert len(cluster.requests) == 1
@@ -0,0 +1,55 @@
+from unittest import TestCase
+
+from actions.cache import TTLCache, normalize_query
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Test(TestCase):
+
+    def test_hit_and_miss(self):
+        cache = TTLCache(max_size=2, ttl=10)
+        assert cache.get("ipad") is None
+        cache.set("ipad", {"hit": {"Model Name": "iPad"}})
+
+        assert cache.get("ipad") == {"hit": {"Model Name": "iPad"}}
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_evicts_least_recently_used(self):
+        cache = TTLCache(max_size=2, ttl=10)
+        cache.set("ipad", 1)
+        cache.set("galaxy s8", 2)
+        cache.get("ipad")
+        cache.set("fire tv", 3)
+
+        assert cache.get("galaxy s8") is None
+        assert cache.get("ipad") == 1
+        assert cache.get("fire tv") == 3
+        assert cache.evictions == 1
+
+    def test_entries_expire(self):
+        clock = FakeClock()
+        cache = TTLCache(max_size=2, ttl=10, clock=clock)
+        cache.set("ipad", 1)
+        clock.now = 9
+        assert cache.get("ipad") == 1
+        clock.now = 10
+        assert cache.get("ipad") is None
+        assert cache.expirations == 1
+        assert len(cache) == 0
+
+    def test_disabled_cache(self):
+        cache = TTLCache(max_size=0)
+        cache.set("ipad", 1)
+        assert cache.get("ipad") is None
+
+    def test_normalize_query(self):
+        assert normalize_query("  Galaxy   S8 ") == "galaxy s8"
+        assert normalize_query(None) == ""
@@ -0,0 +1,113 @@
+import os
+from unittest import IsolatedAsyncioTestCase, TestCase, mock
+
+from actions import dedup
+from actions.config import reset_settings
+from actions.dedup import IncidentIndex, shingles, signature, similarity
+
+
+def incident(problem="Das Video stoppt nach ein paar Sekunden und lädt dann ewig",
+             steps="App öffnen, Livestream starten", model="iPhone 12", app_version="5.3.1"):
+    return {"Problem Statement": problem, "Steps to reproduce": steps, "Device Model": model, "OS Version": "14.2",
+            "App Version": app_version, "Content ID": "tagesschau"}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestIndex(TestCase):
+
+    def test_similarity(self):
+        first = signature(shingles("das video stoppt nach ein paar sekunden"))
+
+        assert similarity(first, first) == 1
+        assert similarity(first, signature(shingles("ton und bild sind nicht synchron"))) < 0.2
+
+    def test_near_duplicates_are_clustered(self):
+        index = IncidentIndex()
+
+        cluster, is_new = index.report(incident())
+        duplicate, duplicate_is_new = index.report(incident(problem="Das Video stoppt nach ein paar Sekunden und lädt "
+                                                                    "dann ewig!!"))
+
+        assert is_new and not duplicate_is_new
+        assert duplicate is cluster and cluster.count == 2
+
+    def test_different_reports_are_not_clustered(self):
+        index = IncidentIndex()
+        cluster, _ = index.report(incident())
+
+        for other in [incident(model="Galaxy S8"), incident(app_version="5.4"),
+                      incident(problem="Ton und Bild sind nicht synchron", steps="Video on demand abspielen")]:
+            assert index.report(other)[0] is not cluster
+        assert len(index) == 4
+        assert index.report(incident(problem="", steps="")) == (None, True)
+
+    def test_expiry_and_capacity(self):
+        clock = Clock()
+        index = IncidentIndex(window=60, max_clusters=2, clock=clock)
+        first, _ = index.report(incident())
+        clock.now = 59
+        assert index.report(incident())[0] is first
+
+        clock.now = 118
+        second, is_new = index.report(incident(model="Fire TV"))
+        assert is_new and second is not first
+        assert index.report(incident())[0] is first
+
+        clock.now = 180
+        assert index.report(incident(model="Fire TV"))[1]
+        assert len(index) == 1
+
+        index.report(incident(model="Pixel 6"))
+        index.report(incident(model="Galaxy S8"))
+        assert len(index) == 2
+        assert index._buckets and all(cluster.key in index._clusters
+                                      for clusters in index._buckets.values() for cluster in clusters)
+
+
+class TestSubmit(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.patches = [mock.patch.dict(os.environ, {"INCIDENT_DEDUP": "true"}),
+                        mock.patch.object(dedup, "_index", None),
+                        mock.patch.object(dedup, "submit_incident", return_value="created"),
+                        mock.patch.object(dedup, "submit_update", return_value="updated")]
+        self.env, _, self.submit_incident, self.submit_update = [patch.start() for patch in self.patches]
+        reset_settings()
+
+    def tearDown(self):
+        for patch in reversed(self.patches):
+            patch.stop()
+        reset_settings()
+
+    async def test_duplicates_update_occurrences(self):
+        assert await dedup.submit_deduplicated(incident()) == "created"
+        assert await dedup.submit_deduplicated(incident()) == "updated"
+
+        created, = self.submit_incident.call_args.args
+        cluster = created["Cluster"]
+        assert created["Occurrences"] == 1
+        self.submit_update.assert_awaited_once_with({"Cluster": cluster, "Occurrences": 2})
+
+    async def test_unspooled_cluster_is_forgotten(self):
+        self.submit_incident.side_effect = OSError("read-only file system")
+        with self.assertRaises(OSError):
+            await dedup.submit_deduplicated(incident())
+        self.submit_incident.side_effect = None
+
+        assert await dedup.submit_deduplicated(incident()) == "created"
+        self.submit_update.assert_not_called()
+
+    async def test_disabled(self):
+        with mock.patch.dict(os.environ, {"INCIDENT_DEDUP": "false"}):
+            reset_settings()
+            await dedup.submit_deduplicated(incident())
+            await dedup.submit_deduplicated(incident())
+
+        assert [call.args for call in self.submit_incident.call_args_list] == [(incident(),), (incident(),)]
@@ -0,0 +1,81 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from actions.device_index import DeviceIndex, DeviceRecord, ngrams, tokenize
+from tests.conftest import here
+
+INDEX = DeviceIndex.load(str(here / "data/supported_devices.json"))
+
+
+class Test(TestCase):
+
+    def test_tokenize(self):
+        assert tokenize("Galaxy S8+") == ["galaxy", "s8"]
+        assert tokenize(None) == []
+
+    def test_ngrams(self):
+        assert ngrams("tv") == [" tv", "tv "]
+        assert ngrams("a") == [" a "]
+
+    def test_exact_model_is_top_hit(self):
+        assert INDEX.search_model("galaxy s8")["hit"]["Model Name"] == "Galaxy S8"
+        assert INDEX.search_model("Fire TV")["hit"]["Model Name"] == "Fire TV"
+        assert INDEX.search_model("iPad")["hit"]["Model Name"] == "iPad"
+
+    def test_model_boost_over_manufacturer(self):
+        # "Apple" appears in the manufacturer of every apple device but the model name boost wins
+        assert INDEX.search_model("Apple TV")["hit"]["Model Name"] == "Apple TV"
+
+    def test_suggestion_for_typo(self):
+        result = INDEX.search_model("Galxy S8")
+        assert result["suggestion"] == "galaxy s8"
+        assert INDEX.search_model("Galaxy S8").get("suggestion") is None
+
+    def test_no_hit(self):
+        assert INDEX.search_model("Nokia 3310").get("hit") is None
+
+    def test_search_manufacturer(self):
+        assert INDEX.search_manufacturer("samsung")["hit"]["Manufacturer"] == "Samsung"
+        assert INDEX.search_manufacturer("Samsun")["suggestion"] == "samsung"
+
+    def test_exact_and_prefix(self):
+        assert INDEX.exact("galaxy s8+", "Model Name")["Model Name"] == "Galaxy S8"
+        assert INDEX.exact("Galaxy", "Model Name") is None
+        assert INDEX.prefix("Galaxy S1", "Model Name")["Model Name"] == "Galaxy S10"
+        assert INDEX.prefix("fire", "Model Name")["Model Name"] == "Fire HD 10"
+        assert INDEX.prefix("Nokia", "Model Name") is None
+
+    def test_load_json_lines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "devices.jsonl")
+            with open(path, "w") as file:
+                file.write('{"_source": {"Model Name": "iPad", "Manufacturer": "Apple"}}\n')
+                file.write('{"Model Name": "Pixel 6", "Manufacturer": "Google"}\n')
+            index = DeviceIndex.load(path)
+
+        assert len(index) == 2
+        assert index.search_model("ipad") == {"hit": {"Model Name": "iPad", "Manufacturer": "Apple"}}
+
+    def test_device_records(self):
+        source = {"Model Name": "Galaxy S8", "Manufacturer": "Samsung ".strip(), "Form Factor": "Phone",
+                  "Android SDK Versions": "26", "Release": 2017}
+        record = DeviceRecord.from_source(source)
+
+        assert record == source and record.to_dict() == source
+        assert record["Release"] == 2017
+        assert record.get("Color", "black") == "black"
+        assert record.is_android
+        assert record.manufacturer is INDEX.search_manufacturer("samsung")["hit"].manufacturer
+        with self.assertRaises(AttributeError):
+            record.__dict__
+
+    def test_records_keep_null_fields(self):
+        record = DeviceRecord.from_source({"Model Name": "iPad", "Android SDK Versions": None})
+
+        assert list(record) == ["Model Name", "Android SDK Versions"]
+        assert not record.is_android
+        with self.assertRaises(KeyError):
+            record["Manufacturer"]
+        assert INDEX.exact("iPad", "Model Name") is INDEX.search_model("iPad")["hit"]
+
@@ -1,6 +1,12 @@
-from unittest import TestCase
+import os
+from unittest import TestCase, IsolatedAsyncioTestCase, mock
 
-from actions.elastic import search_model, search_manufacturer
+from elasticsearch import RequestError, TransportError
+
+from actions import elastic
+from actions.config import reset_settings
+from actions.elastic import multi_search, search_model, search_manufacturer, search_model_async, \
+    search_manufacturer_async
 
 
 class Test(TestCase):
@@ -42,3 +48,185 @@ class Test(TestCase):
 
         assert result
         assert result['hit']['Manufacturer'] == "Apple"
+
+
+class TestAsync(IsolatedAsyncioTestCase):
+
+    async def test_search_model_async_ipad(self):
+        model_name = "iPad"
+        result = await search_model_async(model_name)
+
+        assert result
+        assert result['hit']['Model Name'] == model_name
+
+    async def test_search_manufacturer_async_apple(self):
+        manufacturer = "Apple"
+        result = await search_manufacturer_async(manufacturer)
+
+        assert result
+        assert result['hit']['Manufacturer'] == "Apple"
+
+    async def test_multi_search_uses_catalogue_index(self):
+        client = mock.Mock(msearch=mock.AsyncMock(return_value={"responses": [{}, {}]}))
+        with mock.patch("actions.elastic.get_async_client", return_value=client):
+            assert await multi_search([{"query": {}}, {"size": 1}]) == [{}, {}]
+
+        client.msearch.assert_awaited_once_with(body=[{"index": "supported_devices_v2"}, {"query": {}},
+                                                      {"index": "supported_devices_v2"}, {"size": 1}])
+
+    async def test_multi_search_uses_configured_alias(self):
+        client = mock.Mock(msearch=mock.AsyncMock(return_value={"responses": [{}]}))
+        with mock.patch.dict(os.environ, {"ELASTIC_INDEX": "devices"}), \
+                mock.patch("actions.elastic.get_async_client", return_value=client):
+            reset_settings()
+            try:
+                await multi_search([{"size": 1}])
+            finally:
+                reset_settings()
+
+        client.msearch.assert_awaited_once_with(body=[{"index": "devices"}, {"size": 1}])
+
+
+def search_response(hits=(), suggest=None):
+    return {"hits": {"total": {"value": len(hits), "relation": "eq"},
+                     "hits": [{"_index": "devices", "_id": str(i), "_source": hit} for i, hit in enumerate(hits)]},
+            "suggest": suggest or {}}
+
+
+IPHONE = {"Model Name": "iPhone 12", "Manufacturer": "Apple"}
+
+
+class TestTiered(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.patches = [mock.patch.dict(os.environ, {"ELASTIC_HOST": "http://elastic:9200", "ELASTIC_MODE": "remote",
+                                                     "ELASTIC_SEARCH_MODE": "tiered", "ELASTIC_BATCH_WINDOW": "0"}),
+                        mock.patch.object(elastic, "_search_cache", None)]
+        for patch in self.patches:
+            patch.start()
+        reset_settings()
+        self.client = mock.Mock(search=mock.AsyncMock(side_effect=self.respond))
+
+    def tearDown(self):
+        for patch in reversed(self.patches):
+            patch.stop()
+        reset_settings()
+
+    @staticmethod
+    def respond(index, body):
+        if "multi_match" in body["query"]:
+            suggest = {"model": [{"text": "iphone 21", "options": [{"text": "iphone 12", "score": 0.8}]}]}
+            return search_response(suggest=suggest)
+        query = body["query"]["match"]["Model Name.exact"]
+        options = [{"text": "iPhone 12", "_source": IPHONE}] if "iphone 12".startswith(query.lower()) else []
+        return search_response([IPHONE] if query.lower() == "iphone 12" else [],
+                               {"prefix": [{"text": query, "options": options}]})
+
+    async def lookup(self, model):
+        with mock.patch("actions.elastic.get_async_client", return_value=self.client):
+            return await search_model_async(model)
+
+    def bodies(self):
+        return [call.kwargs["body"] for call in self.client.search.await_args_list]
+
+    async def test_exact(self):
+        exact = elastic.CATALOGUE_LOOKUPS.value(kind="model", tier="exact")
+
+        assert await self.lookup("iphone 12") == {"hit": IPHONE}
+        assert len(self.bodies()) == 1
+        assert elastic.CATALOGUE_LOOKUPS.value(kind="model", tier="exact") == exact + 1
+
+    async def test_prefix(self):
+        prefix = elastic.CATALOGUE_LOOKUPS.value(kind="model", tier="prefix")
+
+        assert await self.lookup("iPhone 1") == {"hit": IPHONE}
+        body, = self.bodies()
+        assert body["suggest"]["prefix"]["completion"]["field"] == "Model Name.completion"
+        assert elastic.CATALOGUE_LOOKUPS.value(kind="model", tier="prefix") == prefix + 1
+
+    async def test_falls_back_to_full_text_search(self):
+        miss = elastic.CATALOGUE_LOOKUPS.value(kind="model", tier="miss")
+
+        assert await self.lookup("iphone 21") == {"suggestion": "iphone 12"}
+        fast, full = self.bodies()
+        assert "match" in fast["query"] and "multi_match" in full["query"]
+        assert elastic.CATALOGUE_LOOKUPS.value(kind="model", tier="miss") == miss + 1
+
+
+class TestBatched(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.patches = [mock.patch.dict(os.environ, {"ELASTIC_HOST": "http://elastic:9200", "ELASTIC_MODE": "remote",
+                                                     "ELASTIC_BATCH_WINDOW": "0.001", "ELASTIC_BACKOFF_BASE": "0"}),
+                        mock.patch.object(elastic, "_search_cache", None),
+                        mock.patch.object(elastic, "_batcher", None),
+                        mock.patch.object(elastic, "_circuit_breaker", None)]
+        for patch in self.patches:
+            patch.start()
+        reset_settings()
+
+    async def asyncTearDown(self):
+        await elastic.get_batcher().close()
+        for patch in reversed(self.patches):
+            patch.stop()
+        reset_settings()
+
+    async def test_rejected_search_falls_back_to_local_index(self):
+        rejected = {"error": {"type": "es_rejected_execution_exception", "status": 429}}
+        client = mock.Mock(msearch=mock.AsyncMock(return_value={"responses": [rejected]}))
+        with mock.patch("actions.elastic.get_async_client", return_value=client), \
+                mock.patch("actions.elastic.search_local", return_value={"hit": IPHONE}) as search_local:
+            assert await search_model_async("iPad") == {"hit": IPHONE}
+
+        search_local.assert_called_once_with("model", "iPad")
+        assert client.msearch.await_count == elastic.get_settings().elastic_retries
+        assert elastic.get_circuit_breaker().failures == elastic.get_settings().elastic_retries
+
+
+class TestUnavailable(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.patches = [mock.patch.dict(os.environ, {"ELASTIC_HOST": "http://elastic:9200", "ELASTIC_MODE": "remote",
+                                                     "ELASTIC_BATCH_WINDOW": "0", "ELASTIC_BACKOFF_BASE": "0"}),
+                        mock.patch.object(elastic, "_search_cache", None),
+                        mock.patch.object(elastic, "_circuit_breaker", None)]
+        for patch in self.patches:
+            patch.start()
+        reset_settings()
+
+    def tearDown(self):
+        for patch in reversed(self.patches):
+            patch.stop()
+        reset_settings()
+
+    async def test_overloaded_cluster_falls_back_to_local_index(self):
+        retries = elastic.get_settings().elastic_retries
+        for status in (429, 503):
+            with self.subTest(status=status):
+                elastic._circuit_breaker = None
+                error = TransportError(status, "unavailable", {})
+                client = mock.Mock(search=mock.AsyncMock(side_effect=error))
+                with mock.patch("actions.elastic.get_async_client", return_value=client), \
+                        mock.patch("actions.elastic.search_local", return_value={"hit": IPHONE}) as search_local:
+                    assert await search_model_async("iPad") == {"hit": IPHONE}
+
+                search_local.assert_called_once_with("model", "iPad")
+                assert client.search.await_count == retries
+                assert elastic.get_circuit_breaker().failures == retries
+
+    def test_overloaded_cluster_falls_back_to_local_index_sync(self):
+        with mock.patch("actions.elastic.execute", side_effect=TransportError(502, "bad gateway", {})) as execute, \
+                mock.patch("actions.elastic.search_local", return_value={"hit": IPHONE}):
+            assert search_manufacturer("Apple") == {"hit": IPHONE}
+
+        assert execute.call_count == elastic.get_settings().elastic_retries
+        assert elastic.get_circuit_breaker().failures == elastic.get_settings().elastic_retries
+
+    async def test_invalid_search_is_not_retried(self):
+        client = mock.Mock(search=mock.AsyncMock(side_effect=RequestError(400, "parsing_exception", {})))
+        with mock.patch("actions.elastic.get_async_client", return_value=client):
+            with self.assertRaises(RequestError):
+                await search_model_async("iPad")
+
+        assert client.search.await_count == 1
+        assert elastic.get_circuit_breaker().failures == 0
@@ -0,0 +1,81 @@
+import copy
+from pathlib import Path
+from unittest import TestCase, IsolatedAsyncioTestCase
+
+import yaml
+from rasa_sdk import Tracker
+from rasa_sdk.executor import CollectingDispatcher
+
+from actions.actions import ValidatePlaybackIssueForm
+from actions.form_plans import FormPlanError, get_form_plans, load_form_plans, parse_form_plans
+from tests.conftest import EMPTY_TRACKER
+
+ROOT = Path(__file__).parent.parent
+
+DEVICE = ["a_detailed_problem", "c_steps_to_reproduce", "model_name", "platform", "vendor", "os_name", "os_version",
+          "app_version"]
+
+PLAN = {
+    "version": 1,
+    "slot_groups": {"device": ["model_name", "vendor"]},
+    "issue_types": {"playback": ["device", "error_message"], "offline": ["video_content_id"]},
+    "always": ["email_contact"],
+    "web_skips": ["vendor"],
+}
+
+
+class Test(TestCase):
+
+    def test_plans_of_the_repository(self):
+        plans = load_form_plans(str(ROOT / "form_plans.yml"))
+
+        assert plans.plan("playback", False, False) == tuple(DEVICE + [
+            "video_content_type", "video_content_id", "video_interruptions", "connectivity", "error_message",
+            "email_contact"])
+        assert plans.plan("stream_interrupt", False, False) == tuple(DEVICE + [
+            "video_content_type", "video_content_id", "connectivity", "email_contact"])
+        assert plans.plan("offline", True, True) == ("confirm_slot", "video_interruptions", "video_content_id",
+                                                     "email_contact")
+
+    def test_plan_slots_exist_in_domain(self):
+        domain = yaml.safe_load((ROOT / "domain.yml").read_text(encoding="utf-8"))
+        plans = load_form_plans(str(ROOT / "form_plans.yml"))
+
+        assert set(plans.all_slots()) - set(domain["slots"]) == set()
+
+    def test_web_and_confirmation(self):
+        plans = parse_form_plans(PLAN)
+
+        assert plans.plan("playback", False, False) == ("model_name", "vendor", "error_message", "email_contact")
+        assert plans.plan("playback", True, False) == ("model_name", "error_message", "email_contact")
+        assert plans.plan("playback", True, True) == ("confirm_slot", "model_name", "error_message", "email_contact")
+
+    def test_unknown_issue_type_uses_domain_slots(self):
+        plans = parse_form_plans(PLAN)
+
+        plan = plans.plan("undefined", True, False, ["a_detailed_problem", "vendor", "email_contact"])
+
+        assert plan == ("a_detailed_problem", "email_contact")
+        assert plans.plan("undefined", True, False, ["a_detailed_problem", "vendor", "email_contact"]) is plan
+
+    def test_invalid_plans(self):
+        for change in [{"version": 2}, {"issue_types": {}}, {"issue_types": {"offline": "video_content_id"}},
+                       {"issue_types": {"playback": ["device", "vendor"]}}, {"web_skip": ["vendor"]},
+                       {"slot_groups": {"device": [None]}}]:
+            with self.assertRaises(FormPlanError, msg=change):
+                parse_form_plans(dict(copy.deepcopy(PLAN), **change))
+
+
+class TestRequiredSlots(IsolatedAsyncioTestCase):
+
+    async def required_slots(self, **slots):
+        state = copy.deepcopy(EMPTY_TRACKER.current_state())
+        state["slots"].update(slots)
+        return await ValidatePlaybackIssueForm().required_slots(["a_detailed_problem", "email_contact"],
+                                                                CollectingDispatcher(), Tracker.from_dict(state), {})
+
+    async def test_required_slots(self):
+        assert await self.required_slots(issue_type="offline") == list(get_form_plans().plan("offline", False, False))
+        confirming = await self.required_slots(issue_type="offline", platform="web", confirm_required=["model_name"])
+        assert confirming[0] == "confirm_slot"
+        assert await self.required_slots(issue_type="undefined") == ["a_detailed_problem", "email_contact"]
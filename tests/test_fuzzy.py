@@ -0,0 +1,47 @@
+import random
+from unittest import TestCase
+
+from thefuzz import fuzz
+
+from actions.fuzzy import FuzzyIndex, fuzzy_index, load_lookup_table
+from actions.util import android, ios
+
+
+class Test(TestCase):
+
+    def test_match_keeps_vocabulary_order(self):
+        index = FuzzyIndex(["samsung", "samsung galaxy", "samsong"])
+        assert index.match("samsong") == "samsung"
+        assert index.match("SAMSUNG") == "samsung"
+
+    def test_no_match_below_threshold(self):
+        index = FuzzyIndex(android)
+        assert index.match("nokia") is None
+        assert index.match("") is None
+        assert index.match(None) is None
+
+    def test_match_all_and_any(self):
+        index = FuzzyIndex(ios)
+        assert index.match_all(["my", "iphnoe", "Iphnoe"]) == [None, "iphone", "iphone"]
+        assert index.match_any(["Fire", "TV", "aple"]) == "apple"
+        assert index.match_any(["Fire", "TV"]) is None
+
+    def test_same_match_as_linear_scan(self):
+        rng = random.Random(7)
+        characters = "aabbcdeeio st1"
+        for threshold in (50, 70, 90):
+            words = ["".join(rng.choice(characters) for _ in range(rng.randint(0, 10))) for _ in range(200)]
+            index = FuzzyIndex(words, threshold)
+            for _ in range(50):
+                token = "".join(rng.choice(characters + "AB") for _ in range(rng.randint(1, 10)))
+                expected = next((word for word in words if fuzz.ratio(token.lower(), word.lower()) >= threshold), None)
+                assert index.match(token) == expected, token
+
+    def test_index_is_built_once_per_vocabulary(self):
+        assert fuzzy_index(ios) is fuzzy_index(list(ios))
+        assert fuzzy_index(ios) is not fuzzy_index(ios, threshold=80)
+
+    def test_load_lookup_table(self):
+        vendors = load_lookup_table("data/nlu/lookups/vendor.yml", "vendor")
+        assert "Samsung" in vendors
+        assert FuzzyIndex(vendors).match("Motorolla") == "Motorola"
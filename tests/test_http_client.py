@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+from unittest import TestCase, IsolatedAsyncioTestCase
+
+from actions import http_client
+from actions.config import get_settings
+
+
+class Test(TestCase):
+
+    def test_session_is_shared_and_pooled(self):
+        session = http_client.get_session()
+        assert http_client.get_session() is session
+
+        adapter = session.get_adapter("https://api.airtable.com/v0")
+        assert isinstance(adapter, http_client.TimeoutAdapter)
+        assert adapter._pool_maxsize == get_settings().http_pool_per_host
+
+    def test_clients_imported_on_first_use(self):
+        # Loading the actions must not import the HTTP clients, the spool or the elasticsearch packages
+        script = ("import sys, actions.actions; "
+                  "print(sorted({'aiohttp', 'requests', 'actions.spool', 'elasticsearch'} & set(sys.modules)))")
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.run([sys.executable, "-c", script], cwd=root, capture_output=True, text=True,
+                                check=True).stdout
+        assert output.strip() == "[]"
+
+
+class TestAsync(IsolatedAsyncioTestCase):
+
+    async def test_async_session_is_shared(self):
+        session = http_client.get_async_session()
+        try:
+            assert http_client.get_async_session() is session
+            assert session.connector.limit_per_host == get_settings().http_pool_per_host
+            assert session.timeout.sock_connect == get_settings().http_connect_timeout
+        finally:
+            await http_client.close()
+        assert session.closed
@@ -0,0 +1,119 @@
+import copy
+import io
+import json
+import os
+import tempfile
+from contextlib import redirect_stdout
+from unittest import IsolatedAsyncioTestCase, TestCase, mock
+
+from rasa_sdk import Tracker
+from rasa_sdk.executor import CollectingDispatcher
+
+from actions import incident_store
+from actions.actions import SubmitIncidentAction, ValidatePlaybackIssueForm
+from actions.config import reset_settings
+from actions.incident_store import IncidentStore, main, parse_time
+from actions.util import incident_fields
+from tests.conftest import EMPTY_TRACKER
+
+DAY = 86400
+
+
+def incident(platform="android", os_version="12", app_version="5.3", content_id="tagesschau"):
+    return incident_fields(problem="Video stoppt", expected="", steps="", platform=platform, model="Pixel 6",
+                           vendor="Google", os="Android", os_version=os_version, content_type="live",
+                           content_id=content_id, video_interrupt=True, app_version=app_version,
+                           connectivity="wifi", error_msg="", email="tester@example.org")
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "incidents.db")
+        self.store = IncidentStore(self.path)
+        for created, fields in [(0, incident()), (10, incident(app_version="5.4")), (DAY, incident()),
+                                (DAY + 10, incident(platform="ios", os_version="14.2")),
+                                (DAY + 20, incident(platform="Android"))]:
+            self.store.add(fields, created=created)
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_grouped_counts(self):
+        assert list(self.store.aggregate(["platform"], since=DAY)) == [{"platform": "android", "count": 2},
+                                                                      {"platform": "ios", "count": 1}]
+        assert list(self.store.aggregate(where={"os_version": "12", "app_version": "5.3"})) == [{"count": 3}]
+
+    def test_time_windows(self):
+        rows = list(self.store.aggregate(["app_version"], where={"platform": "android"}, window=DAY))
+
+        assert rows == [{"window": "1970-01-01T00:00:00+00:00", "app_version": "5.3", "count": 1},
+                        {"window": "1970-01-01T00:00:00+00:00", "app_version": "5.4", "count": 1},
+                        {"window": "1970-01-02T00:00:00+00:00", "app_version": "5.3", "count": 2}]
+
+    def test_filters_use_indexes(self):
+        plan = self.store._connection.execute(
+            "EXPLAIN QUERY PLAN SELECT COUNT(*) FROM incidents WHERE os_version = ? AND created >= ?",
+            ["12", 0]).fetchall()
+
+        assert "incidents_os_version" in " ".join(row[-1] for row in plan)
+
+    def test_incidents_without_email(self):
+        newest, = self.store.incidents(where={"platform": "ios"}, limit=1)
+
+        assert newest["os_version"] == "14.2"
+        assert newest["created"] == "1970-01-02T00:00:10+00:00"
+        assert "tester@example.org" not in json.dumps(newest)
+
+    def test_unknown_column(self):
+        with self.assertRaises(ValueError):
+            list(self.store.aggregate(["email"]))
+        with self.assertRaises(ValueError):
+            list(self.store.incidents(where={"1=1 OR platform": "ios"}))
+
+    def test_command_line(self):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            main(["--path", self.path, "count", "--group-by", "os_version", "--where", "platform=android",
+                  "--since", "1970-01-02"])
+
+        assert [json.loads(line) for line in output.getvalue().splitlines()] == [{"os_version": "12", "count": 2}]
+
+    def test_parse_time(self):
+        assert parse_time("24h", now=2 * DAY) == DAY
+        assert parse_time("1970-01-02T00:00:00+01:00") == DAY - 3600
+
+
+class TestSubmittedIncidents(IsolatedAsyncioTestCase):
+
+    async def test_stores_validated_slots(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "incidents.db")
+        form = ValidatePlaybackIssueForm()
+        dispatcher = CollectingDispatcher()
+        slots = {"platform": "android", "a_detailed_problem": "Video stoppt"}
+        slots.update(await form.validate_app_version("Version 5.3.1", dispatcher, EMPTY_TRACKER, {}))
+        slots.update(await form.validate_os_version("Android 12", dispatcher, EMPTY_TRACKER, {}))
+        assert isinstance(slots["app_version"], list)
+
+        state = copy.deepcopy(EMPTY_TRACKER.current_state())
+        state["slots"].update(slots)
+        state["latest_message"]["intent"] = {"name": "confirm"}
+        with mock.patch.dict(os.environ, {"INCIDENT_STORE_PATH": path}), \
+                mock.patch("actions.dedup.submit_deduplicated", mock.AsyncMock(return_value=True)):
+            reset_settings()
+            incident_store._store = None
+            try:
+                await SubmitIncidentAction().run(dispatcher, Tracker.from_dict(state), {})
+            finally:
+                incident_store._store.close()
+                incident_store._store = None
+                reset_settings()
+
+        store = IncidentStore(path, read_only=True)
+        self.addCleanup(store.close)
+        assert list(store.aggregate(["os_version"], where={"app_version": "5.3.1"})) == [
+            {"os_version": "12", "count": 1}]
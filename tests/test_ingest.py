@@ -0,0 +1,159 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import TestCase
+
+from elasticsearch.serializer import JSONSerializer
+
+from actions.ingest import IngestError, clean_document, ingest, read_documents
+
+DEVICES = Path(__file__).parent / "data" / "supported_devices.json"
+
+
+class Indices:
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, index, body):
+        self.client.indices_created.append(index)
+        self.client.settings[index] = dict(body["settings"])
+        self.client.documents[index] = []
+
+    def put_settings(self, index, body):
+        self.client.settings[index].update(body["index"])
+
+    def forcemerge(self, index, **kwargs):
+        pass
+
+    def refresh(self, index):
+        pass
+
+    def exists_alias(self, name):
+        return name in self.client.aliases
+
+    def get_alias(self, name):
+        return {index: {"aliases": {name: {}}} for index in self.client.aliases[name]}
+
+    def exists(self, index):
+        return index in self.client.documents
+
+    def get(self, index):
+        prefix = index.rstrip("*")
+        return {name: {} for name in self.client.documents if name.startswith(prefix)}
+
+    def delete(self, index, ignore_unavailable=False):
+        self.client.documents.pop(index, None)
+
+    def update_aliases(self, body):
+        self.client.alias_updates.append(body["actions"])
+        for action in body["actions"]:
+            if "remove" in action:
+                self.client.aliases[action["remove"]["alias"]].remove(action["remove"]["index"])
+            elif "remove_index" in action:
+                self.client.documents.pop(action["remove_index"]["index"])
+            else:
+                self.client.aliases.setdefault(action["add"]["alias"], []).append(action["add"]["index"])
+
+
+class Client:
+    """Answers the requests of the ingestion like a cluster, bulk requests fail for devices named "broken"."""
+
+    def __init__(self):
+        self.transport = SimpleNamespace(serializer=JSONSerializer())
+        self.indices = Indices(self)
+        self.indices_created = []
+        self.settings = {}
+        self.documents = {}
+        self.aliases = {}
+        self.alias_updates = []
+
+    def bulk(self, body, **kwargs):
+        lines = body.strip().split("\n")
+        items = []
+        for action, source in zip(lines[::2], lines[1::2]):
+            index = json.loads(action)["index"]["_index"]
+            document = json.loads(source)
+            if document["Model Name"] == "broken":
+                items.append({"index": {"status": 400, "error": {"type": "mapper_parsing_exception"}}})
+            else:
+                self.documents[index].append(document)
+                items.append({"index": {"status": 201}})
+        return {"errors": any(item["index"]["status"] >= 300 for item in items), "items": items}
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(content)
+        return path
+
+    def test_read_formats(self):
+        skipped = [0]
+        csv_path = self.write("devices.csv", "Manufacturer,Model Name,Form Factor\n"
+                                             "Apple , iPhone 12,Phone\nSamsung,,Phone\n")
+        lines_path = self.write("devices.jsonl",
+                                '\n{"_source": {"Model Name": "Galaxy S8"}}\n\n{"Model Name": "iPad"}\n')
+
+        assert list(read_documents(csv_path, skipped)) == [
+            {"Manufacturer": "Apple", "Model Name": "iPhone 12", "Form Factor": "Phone"}]
+        assert skipped == [1]
+        assert list(read_documents(lines_path, skipped)) == [{"Model Name": "Galaxy S8"}, {"Model Name": "iPad"}]
+        assert len(list(read_documents(str(DEVICES), skipped))) == 25
+
+    def test_clean_document(self):
+        assert clean_document({"Model Name": " Fire TV ", "Android SDK Versions": " "}) == {
+            "Model Name": "Fire TV", "Android SDK Versions": None}
+        assert clean_document({"Manufacturer": "Apple"}) is None
+
+    def test_replaces_index_named_like_the_alias(self):
+        client = Client()
+        client.documents["devices"] = [{"Model Name": "iPhone"}]
+        snapshot = os.path.join(self.directory, "snapshot.jsonl")
+
+        report = ingest(client, str(DEVICES), "devices", threads=2, chunk_size=10, snapshot=snapshot)
+
+        assert report.indexed == 25 and report.failed == 0
+        assert client.aliases == {"devices": [report.index]}
+        assert {"remove_index": {"index": "devices"}} in client.alias_updates[0]
+        assert len(client.documents[report.index]) == 25
+        assert client.settings[report.index]["refresh_interval"] == "1s"
+        assert client.settings[report.index]["number_of_replicas"] == 1
+        with open(snapshot, encoding="utf-8") as file:
+            assert len(file.readlines()) == 25
+
+    def test_swaps_alias_and_prunes_old_versions(self):
+        client = Client()
+        for old in ["devices_20200101000000", "devices_20210101000000"]:
+            client.documents[old] = []
+        client.aliases["devices"] = ["devices_20210101000000"]
+
+        report = ingest(client, str(DEVICES), "devices", keep=1)
+
+        assert client.alias_updates[0] == [{"remove": {"index": "devices_20210101000000", "alias": "devices"}},
+                                           {"add": {"index": report.index, "alias": "devices"}}]
+        assert sorted(client.documents) == ["devices_20210101000000", report.index]
+
+    def test_failed_ingestion_keeps_alias(self):
+        client = Client()
+        client.documents["devices_20210101000000"] = []
+        client.aliases["devices"] = ["devices_20210101000000"]
+        path = self.write("devices.jsonl", '{"Model Name": "iPhone"}\n{"Model Name": "broken"}\n')
+        snapshot = os.path.join(self.directory, "snapshot.jsonl")
+
+        with self.assertRaises(IngestError):
+            ingest(client, path, "devices", snapshot=snapshot)
+
+        assert client.aliases == {"devices": ["devices_20210101000000"]}
+        assert list(client.documents) == ["devices_20210101000000"]
+        assert not os.path.exists(snapshot)
+        assert not os.path.exists(snapshot + ".tmp")
+
+        report = ingest(client, path, "devices", max_errors=1)
+        assert (report.indexed, report.failed) == (1, 1)
@@ -0,0 +1,71 @@
+import gc
+import os
+import tempfile
+from unittest import IsolatedAsyncioTestCase, TestCase, mock
+
+from actions import elastic, form_plans, lifecycle, spool
+from actions.config import Settings, reset_settings
+
+
+class TestSettings(TestCase):
+
+    def test_local_mode_without_cluster(self):
+        assert Settings({}).elastic_mode == "local"
+        assert Settings({"ELASTIC_HOST": "https://elastic"}).elastic_mode == "remote"
+        assert Settings({"ELASTIC_HOST": "https://elastic", "ELASTIC_MODE": "local"}).elastic_mode == "local"
+
+    def test_warm_up_models(self):
+        assert Settings({"WARM_UP_MODELS": "iPad, Fire TV,"}).warm_up_models == ["iPad", "Fire TV"]
+        assert Settings({"WARM_UP_MODELS": ""}).warm_up_models == []
+
+
+class TestLifecycle(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.environ = mock.patch.dict(os.environ, {
+            "INCIDENT_SPOOL_PATH": os.path.join(self.directory.name, "incidents.spool"),
+            "ELASTIC_MODE": "local",
+        })
+        self.environ.start()
+        reset_settings()
+        spool._worker = None
+
+    async def asyncTearDown(self):
+        await lifecycle.shut_down()
+        spool._worker = None
+        self.environ.stop()
+        reset_settings()
+        self.directory.cleanup()
+
+    async def test_ready_after_warm_up(self):
+        assert not lifecycle.is_ready()
+
+        await lifecycle.warm_up()
+
+        assert lifecycle.is_ready()
+        readiness = lifecycle.readiness()
+        assert readiness["status"] == "ready"
+        assert readiness["checks"]["elasticsearch"] is True
+        assert readiness["checks"]["incident_spool"] is True
+        assert spool.get_worker().running
+
+    async def test_preload_reads_files_again(self):
+        self.addCleanup(gc.unfreeze)
+        plans, index = form_plans.get_form_plans(), elastic.get_local_index()
+
+        lifecycle.preload()
+
+        assert form_plans.get_form_plans() is not plans
+        assert elastic.get_local_index() is not index
+        assert len(elastic.get_local_index()) == len(index)
+        assert gc.get_freeze_count() > 0
+
+    async def test_worker_spools(self):
+        path = os.path.join(self.directory.name, "incidents.spool")
+
+        lifecycle.start_worker(2)
+
+        assert spool.get_worker().spool.path == path + ".2"
+        assert spool.worker_spool_path(path, 0) == path
+
@@ -0,0 +1,123 @@
+import io
+import json
+import logging
+import os
+from unittest import TestCase, mock
+
+from actions import logs
+from actions.config import Settings
+from actions.metrics import LOG_RECORDS_DROPPED
+from actions.tracing import trace_call
+
+
+def record(category=None, level=logging.INFO, name="actions.actions"):
+    extra = {"category": category} if category else {}
+    return logging.makeLogRecord(dict(extra, name=name, levelno=level, levelname=logging.getLevelName(level),
+                                      msg="message"))
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestFilter(TestCase):
+
+    def test_sampling(self):
+        sampling = logs.SamplingFilter({"slots": 0}, rate_limit=0)
+        dropped = LOG_RECORDS_DROPPED.value(category="slots", reason="sampled")
+
+        assert not sampling.filter(record("slots"))
+        assert sampling.filter(record("slots", level=logging.WARNING))
+        assert sampling.filter(record("catalogue"))
+        assert LOG_RECORDS_DROPPED.value(category="slots", reason="sampled") == dropped + 1
+
+    def test_rate_limit(self):
+        clock = Clock()
+        sampling = logs.SamplingFilter({}, rate_limit=2, clock=clock)
+
+        assert [sampling.filter(record("slots")) for _ in range(3)] == [True, True, False]
+        assert sampling.filter(record("catalogue"))
+        clock.now = 0.5
+        assert [sampling.filter(record("slots")) for _ in range(2)] == [True, False]
+
+    def test_category_defaults_to_logger_name(self):
+        assert logs.category_of(record(name="actions.elastic")) == "actions.elastic"
+        assert logs.category_of(record("slots")) == "slots"
+
+
+class TestPayload(TestCase):
+
+    def test_truncated(self):
+        assert str(logs.Payload({"model": "iPhone"})) == '{"model": "iPhone"}'
+        assert str(logs.Payload(["a" * 10], limit=5)) == '["aaa... (9 more characters)'
+
+
+class TestPipeline(TestCase):
+
+    def setUp(self):
+        self.root = logging.getLogger()
+        self.handlers, self.level = self.root.handlers[:], self.root.level
+        self.output = io.StringIO()
+
+    def tearDown(self):
+        logs.stop_logging()
+        self.root.handlers[:] = self.handlers
+        self.root.setLevel(self.level)
+
+    def configure(self, **environ):
+        environ = dict({"LOG_RATE_LIMIT": "0"}, **environ)
+        with mock.patch.dict(os.environ, environ):
+            logs.configure_logging(Settings(os.environ), logging.StreamHandler(self.output))
+
+    def lines(self):
+        logs.stop_logging()
+        return self.output.getvalue().splitlines()
+
+    def test_structured_records(self):
+        self.configure(LOG_FORMAT="json", LOG_LEVEL="DEBUG")
+        logger = logging.getLogger("actions.test")
+        logger.debug("Setting %s", logs.Payload({"model_name": "iPhone"}), extra=logs.SLOTS)
+        with mock.patch("actions.tracing.is_sampled", return_value=True), mock.patch("actions.tracing.write"), \
+                trace_call("action_test", "someone") as trace:
+            logger.warning("Traced")
+        try:
+            raise KeyError("missing")
+        except KeyError:
+            logger.exception("Failed")
+
+        first, second, third = [json.loads(line) for line in self.lines()]
+        assert first["message"] == 'Setting {"model_name": "iPhone"}'
+        assert first["category"] == "slots"
+        assert first["level"] == "DEBUG"
+        assert first["logger"] == "actions.test"
+        assert "trace_id" not in first
+        assert second["trace_id"] == trace.trace_id
+        assert "KeyError" in third["exception"]
+
+    def test_level_and_sampling(self):
+        self.configure(LOG_SAMPLE_RATES="slots=0")
+        logger = logging.getLogger("actions.test")
+        logger.debug("Debug")
+        payload = mock.MagicMock(spec=logs.Payload)
+        logger.info("Sampled out %s", payload, extra=logs.SLOTS)
+        logger.info("Written")
+
+        lines = self.lines()
+        assert len(lines) == 1
+        assert lines[0].endswith("INFO actions.test - Written")
+        payload.__str__.assert_not_called()
+
+    def test_full_queue_drops_records(self):
+        self.configure(LOG_QUEUE_SIZE="1")
+        logs._listener.stop()
+        dropped = LOG_RECORDS_DROPPED.value(category="actions.test", reason="queue_full")
+        logger = logging.getLogger("actions.test")
+        logger.info("Queued")
+        logger.info("Dropped")
+
+        assert LOG_RECORDS_DROPPED.value(category="actions.test", reason="queue_full") == dropped + 1
+        logs._listener = None
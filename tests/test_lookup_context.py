@@ -0,0 +1,130 @@
+import asyncio
+import copy
+from unittest import IsolatedAsyncioTestCase, mock
+
+from rasa_sdk import Tracker
+from rasa_sdk.executor import CollectingDispatcher
+
+from actions import actions, elastic
+from actions.device_index import DeviceRecord
+from actions.lookup_context import LookupContext, current_lookups, search_model, turn_lookups
+from tests.conftest import EMPTY_TRACKER
+
+DEVICES = {
+    "galaxy s8": {"Model Name": "Galaxy S8", "Manufacturer": "Samsung", "Android SDK Versions": "26"},
+    "samsung": {"Model Name": "Galaxy S7", "Manufacturer": "Samsung", "Android SDK Versions": "24"},
+    "apple": {"Model Name": "iPhone", "Manufacturer": "Apple"},
+}
+
+
+class FakeCatalogue:
+    def __init__(self, delay: float = 0.01):
+        self.delay = delay
+        self.queries = []
+        self.answered = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def search(self, query):
+        self.queries.append(query)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        self.answered.append(query)
+        hit = DEVICES.get(query.lower())
+        return {"hit": DeviceRecord.from_source(hit)} if hit else {}
+
+
+def tracker_with_slots(**slots):
+    state = copy.deepcopy(EMPTY_TRACKER.current_state())
+    state["events"] += [{"event": "slot", "name": name, "value": value} for name, value in slots.items()]
+    state["slots"].update(slots)
+    return Tracker.from_dict(state)
+
+
+class TestLookupContext(IsolatedAsyncioTestCase):
+
+    async def test_prefetched_lookups_run_concurrently(self):
+        catalogue = FakeCatalogue()
+        context = LookupContext(search_model=catalogue.search, search_manufacturer=catalogue.search)
+        context.prefetch_model("Galaxy S8")
+        context.prefetch_model("iPhone")
+
+        results = await asyncio.gather(context.search_model("galaxy s8"), context.search_model("iPhone"))
+
+        assert results[0]["hit"]["Model Name"] == "Galaxy S8"
+        assert catalogue.queries == ["Galaxy S8", "iPhone"]
+        assert catalogue.max_in_flight == 2
+
+    async def test_vendor_resolved_by_model_drops_its_query(self):
+        models, vendors = FakeCatalogue(), FakeCatalogue(delay=1)
+        context = LookupContext(search_model=models.search, search_manufacturer=vendors.search)
+        context.prefetch_model("Galaxy S8")
+        context.prefetch_manufacturer("Samsung")
+
+        result = await context.search_manufacturer("samsung")
+        await asyncio.sleep(0)
+
+        assert result["hit"]["Manufacturer"] == "Samsung"
+        assert result["hit"]["Android SDK Versions"] == "26"
+        # The vendor query ran alongside the model lookup and was cancelled once the model hit answered it
+        assert models.queries == ["Galaxy S8"] and vendors.queries == ["Samsung"]
+        assert vendors.answered == [] and vendors.in_flight == 0
+        assert context.reused == 1
+
+    async def test_vendor_resolved_by_finished_model_is_not_queried(self):
+        catalogue = FakeCatalogue()
+        context = LookupContext(search_model=catalogue.search, search_manufacturer=catalogue.search)
+        await context.search_model("Galaxy S8")
+
+        result = await context.search_manufacturer("samsung")
+
+        assert result["hit"]["Manufacturer"] == "Samsung"
+        assert catalogue.queries == ["Galaxy S8"]
+        assert context.reused == 1
+
+    async def test_other_vendor_is_queried(self):
+        catalogue = FakeCatalogue()
+        context = LookupContext(search_model=catalogue.search, search_manufacturer=catalogue.search)
+        context.prefetch_model("Galaxy S8")
+
+        result = await context.search_manufacturer("Apple")
+
+        assert result["hit"]["Manufacturer"] == "Apple"
+        assert catalogue.queries == ["Galaxy S8", "Apple"]
+
+    async def test_context_is_scoped_to_the_call(self):
+        catalogue = FakeCatalogue(delay=10)
+        with turn_lookups(search_model=catalogue.search, search_manufacturer=catalogue.search) as context:
+            assert current_lookups() is context
+            context.prefetch_model("iPhone")
+            await asyncio.sleep(0)
+        assert current_lookups() is None
+        await asyncio.sleep(0)
+        assert all(task.cancelled() for task in context._lookups.values())
+
+        with mock.patch.object(elastic, "search_model_async", FakeCatalogue(delay=0).search):
+            assert (await search_model("apple"))["hit"]["Manufacturer"] == "Apple"
+
+    async def test_form_validates_model_and_vendor_with_one_lookup(self):
+        model_catalogue = FakeCatalogue()
+        manufacturer_catalogue = FakeCatalogue(delay=1)
+        tracker = tracker_with_slots(model_name="Galaxy S8", vendor="Samsung", requested_slot="model_name")
+        form = actions.ValidatePlaybackIssueForm()
+        dispatcher = CollectingDispatcher()
+
+        with mock.patch.object(elastic, "search_model_async", model_catalogue.search), \
+                mock.patch.object(elastic, "search_manufacturer_async", manufacturer_catalogue.search), \
+                turn_lookups() as lookups:
+            actions.prefetch_lookups(lookups, tracker)
+            model = await form.validate_model_name("Galaxy S8", dispatcher, tracker, {})
+            vendor = await form.validate_vendor("Samsung", dispatcher, tracker, {})
+
+        assert model["vendor"] == "Samsung"
+        assert model["os_name"] == "android"
+        assert vendor == {"vendor": "Samsung", "os_name": "android"}
+        assert model_catalogue.queries == ["Galaxy S8"]
+        assert manufacturer_catalogue.answered == []
@@ -0,0 +1,74 @@
+from unittest import TestCase, IsolatedAsyncioTestCase
+
+from rasa_sdk import Action
+from rasa_sdk.executor import CollectingDispatcher
+
+from actions import metrics
+from actions.actions import AskForConfirmation, ValidatePlaybackIssueForm
+from actions.metrics import Counter, Histogram, Registry, instrumented
+from tests.conftest import EMPTY_TRACKER
+
+
+class Test(TestCase):
+
+    def test_histogram_renders_cumulative_buckets(self):
+        histogram = Histogram("latency_seconds", "Latency", ["action"], buckets=(0.1, 1))
+        histogram.observe(0.05, action="a")
+        histogram.observe(0.5, action="a")
+        histogram.observe(5, action="a")
+
+        lines = histogram.render()
+
+        assert 'latency_seconds_bucket{action="a",le="0.1"} 1' in lines
+        assert 'latency_seconds_bucket{action="a",le="1"} 2' in lines
+        assert 'latency_seconds_bucket{action="a",le="+Inf"} 3' in lines
+        assert 'latency_seconds_sum{action="a"} 5.55' in lines
+        assert 'latency_seconds_count{action="a"} 3' in lines
+
+    def test_counter_and_registry(self):
+        registry = Registry()
+        counter = registry.register(Counter("retries_total", "Retries", ["backend"]))
+        counter.inc(backend="airtable")
+        counter.inc(2, backend='air"table')
+
+        text = registry.render()
+
+        assert "# TYPE retries_total counter" in text
+        assert 'retries_total{backend="airtable"} 1' in text
+        assert 'retries_total{backend="air\\"table"} 2' in text
+        assert text.endswith("\n")
+
+
+class TestInstrumented(IsolatedAsyncioTestCase):
+
+    async def test_instrumented_action(self):
+        @instrumented
+        class Failing(Action):
+            def name(self):
+                return "action_failing_for_test"
+
+            async def run(self, dispatcher, tracker, domain):
+                raise ValueError()
+
+        with self.assertRaises(ValueError):
+            await Failing().run(None, None, None)
+
+        assert metrics.ACTION_DURATION.count(action="action_failing_for_test") == 1
+        assert metrics.ACTION_ERRORS.value(action="action_failing_for_test") == 1
+
+    async def test_validators_are_timed(self):
+        count = metrics.VALIDATOR_DURATION.count(action="validate_form_issue_playback", slot="os_version")
+
+        await ValidatePlaybackIssueForm().validate_os_version("14.2", CollectingDispatcher(), EMPTY_TRACKER, {})
+
+        assert metrics.VALIDATOR_DURATION.count(action="validate_form_issue_playback", slot="os_version") == count + 1
+
+    async def test_confirmations_are_counted(self):
+        count = metrics.CONFIRMATIONS.value(slot="os_name")
+        tracker = EMPTY_TRACKER.copy()
+        tracker.slots = dict(tracker.slots, confirm_required=["os_name"], os_name=["android", "ios"])
+
+        await AskForConfirmation().run(CollectingDispatcher(), tracker, {})
+
+        assert metrics.CONFIRMATIONS.value(slot="os_name") == count + 1
+        assert "bugbot_confirmations_total" in metrics.render()
@@ -0,0 +1,107 @@
+import asyncio
+from unittest import TestCase, IsolatedAsyncioTestCase
+
+from actions.resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded, RetriesExhausted, STATE_CLOSED, \
+    STATE_HALF_OPEN, STATE_OPEN, backoff_delay, call_with_retries, call_with_retries_sync, latency_budget, \
+    remaining_budget
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Flaky:
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError("unreachable")
+        return "ok"
+
+
+class Test(TestCase):
+
+    def test_backoff_delay(self):
+        assert backoff_delay(0, 0.1, 2, rng=lambda: 1) == 0.1
+        assert backoff_delay(3, 0.1, 2, rng=lambda: 1) == 0.8
+        assert backoff_delay(10, 0.1, 2, rng=lambda: 1) == 2
+        assert backoff_delay(3, 0.1, 2, rng=lambda: 0.5) == 0.4
+
+    def test_circuit_breaker_opens_and_recovers(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+        breaker.record_failure()
+        assert breaker.state == STATE_CLOSED
+        breaker.record_failure()
+        assert breaker.state == STATE_OPEN
+        assert not breaker.allow_request()
+
+        clock.now = 10
+        assert breaker.allow_request()
+        assert breaker.state == STATE_HALF_OPEN
+        assert not breaker.allow_request()
+
+        breaker.record_success()
+        assert breaker.state == STATE_CLOSED
+        assert breaker.allow_request()
+
+    def test_failed_trial_reopens_circuit(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+        breaker.record_failure()
+        clock.now = 10
+        assert breaker.allow_request()
+        breaker.record_failure()
+        assert breaker.state == STATE_OPEN
+        clock.now = 15
+        assert not breaker.allow_request()
+
+    def test_sync_retries(self):
+        action = Flaky(failures=2)
+        assert call_with_retries_sync(action, retry_on=(ConnectionError,), base_delay=0) == "ok"
+        assert action.calls == 3
+
+        with self.assertRaises(RetriesExhausted):
+            call_with_retries_sync(Flaky(failures=3), retry_on=(ConnectionError,), base_delay=0)
+
+    def test_open_circuit_short_circuits(self):
+        breaker = CircuitBreaker(failure_threshold=1)
+        action = Flaky(failures=5)
+        with self.assertRaises(CircuitOpenError):
+            call_with_retries_sync(action, retry_on=(ConnectionError,), base_delay=0, breaker=breaker)
+        assert action.calls == 1
+
+    def test_latency_budget(self):
+        assert remaining_budget() is None
+        with latency_budget(5):
+            assert 4 < remaining_budget() <= 5
+            with latency_budget(10):
+                assert remaining_budget() <= 5
+        assert remaining_budget() is None
+
+
+class TestAsync(IsolatedAsyncioTestCase):
+
+    async def test_async_retries(self):
+        flaky = Flaky(failures=1)
+
+        async def action():
+            return flaky()
+
+        assert await call_with_retries(action, retry_on=(ConnectionError,), base_delay=0) == "ok"
+        assert flaky.calls == 2
+
+    async def test_deadline_cancels_slow_call(self):
+        async def slow():
+            await asyncio.sleep(1)
+
+        with latency_budget(0.05):
+            with self.assertRaises(DeadlineExceeded):
+                await call_with_retries(slow, retry_on=(ConnectionError,), base_delay=0.1)
@@ -0,0 +1,65 @@
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Tuple
+from unittest import TestCase
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get(server: subprocess.Popen, port: int, path: str, timeout: float = 20):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=2) as response:
+                return response.status, json.loads(response.read())
+        except OSError:
+            assert server.poll() is None, f"Server exited with status {server.returncode}"
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+class Test(TestCase):
+    """Starts `python -m actions.server` the way the Docker image does."""
+
+    def start(self, *args: str) -> Tuple[subprocess.Popen, int]:
+        port = free_port()
+        env = dict(os.environ, SANIC_HOST="127.0.0.1")
+        server = subprocess.Popen([sys.executable, "-m", "actions.server", "--port", str(port), *args], cwd=ROOT,
+                                  env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+        def stop():
+            # The workers are in the process group of the server
+            os.killpg(server.pid, signal.SIGTERM)
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                os.killpg(server.pid, signal.SIGKILL)
+                server.wait()
+
+        self.addCleanup(stop)
+        return server, port
+
+    def test_single_process(self):
+        server, port = self.start("--workers", "1")
+
+        assert get(server, port, "/health") == (200, {"status": "ok"})
+        status, actions = get(server, port, "/actions")
+        assert status == 200 and {"name": "submit_incident"} in actions
+
+    def test_forked_workers(self):
+        server, port = self.start("--workers", "2")
+
+        assert get(server, port, "/health") == (200, {"status": "ok"})
@@ -0,0 +1,181 @@
+import asyncio
+import os
+import tempfile
+from unittest import TestCase, IsolatedAsyncioTestCase, mock
+
+from requests import HTTPError, Response
+
+from actions import spool
+from actions.resilience import CircuitBreaker, CircuitOpenError
+from actions.spool import IncidentSpool, SubmissionWorker, fold_updates
+
+
+def fields(number: int):
+    return {"Problem Statement": f"problem {number}"}
+
+
+class RecordingPoster:
+    def __init__(self, status_code: int = 200):
+        self.status_code = status_code
+        self.batches = []
+
+    def __call__(self, records):
+        if self.status_code != 200:
+            response = Response()
+            response.status_code = self.status_code
+            raise HTTPError(f"{self.status_code} error", response=response)
+        self.batches.append(records)
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "incidents.spool")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_pending_until_acknowledged(self):
+        spool = IncidentSpool(self.path)
+        first = spool.append(fields(1))
+        spool.append(fields(2))
+        spool.ack([first])
+
+        assert [record["fields"] for record in spool.pending()] == [fields(2)]
+
+    def test_replay_after_restart(self):
+        IncidentSpool(self.path).append(fields(1))
+
+        assert [record["fields"] for record in IncidentSpool(self.path).pending()] == [fields(1)]
+
+    def test_compact_keeps_pending_records(self):
+        spool = IncidentSpool(self.path)
+        first = spool.append(fields(1))
+        spool.compact()
+        assert len(spool.pending()) == 1
+
+        spool.ack([first])
+        spool.compact()
+        assert os.path.getsize(self.path) == 0
+
+    def test_skips_torn_writes(self):
+        spool = IncidentSpool(self.path)
+        spool.append(fields(1))
+        with open(self.path, "a") as file:
+            file.write('{"id": "abc", "fie')
+
+        assert len(spool.pending()) == 1
+
+
+def clustered(cluster: str, occurrences: int):
+    return {"Cluster": cluster, "Occurrences": occurrences}
+
+
+class TestFoldUpdates(TestCase):
+
+    def test_updates_folded_into_pending_record(self):
+        records = [{"id": "1", "fields": dict(fields(1), **clustered("a", 1))},
+                   {"id": "2", "fields": clustered("b", 3), "update": True},
+                   {"id": "3", "fields": clustered("a", 2), "update": True},
+                   {"id": "4", "fields": clustered("b", 4), "update": True}]
+
+        creates, updates = fold_updates(records, "Cluster")
+
+        assert [(record["fields"], record["covers"]) for record in creates] == [
+            (dict(fields(1), **clustered("a", 2)), ["1", "3"])]
+        assert [(record["fields"], record["covers"]) for record in updates] == [(clustered("b", 4), ["2", "4"])]
+        assert records[0]["fields"]["Occurrences"] == 1
+
+
+class TestWorker(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.spool = IncidentSpool(os.path.join(self.directory.name, "incidents.spool"))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    async def test_drain_in_batches(self):
+        for number in range(23):
+            self.spool.append(fields(number))
+        poster = RecordingPoster()
+        worker = SubmissionWorker(self.spool, post_batch=poster, batch_size=10, requests_per_second=0)
+
+        assert await worker.drain() == 23
+        assert [len(batch) for batch in poster.batches] == [10, 10, 3]
+        assert poster.batches[0][0] == fields(0)
+        assert self.spool.pending() == []
+
+    async def test_drain_with_async_poster(self):
+        self.spool.append(fields(1))
+        batches = []
+
+        async def post(records):
+            batches.append(records)
+
+        worker = SubmissionWorker(self.spool, post_batch=post, requests_per_second=0)
+
+        assert await worker.drain() == 1
+        assert batches == [[fields(1)]]
+
+    async def test_rejected_batch_is_dead_lettered(self):
+        self.spool.append(fields(1))
+        worker = SubmissionWorker(self.spool, post_batch=RecordingPoster(status_code=422), requests_per_second=0)
+
+        assert await worker.drain() == 0
+        assert self.spool.pending() == []
+        assert os.path.getsize(self.spool.dead_letter_path) > 0
+
+    async def test_updates_sent_after_records(self):
+        self.spool.append(dict(fields(1), **clustered("a", 1)))
+        self.spool.append(clustered("b", 2), update=True)
+        self.spool.append(clustered("a", 2), update=True)
+        records, updates = RecordingPoster(), RecordingPoster()
+        worker = SubmissionWorker(self.spool, post_batch=records, post_updates=updates, requests_per_second=0)
+
+        assert await worker.drain() == 3
+        assert records.batches == [[dict(fields(1), **clustered("a", 2))]]
+        assert updates.batches == [[clustered("b", 2)]]
+        assert self.spool.pending() == []
+
+    async def test_failures_open_the_circuit(self):
+        self.spool.append(fields(1))
+        breaker = CircuitBreaker(failure_threshold=2)
+        worker = SubmissionWorker(self.spool, post_batch=RecordingPoster(status_code=503), requests_per_second=0,
+                                  breaker=breaker)
+
+        with mock.patch("actions.resilience.backoff_delay", return_value=0), self.assertRaises(CircuitOpenError):
+            await worker.drain()
+        assert breaker.is_open
+        assert len(self.spool.pending()) == 1
+
+    async def test_open_circuit_pauses_draining(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=lambda: now[0])
+        breaker.record_failure()
+        worker = SubmissionWorker(self.spool, requests_per_second=0, flush_interval=0.01, breaker=breaker)
+        worker.drain = mock.AsyncMock(return_value=0)
+        worker.start()
+        try:
+            await asyncio.sleep(0.05)
+            worker.drain.assert_not_awaited()
+
+            now[0] = 30
+            await asyncio.sleep(0.05)
+            worker.drain.assert_awaited()
+        finally:
+            await worker.stop()
+
+    async def test_submit_incident_spools_and_wakes_worker(self):
+        worker = SubmissionWorker(self.spool, requests_per_second=0)
+        worker.drain = mock.AsyncMock(return_value=1)
+        with mock.patch.object(spool, "_worker", worker):
+            record_id = await spool.submit_incident(fields(1))
+            await asyncio.sleep(0.05)
+            try:
+                assert [record["id"] for record in self.spool.pending()] == [record_id]
+                worker.drain.assert_awaited_once()
+            finally:
+                await worker.stop()
@@ -0,0 +1,84 @@
+import json
+import os
+import tempfile
+from unittest import IsolatedAsyncioTestCase, mock
+
+from rasa_sdk import Action
+
+from actions import tracing
+from actions.config import reset_settings
+from actions.metrics import instrumented
+from actions.util import find_fuzzy_match, ios
+
+
+class Tracker:
+    def __init__(self, sender_id):
+        self.sender_id = sender_id
+
+
+@instrumented
+class TracedAction(Action):
+    def name(self):
+        return "action_traced_for_test"
+
+    async def run(self, dispatcher, tracker, domain):
+        with tracing.span("lookup", query="iphone"):
+            find_fuzzy_match("iphone", ios)
+        return []
+
+
+class TestTracing(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "traces.jsonl")
+        self.env = mock.patch.dict(os.environ, {"TRACE_PATH": self.path, "TRACE_SENDER_IDS": "slow-user"})
+        self.env.start()
+        reset_settings()
+
+    def tearDown(self):
+        self.env.stop()
+        reset_settings()
+
+    def traces(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as file:
+            return [json.loads(line) for line in file]
+
+    async def test_not_sampled(self):
+        await TracedAction().run(None, Tracker("someone"), {})
+        with tracing.span("outside"):
+            pass
+
+        assert self.traces() == []
+
+    async def test_forced_sender_id(self):
+        await TracedAction().run(None, Tracker("slow-user"), {})
+
+        trace, = self.traces()
+        assert trace["action"] == "action_traced_for_test"
+        assert trace["sender_id"] == "slow-user"
+        spans = {span["name"]: span for span in trace["spans"]}
+        assert spans["action_traced_for_test"]["parent"] is None
+        assert spans["lookup"]["parent"] == spans["action_traced_for_test"]["id"]
+        assert spans["lookup"]["attributes"] == {"query": "iphone"}
+        assert spans["fuzzy.match"]["parent"] == spans["lookup"]["id"]
+        assert "profile" not in trace
+
+    async def test_sample_rate_and_profile(self):
+        with mock.patch.dict(os.environ, {"TRACE_SAMPLE_RATE": "1", "TRACE_PROFILE": "true"}):
+            reset_settings()
+            await TracedAction().run(None, Tracker("someone"), {})
+
+        trace, = self.traces()
+        assert trace["profile"]
+        assert {"function", "calls", "total", "cumulative"} <= set(trace["profile"][0])
+
+    async def test_errors_are_recorded(self):
+        with self.assertRaises(KeyError):
+            with tracing.trace_call("action_failing", "slow-user"):
+                with tracing.span("inner"):
+                    raise KeyError()
+
+        trace, = self.traces()
+        assert [span["error"] for span in trace["spans"]] == ["KeyError", "KeyError"]
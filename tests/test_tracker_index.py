@@ -0,0 +1,106 @@
+import copy
+import json
+import os
+from unittest import TestCase, mock
+
+from rasa_sdk import Tracker
+
+from actions.actions import get_confidence_for_slot_value
+from actions.config import reset_settings
+from actions import tracker_index
+from actions.tracker_index import EntityConfidenceIndex, LatestEntityConfidences, confidence_index
+from actions.webhook import decode_action_call
+from tests.conftest import EMPTY_TRACKER
+
+
+def user_event(timestamp, *entities):
+    return {"event": "user", "timestamp": timestamp,
+            "parse_data": {"entities": [{"entity": name, "confidence_entity": confidence}
+                                        for name, confidence in entities]}}
+
+
+def tracker_with(*events):
+    state = copy.deepcopy(EMPTY_TRACKER.current_state())
+    state["events"] = state["events"] + list(events)
+    return Tracker.from_dict(state)
+
+
+class Test(TestCase):
+
+    def test_latest_confidence_wins(self):
+        events = [user_event(1, ("model_name", 0.5)), user_event(2, ("vendor", 0.7)),
+                  user_event(3, ("model_name", 0.95), ("model_name", 0.1))]
+        index = EntityConfidenceIndex().update(events)
+
+        assert index.confidence("model_name") == 0.95
+        assert index.confidence("vendor") == 0.7
+        assert index.confidence("os_name") == 1
+
+    def test_incremental_update(self):
+        events = [user_event(1, ("model_name", 0.5))]
+        index = EntityConfidenceIndex().update(events)
+        events.append({"event": "slot", "timestamp": 2, "name": "model_name", "value": "iPad"})
+        events.append(user_event(3, ("model_name", 0.8)))
+
+        assert index.update(events).confidence("model_name") == 0.8
+        assert index.event_count == 3
+
+    def test_rebuild_after_history_changed(self):
+        index = EntityConfidenceIndex().update([user_event(1, ("model_name", 0.5)), user_event(2)])
+        index.update([user_event(5)])
+
+        assert index.confidence("model_name") == 1
+
+    def test_reads_events_backwards_until_the_entity_is_found(self):
+        events = [user_event(1, ("vendor", 0.7)), user_event(2, ("model_name", 0.5)), user_event(3)]
+        index = LatestEntityConfidences(events)
+
+        assert index.confidence("model_name") == 0.5
+        assert "vendor" not in index.confidences
+        assert index.update([user_event(5)]).confidence("model_name") == 1
+
+    def test_confidence_for_slot_value(self):
+        tracker = tracker_with(user_event(10, ("model_name", 0.4)))
+        assert get_confidence_for_slot_value(tracker, "model_name") == 0.4
+        assert get_confidence_for_slot_value(EMPTY_TRACKER, "model_name") == 1
+
+    def test_index_is_shared_within_a_call(self):
+        tracker = tracker_with(user_event(10, ("model_name", 0.4)))
+        assert confidence_index(tracker) is confidence_index(tracker)
+
+    def test_cache_across_turns(self):
+        with mock.patch.dict(os.environ, {"CONFIDENCE_CACHE_SIZE": "10"}):
+            reset_settings()
+            tracker_index._cache = None
+            try:
+                first = confidence_index(tracker_with(user_event(10, ("model_name", 0.4))))
+                second_turn = tracker_with(user_event(10, ("model_name", 0.4)), user_event(11, ("vendor", 0.3)))
+                assert confidence_index(second_turn) is first
+                assert first.confidence("vendor") == 0.3
+            finally:
+                tracker_index._cache = None
+                reset_settings()
+
+    def test_cache_parses_only_new_lazy_events(self):
+        def lazy_tracker(*events):
+            state = copy.deepcopy(EMPTY_TRACKER.current_state())
+            state["events"] = list(events)
+            body = json.dumps({"tracker": state}).encode("utf-8")
+            return Tracker.from_dict(decode_action_call(body, lazy_events=True)["tracker"])
+
+        history = [user_event(turn, ("model_name", turn / 100)) for turn in range(1, 30)]
+        with mock.patch.dict(os.environ, {"CONFIDENCE_CACHE_SIZE": "10"}):
+            reset_settings()
+            tracker_index._cache = None
+            try:
+                first = confidence_index(lazy_tracker(*history))
+                second_turn = lazy_tracker(*history, user_event(30, ("vendor", 0.3)))
+                assert confidence_index(second_turn) is first
+                # The first and the last indexed event are compared, only the new one is scanned
+                assert second_turn.events.parsed == 3
+                assert first.confidence("vendor") == 0.3
+                assert first.confidence("os_name") == 1
+                assert second_turn.events.parsed == 3
+            finally:
+                tracker_index._cache = None
+                reset_settings()
@@ -1,7 +1,7 @@
 from unittest import TestCase
 
 from actions.util import create_incident_report, match_app_version, is_valid_os_name, find_fuzzy_match, ios, android, \
-    sanitize, match_os_version
+    sanitize, match_os_version, parse_versions
 
 
 class Test(TestCase):
@@ -42,6 +42,17 @@ class Test(TestCase):
         assert match_os_version("5.10") is None
         assert match_os_version("10")
 
+    def test_parse_versions(self):
+        info = parse_versions(["Android 10", "App 5.3.1"])
+        assert info.app_versions == ["5.3.1"]
+        assert info.os_versions is None
+        assert info.os_names == ["Android 10"]
+
+        info = parse_versions("iOS 14.2")
+        assert info.app_versions == []
+        assert info.os_versions == ["14.2"]
+        assert info.os_names == ["iOS 14.2"]
+
     def test_is_valid_os_name(self):
         self.assertTrue(is_valid_os_name("Android 10"))
         self.assertTrue(is_valid_os_name("iOS 3"))
@@ -1,3 +1,5 @@
+from unittest import mock
+
 import pytest
 
 from actions import actions
@@ -17,3 +19,21 @@ async def test_validate_model_name_iphone(dispatcher, domain):
     }
 
     assert result == expected_result
+
+
+@pytest.mark.asyncio
+async def test_validate_model_name_without_hit(dispatcher, domain):
+    action = actions.ValidatePlaybackIssueForm()
+    with mock.patch("actions.actions.search_model", mock.AsyncMock(return_value={})):
+        result = await action.validate_model_name("", dispatcher, EMPTY_TRACKER, domain)
+
+    assert result == {"model_name": "", "os_name": None, "platform": None, "vendor": None}
+
+
+@pytest.mark.asyncio
+async def test_validate_vendor_without_hit(dispatcher, domain):
+    action = actions.ValidatePlaybackIssueForm()
+    with mock.patch("actions.actions.search_manufacturer", mock.AsyncMock(return_value={})):
+        result = await action.validate_vendor("Nokia", dispatcher, EMPTY_TRACKER, domain)
+
+    assert result == {"vendor": "Nokia"}
@@ -0,0 +1,177 @@
+import copy
+import json
+import os
+import tempfile
+from unittest import IsolatedAsyncioTestCase, TestCase, mock
+
+import orjson
+from rasa_sdk import Action, Tracker
+from rasa_sdk.events import SlotSet
+from rasa_sdk.executor import ActionExecutor
+
+from actions.config import reset_settings
+from actions.tracker_index import confidence_index
+from actions.webhook import LazyEvents, decode_action_call, handle_webhook
+from tests.conftest import EMPTY_TRACKER
+
+
+def user_event(timestamp, text, *entities):
+    return {"event": "user", "timestamp": timestamp, "text": text,
+            "parse_data": {"intent": {"name": "inform", "confidence": 0.9},
+                           "entities": [{"entity": name, "value": text, "confidence_entity": confidence}
+                                        for name, confidence in entities]},
+            "metadata": {}}
+
+
+def conversation(turns=50):
+    events = [{"event": "action", "timestamp": 0, "name": "action_listen"}]
+    for turn in range(turns):
+        events.append(user_event(turn + 0.1, f"Mein iPhone {turn}", ("model_name", 0.5 + turn / 1000)))
+        events.append({"event": "slot", "timestamp": turn + 0.2, "name": "model_name", "value": [f"iPhone {turn}"]})
+        events.append({"event": "action", "timestamp": turn + 0.3, "name": "action_listen"})
+    return events
+
+
+def action_call(events, **tracker):
+    state = copy.deepcopy(EMPTY_TRACKER.current_state())
+    state.update(tracker, events=events)
+    return {"next_action": "action_latest_model", "sender_id": state["sender_id"], "tracker": state,
+            "domain": {"slots": {"model_name": {"type": "list"}}}, "version": "2.8.0"}
+
+
+def encode(call):
+    return json.dumps(call, ensure_ascii=False).encode("utf-8")
+
+
+def decode_lazily(body):
+    return decode_action_call(body, lazy_events=True)
+
+
+class ActionLatestModel(Action):
+
+    def name(self):
+        return "action_latest_model"
+
+    def run(self, dispatcher, tracker, domain):
+        confidence = confidence_index(tracker).confidence("model_name")
+        return [SlotSet("model_name", f"{tracker.events[-2]['value'][0]} ({confidence})")]
+
+
+class Test(TestCase):
+
+    def test_parses_events_from_the_end_on_demand(self):
+        events = conversation()
+        decoded = decode_lazily(encode(action_call(events)))
+        lazy = decoded["tracker"]["events"]
+
+        assert isinstance(lazy, LazyEvents)
+        assert len(lazy) == len(events)
+        assert lazy.parsed == 1
+        assert lazy[-2] == events[-2]
+        assert lazy.parsed == 2
+        assert lazy[3:5] == events[3:5]
+        assert lazy == events
+        assert decoded == dict(action_call(events), tracker=dict(action_call(events)["tracker"], events=lazy))
+
+    def test_latest_confidence_reads_only_recent_events(self):
+        tracker = Tracker.from_dict(decode_lazily(encode(action_call(conversation())))["tracker"])
+
+        assert confidence_index(tracker).confidence("model_name") == 0.549
+        assert tracker.events.parsed == 3
+
+    def test_appended_and_copied_events(self):
+        events = conversation(3)
+        tracker = Tracker.from_dict(decode_lazily(encode(action_call(events)))["tracker"])
+        slot = {"event": "slot", "timestamp": 9, "name": "vendor", "value": "Apple"}
+
+        tracker.add_slots([slot])
+        copied = tracker.copy()
+
+        assert tracker.events.parsed == 2
+        assert list(reversed(tracker.events)) == list(reversed(events + [slot]))
+        assert copied.events == events + [slot]
+        del tracker.events[0]
+        assert tracker.events == events[1:] + [slot]
+
+    def test_nested_event_objects_parse_all_events(self):
+        events = conversation(2)
+        events[1]["metadata"] = {"event": "message", "thread": [{"ts": 1}, {"event": "reply"}]}
+        decoded = decode_lazily(encode(action_call(events)))
+
+        assert not isinstance(decoded["tracker"]["events"], LazyEvents)
+        assert decoded["tracker"]["events"] == events
+
+    def test_event_objects_in_metadata_of_any_event(self):
+        # As many separators as further objects starting with "event", so counting them does not tell
+        for position in range(4):
+            with self.subTest(position=position):
+                events = conversation(1)
+                events[position]["metadata"] = {"x": [{"a": 1}, {"event": "z"}]}
+                body = encode(action_call(events))
+                decoded = decode_lazily(body)
+
+                assert len(decoded["tracker"]["events"]) == 4
+                assert list(reversed(decoded["tracker"]["events"])) == list(reversed(events))
+                assert decoded == orjson.loads(body)
+
+    def test_events_array_of_a_slot(self):
+        events = conversation(2)
+        slots = dict(EMPTY_TRACKER.current_state()["slots"], events=[{"event": "user"}])
+        decoded = decode_lazily(encode(action_call(events, slots=slots)))
+
+        assert decoded["tracker"]["slots"]["events"] == [{"event": "user"}]
+        assert decoded["tracker"]["events"] == events
+
+    def test_without_lazy_events(self):
+        call = action_call(conversation(2))
+        assert decode_action_call(encode(call), lazy_events=False) == call
+        assert decode_lazily(encode(action_call([]))) == action_call([])
+
+
+class TestWebhook(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.executor = ActionExecutor()
+        self.executor.register_action(ActionLatestModel())
+
+    async def test_runs_action(self):
+        for lazy_events in ("false", "true"):
+            environment = {"WEBHOOK_LAZY_EVENTS": lazy_events}
+            with self.subTest(lazy_events=lazy_events), mock.patch.dict(os.environ, environment):
+                reset_settings()
+                try:
+                    result = await handle_webhook(self.executor, encode(action_call(conversation())))
+                finally:
+                    reset_settings()
+
+                assert result.status == 200
+                assert orjson.loads(result.body)["events"] == [
+                    {"event": "slot", "timestamp": None, "name": "model_name", "value": "iPhone 49 (0.549)"}]
+
+    async def test_invalid_requests(self):
+        invalid = await handle_webhook(self.executor, b"{\"next_action\": ")
+        unknown = await handle_webhook(self.executor, encode(dict(action_call([]), next_action="action_unknown")))
+
+        assert invalid.status == 400
+        assert unknown.status == 404
+        assert orjson.loads(unknown.body)["action_name"] == "action_unknown"
+
+    async def test_traces_decoding(self):
+        path = os.path.join(tempfile.mkdtemp(), "traces.jsonl")
+        call = action_call(conversation(turns=5), sender_id="slow-user")
+        with mock.patch.dict(os.environ, {"TRACE_PATH": path, "TRACE_SENDER_IDS": "slow-user"}):
+            reset_settings()
+            try:
+                result = await handle_webhook(self.executor, encode(call))
+            finally:
+                reset_settings()
+
+        assert result.status == 200
+        with open(path) as file:
+            trace = json.loads(file.read())
+        spans = {span["name"]: span for span in trace["spans"]}
+        assert trace["action"] == "action_latest_model"
+        assert spans["webhook.decode"]["attributes"] == {"bytes": len(encode(call)),
+                                                        "events": len(call["tracker"]["events"])}
+        assert spans["webhook.decode"]["start"] == 0
+        assert spans["webhook.encode"]["parent"] == spans["action_latest_model"]["id"]
@@ -0,0 +1,145 @@
+import asyncio
+import os
+import tempfile
+import time
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from actions.workers import Supervisor, send_heartbeats
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.starts = os.path.join(self.directory.name, "starts")
+        self.supervisor = None
+
+    def tearDown(self):
+        if self.supervisor is not None:
+            self.supervisor.stop()
+        self.directory.cleanup()
+
+    def record_start(self, number):
+        with open(self.starts, "a") as file:
+            file.write(f"{number} {os.getpid()}\n")
+
+    def started(self):
+        if not os.path.exists(self.starts):
+            return []
+        with open(self.starts) as file:
+            return [tuple(map(int, line.split())) for line in file]
+
+    def serve(self, number, heartbeat):
+        self.record_start(number)
+        self.beat(heartbeat)
+
+    @staticmethod
+    def beat(heartbeat):
+        while True:
+            os.write(heartbeat, b".")
+            time.sleep(0.05)
+
+    def poll_until(self, condition, seconds=5):
+        deadline = time.monotonic() + seconds
+        while not condition():
+            assert time.monotonic() < deadline, "condition not reached"
+            self.supervisor.poll(0.05)
+
+    def test_starts_workers_once_preloaded(self):
+        preloaded = []
+        self.supervisor = Supervisor(self.serve, 2, preload=lambda: preloaded.append(True))
+
+        self.supervisor.start()
+        self.poll_until(self.supervisor.ready)
+
+        assert preloaded == [True]
+        assert sorted(number for number, _ in self.started()) == [0, 1]
+        assert sorted(pid for _, pid in self.started()) == self.supervisor.pids
+
+    def test_restarts_failed_worker(self):
+        def serve(number, heartbeat):
+            self.record_start(number)
+            if len(self.started()) == 1:
+                raise RuntimeError("broken")
+            self.beat(heartbeat)
+
+        self.supervisor = Supervisor(serve, 1, restart_delay=0.1)
+        self.supervisor.start()
+        self.poll_until(self.supervisor.ready)
+
+        (_, first), (number, second) = self.started()
+        assert number == 0
+        assert self.supervisor.pids == [second] != [first]
+
+    def test_kills_worker_without_heartbeat(self):
+        def serve(number, heartbeat):
+            self.record_start(number)
+            if len(self.started()) == 1:
+                time.sleep(30)
+            self.beat(heartbeat)
+
+        self.supervisor = Supervisor(serve, 1, timeout=0.5, restart_delay=0.1)
+        self.supervisor.start()
+        self.poll_until(self.supervisor.ready)
+
+        assert len(self.started()) == 2
+
+    def test_graceful_restart_replaces_workers(self):
+        preloaded = []
+        self.supervisor = Supervisor(self.serve, 2, preload=lambda: preloaded.append(True))
+        self.supervisor.start()
+        self.poll_until(self.supervisor.ready)
+        previous = self.supervisor.pids
+
+        self.supervisor.reload()
+        self.poll_until(lambda: self.supervisor.ready() and not set(previous) & set(self.supervisor.pids))
+
+        assert len(preloaded) == 2
+        assert sorted(number for number, _ in self.started()) == [0, 0, 1, 1]
+
+    def test_failed_preload_keeps_workers(self):
+        def preload():
+            if self.supervisor.pids:
+                raise ValueError("invalid catalogue")
+
+        self.supervisor = Supervisor(self.serve, 1, preload=preload)
+        self.supervisor.start()
+        self.poll_until(self.supervisor.ready)
+        previous = self.supervisor.pids
+
+        self.supervisor.reload()
+        self.supervisor.poll(0.1)
+
+        assert self.supervisor.pids == previous
+
+    def test_stop(self):
+        self.supervisor = Supervisor(self.serve, 2)
+        self.supervisor.start()
+        pids = self.supervisor.pids
+
+        self.supervisor.stop()
+
+        assert self.supervisor.pids == []
+        for pid in pids:
+            with self.assertRaises(ChildProcessError):
+                os.waitpid(pid, os.WNOHANG)
+
+
+class TestHeartbeats(IsolatedAsyncioTestCase):
+
+    async def test_only_while_healthy(self):
+        read, write = os.pipe()
+        healthy = [False]
+        task = asyncio.ensure_future(send_heartbeats(write, interval=0.01, is_healthy=lambda: healthy[0]))
+        await asyncio.sleep(0.05)
+        os.set_blocking(read, False)
+        with self.assertRaises(BlockingIOError):
+            os.read(read, 10)
+
+        healthy[0] = True
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+        assert os.read(read, 100).startswith(b"..")
+        os.close(read)
+        os.close(write)